@@ -1,4 +1,5 @@
 import os
+import time
 from argparse import ArgumentParser
 
 import torch
@@ -12,6 +13,8 @@ import random
 
 from src.autoencoder.components import Encoder, Decoder #here's the diff.
 from src.utils.data_helper import UnlabeledDataset
+from src.utils.helper import split_scenes
+from src.utils.execution import apply_exec_mode, exec_context, add_exec_mode_args
 
 random.seed(20200505)
 np.random.seed(20200505)
@@ -25,9 +28,15 @@ class BasicAE(LightningModule):
         self.hparams = hparams
 
         self.encoder = self.init_encoder(self.hidden_dim, self.latent_dim,
-                                         self.in_channels, self.input_height, self.input_width)
+                                         self.in_channels, self.input_height, self.input_width, self.agnostic_pool)
         self.decoder = self.init_decoder(self.hidden_dim, self.latent_dim,
                                          self.in_channels, self.output_height, self.output_width)
+        self.encoder.checkpoint = self.ckpt_encoder
+
+        # precision / memory format the forward pass runs in
+        apply_exec_mode(self, self.exec_mode)
+
+        self.fit_start_time = None
 
     def __check_hparams(self, hparams):
         self.hidden_dim = hparams.hidden_dim if hasattr(hparams, 'hidden_dim') else 128
@@ -41,9 +50,20 @@ class BasicAE(LightningModule):
 
         self.batch_size = hparams.batch_size if hasattr(hparams, 'batch_size') else 16
         self.in_channels = hparams.in_channels if hasattr(hparams, 'in_channels') else 3
-
-    def init_encoder(self, hidden_dim, latent_dim, in_channels, input_height, input_width):
-        encoder = Encoder(hidden_dim, latent_dim, in_channels, input_height, input_width)
+        self.ckpt_encoder = hparams.ckpt_encoder if hasattr(hparams, 'ckpt_encoder') else False
+        self.exec_mode = hparams.exec_mode if hasattr(hparams, 'exec_mode') else 'fp32'
+
+        # resolution agnostic encoder path + progressive resolution schedule, e.g. '0:0.25,2:0.5,4:1'
+        agnostic_pool = hparams.agnostic_pool if hasattr(hparams, 'agnostic_pool') else None
+        self.agnostic_pool = tuple(int(s) for s in agnostic_pool.split(',')) if agnostic_pool else None
+        schedule = hparams.progressive_schedule if hasattr(hparams, 'progressive_schedule') else None
+        self.progressive_schedule = sorted((int(e), float(r)) for e, r in
+                                           (stage.split(':') for stage in schedule.split(','))) if schedule else []
+        if self.progressive_schedule and self.agnostic_pool is None:
+            raise ValueError('--progressive_schedule needs --agnostic_pool, fc1 is tied to the input size otherwise')
+
+    def init_encoder(self, hidden_dim, latent_dim, in_channels, input_height, input_width, pool_size=None):
+        encoder = Encoder(hidden_dim, latent_dim, in_channels, input_height, input_width, pool_size)
         return encoder
 
     def init_decoder(self, hidden_dim, latent_dim, in_channels, output_height, output_width):
@@ -75,18 +95,49 @@ class BasicAE(LightningModule):
     def forward(self, z):
         return self.decoder(z)
 
+    @torch.no_grad()
+    def predict(self, sample, road_image=None):
+        # sample: [b, 6, 3, 256, 306] -> latent: [b, latent_dim], no camera blacked out at inference
+        x = sample[:, [0, 1, 2, 5, 4, 3]]
+        b, num_imgs, c, h, w = x.size()
+        x = x.permute(0, 2, 3, 1, 4).reshape(b, c, h, -1)
+
+        with exec_context(self.exec_mode):
+            z = self.encoder(x)
+        return {'latent': z.float()}
+
+    def input_scale(self, step_name):
+        # fraction of the full 256 x 1836 resolution this training step runs at, validation is always full res
+        scale = 1.
+        if step_name == 'train':
+            for epoch, stage_scale in self.progressive_schedule:
+                if self.current_epoch >= epoch:
+                    scale = stage_scale
+        return scale
+
     def _run_step(self, batch, batch_idx, step_name):
         x, y = self.six_to_one_task(batch)
 
-        # Encode - z has dim batch_size x latent_dim
-        z = self.encoder(x)
+        scale = self.input_scale(step_name)
+        if scale != 1:
+            x = F.interpolate(x, scale_factor=scale, mode='bilinear', align_corners=False)
 
-        # Decode - y_hat has same dim as true y
-        y_hat = self(z)
+        with exec_context(self.exec_mode):
+            # Encode - z has dim batch_size x latent_dim
+            z = self.encoder(x)
+
+            # Decode - y_hat has same dim as true y
+            y_hat = self(z)
+        y_hat = y_hat.float()
 
         if batch_idx % self.hparams.output_img_freq == 0:
             self._log_images(y, y_hat, step_name)
 
+        # the decoder still outputs a full res camera, compare at the resolution the input was seen at
+        if scale != 1:
+            y = F.interpolate(y, scale_factor=scale, mode='area')
+            y_hat = F.interpolate(y_hat, scale_factor=scale, mode='area')
+
         # consider replacing this reconstruction loss with something else
         loss = F.mse_loss(y, y_hat)
 
@@ -114,21 +165,25 @@ class BasicAE(LightningModule):
     def validation_epoch_end(self, outputs):
         avg_val_loss = torch.stack([x['val_loss'] for x in outputs]).mean()
         val_tensorboard_logs = {'avg_val_loss': avg_val_loss}
+
+        # wall clock since fit started, plot avg_val_loss against this for time-to-loss
+        if self.fit_start_time is not None:
+            val_tensorboard_logs['train_time_sec'] = torch.tensor(time.time() - self.fit_start_time)
         return {'val_loss': avg_val_loss, 'log': val_tensorboard_logs}
 
+    def on_train_start(self):
+        self.fit_start_time = time.time()
+
     def configure_optimizers(self):
             return torch.optim.Adam(self.parameters(), lr=self.hparams.learning_rate)
 
     def prepare_data(self):
         image_folder = self.hparams.link
         unlabeled_scene_index = np.arange(106)
-        trainset_size = round(0.8 * len(unlabeled_scene_index))
 
         # split into train / validation sets at the scene index level
         # before I did this at the sample level --> this will cause leakage (!!)
-        np.random.shuffle(unlabeled_scene_index)
-        train_set_index = unlabeled_scene_index[:trainset_size]
-        valid_set_index = unlabeled_scene_index[trainset_size:]
+        train_set_index, valid_set_index = split_scenes(unlabeled_scene_index)
 
         transform = torchvision.transforms.ToTensor()
 
@@ -148,14 +203,14 @@ class BasicAE(LightningModule):
         loader = torch.utils.data.DataLoader(self.unlabeled_trainset,
                                              batch_size=self.batch_size,
                                              shuffle=True,
-                                             num_workers=4)
+                                             num_workers=self.hparams.num_workers if hasattr(self.hparams, 'num_workers') else 4)
         return loader
 
     def val_dataloader(self):
         loader = torch.utils.data.DataLoader(self.unlabeled_validset,
                                              batch_size=self.batch_size,
                                              shuffle=False,
-                                             num_workers=4)
+                                             num_workers=self.hparams.num_workers if hasattr(self.hparams, 'num_workers') else 4)
         return loader
 
     @staticmethod
@@ -178,7 +233,17 @@ class BasicAE(LightningModule):
         parser.add_argument('--link', type=str, default='/scratch/ab8690/DLSP20Dataset/data')
         #parser.add_argument('--link', type=str, default='/Users/annika/Developer/driving-dirty/data')
         parser.add_argument('--output_img_freq', type=int, default=500)
-        
+
+        # activation checkpointing, trades recompute in backward for a smaller memory footprint
+        parser.add_argument('--ckpt_encoder', default=False, action='store_true')
+        parser = add_exec_mode_args(parser)
+
+        # progressive resolution pretraining
+        parser.add_argument('--agnostic_pool', type=str, default=None,
+                            help="'h,w' grid the c3 features are pooled to, e.g. '16,114'; needed by --progressive_schedule")
+        parser.add_argument('--progressive_schedule', type=str, default=None,
+                            help="'epoch:scale,...' input resolution per epoch range, e.g. '0:0.25,2:0.5,4:1'")
+
         return parser
 
 
@@ -2,19 +2,23 @@ import torch
 from torch import nn
 from torch.nn import functional as F
 
+from src.utils.activation_checkpoint import maybe_checkpoint
+
 
 class Encoder(torch.nn.Module):
     """
     Takes as input an image, uses a CNN to extract features which
     get split into a mu and sigma vector
     """
-    def __init__(self, hidden_dim, latent_dim, in_channels, input_height, input_width):
+    def __init__(self, hidden_dim, latent_dim, in_channels, input_height, input_width, pool_size=None):
         super().__init__()
         self.hidden_dim = hidden_dim
         self.latent_dim = latent_dim
         self.input_height = input_height
         self.input_width = input_width
         self.in_channels = in_channels
+        # (h, w): c3 features are adaptive pooled to this grid, so fc1 no longer depends on the input size
+        self.pool_size = pool_size
 
         self.c1 = nn.Conv2d(in_channels, 32, kernel_size=3, padding=1)
         self.c2 = nn.Conv2d(32, 32, kernel_size=3, padding=1)
@@ -29,22 +33,37 @@ class Encoder(torch.nn.Module):
         self.fc_z_out = nn.Linear(hidden_dim, latent_dim)
 
         self.c3_only = False
+        # recompute the full resolution conv activations during backward instead of storing them
+        self.checkpoint = False
 
     def _calculate_output_dim(self, in_channels, input_height, input_width, pooling_size):
+        if self.pool_size is not None:
+            return 32 * self.pool_size[0] * self.pool_size[1]
         x = torch.rand(1, in_channels, input_height, input_width)
         x = self.c3(self.c2(self.c1(x)))
         x = x.view(-1).unsqueeze(0).unsqueeze(0)
         x = F.max_pool1d(x, kernel_size=pooling_size)
         return x.size(-1)
 
-    def forward(self, x):
+    def conv_features(self, x):
         x = F.relu(self.c1(x))
         x = F.relu(self.c2(x))
         x = F.relu(self.c3(x))
+        return x
+
+    def forward(self, x):
+        x = maybe_checkpoint(self, self.conv_features, x)
         if self.c3_only:
             return x
-        x = x.view(x.size(0), -1).unsqueeze(1)
-        x = F.max_pool1d(x, kernel_size=self.pooling_size).squeeze(1)
+        return self.forward_from_c3(x)
+
+    def forward_from_c3(self, x):
+        # c3 features -> z, lets several heads share one pass through the convs
+        if self.pool_size is not None:
+            x = F.adaptive_avg_pool2d(x, self.pool_size).flatten(1)
+        else:
+            x = x.reshape(x.size(0), -1).unsqueeze(1)
+            x = F.max_pool1d(x, kernel_size=self.pooling_size).squeeze(1)
         x = self.fc1(x)
         x = self.fc2(x)
 
@@ -105,5 +124,5 @@ class DenseBlock(nn.Module):
         x = self.fc1(x)
         x = self.fc_bn(x)
         x = F.relu(x)
-        x = F.dropout(x, self.drop_p)
+        x = F.dropout(x, self.drop_p, training=self.training)
         return x
\ No newline at end of file
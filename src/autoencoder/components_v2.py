@@ -21,7 +21,7 @@ class Encoder(torch.nn.Module):
         self.c2 = nn.Conv2d(32, 32, kernel_size=3, padding=1)
         self.bn2 = nn.BatchNorm2d(32)
         self.c3 = nn.Conv2d(32, 32, kernel_size=3, stride=2, padding=1)
-        self.bn3 = nn.Conv2d(32)
+        self.bn3 = nn.BatchNorm2d(32)
 
         self.pooling_size = 4
         conv_out_dim = self._calculate_output_dim(in_channels, input_height, input_width, self.pooling_size)
@@ -111,5 +111,5 @@ class DenseBlock(nn.Module):
         x = self.fc1(x)
         x = self.fc_bn(x)
         x = F.relu(x)
-        x = F.dropout(x, self.drop_p)
+        x = F.dropout(x, self.drop_p, training=self.training)
         return x
\ No newline at end of file
@@ -23,7 +23,7 @@ from argparse import ArgumentParser, Namespace
 from pytorch_lightning import LightningModule, Trainer
 from test_tube import HyperOptArgumentParser
 
-from src.utils.helper import collate_fn, plot_image, log_bb_images, plot_all_boxes_new
+from src.utils.helper import split_scenes, collate_fn, plot_image, log_bb_images, plot_all_boxes_new
 from src.utils.data_helper import LabeledDataset
 
 from src.autoencoder.autoencoder import BasicAE
@@ -159,13 +159,10 @@ class Boxes(LightningModule):
         image_folder = self.hparams.link
         annotation_csv = self.hparams.link + '/annotation.csv'
         labeled_scene_index = np.arange(106, 134)
-        trainset_size = round(0.8 * len(labeled_scene_index))
 
         # split into train / validation sets at the scene index level
         # before I did this at the sample level --> this will cause leakage (!!)
-        np.random.shuffle(labeled_scene_index)
-        train_set_index = labeled_scene_index[:trainset_size]
-        valid_set_index = labeled_scene_index[trainset_size:]
+        train_set_index, valid_set_index = split_scenes(labeled_scene_index)
 
         transform = torchvision.transforms.ToTensor()
 
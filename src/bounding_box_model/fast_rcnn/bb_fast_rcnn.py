@@ -14,14 +14,13 @@ from test_tube import HyperOptArgumentParser
 
 from src.utils.data_helper import LabeledDataset
 from src.utils import helper
-from src.utils.helper import collate_fn, boxes_to_binary_map, compute_ts_road_map, log_fast_rcnn_images
+from src.utils.helper import split_scenes, collate_fn, compute_ts_road_map, log_fast_rcnn_images
+from src.utils.bb_to_img import boxes_to_binary_map
 from src.autoencoder.autoencoder import BasicAE
 from src.bounding_box_model.spatial_bb.components import SpatialMappingCNN, RoadMapBoxesMergingCNN
 
-from torchvision.models.detection import FasterRCNN
-from torchvision.models.detection.rpn import AnchorGenerator
-
-import matplotlib.pyplot as plt
+from src.utils.execution import apply_exec_mode, exec_context, add_exec_mode_args
+from src.bounding_box_model.fast_rcnn.components import build_fast_rcnn, add_fast_rcnn_args
 
 random.seed(20200505)
 np.random.seed(20200505)
@@ -53,27 +52,21 @@ class BBFasterRCNN(LightningModule):
         ae.freeze()
         self.backbone = ae.encoder
         self.backbone.c3_only = True
+        self.backbone.checkpoint = self.hparams.ckpt_encoder if hasattr(self.hparams, 'ckpt_encoder') else False
         self.backbone.out_channels = 32
 
         # ------------------
         # FAST RCNN
         # ------------------
-        anchor_generator = AnchorGenerator(sizes=((32, 64, 128, 256, 512),),
-                                           aspect_ratios=((0.5, 1.0, 2.0),))
-
-        roi_pooler = torchvision.ops.MultiScaleRoIAlign(featmap_names=['0'],
-                                                        output_size=7,
-                                                        sampling_ratio=2)
-        self.fast_rcnn = FasterRCNN(
-            self.backbone,
-            num_classes=9,
-            rpn_anchor_generator=anchor_generator,
-            box_roi_pool=roi_pooler
-        )
+        self.fast_rcnn = build_fast_rcnn(self.backbone, self.hparams)
 
         # for unfreezing encoder later
         self.frozen = True
 
+        # precision / memory format the forward pass runs in
+        self.exec_mode = hparams.exec_mode if hasattr(hparams, 'exec_mode') else 'fp32'
+        apply_exec_mode(self, self.exec_mode)
+
     def wide_stitch_six_images(self, x):
         # change from tuple len([6 x 3 x H x W]) = b --> tensor [b x 6 x 3 x H x W]
         #x = torch.stack(sample, dim=0)
@@ -90,6 +83,21 @@ class BBFasterRCNN(LightningModule):
         losses_dict = self.fast_rcnn(ssr, targets)
         return losses_dict
 
+    @torch.no_grad()
+    def predict(self, sample, road_image=None):
+        # sample: [b, 6, 3, 256, 306] -> boxes: list of [N, 2, 4] in meters, labels / scores: list of [N]
+        square_images = helper.layout_images_as_map(sample)
+        images = list(image.float() for image in square_images)
+
+        with exec_context(self.exec_mode):
+            detections = self.fast_rcnn(images)
+
+        # [N, 4] on the (0, 800) map -> [N, 2, 4] in meters
+        boxes = [(self._change_to_old_coord_sys(d['boxes'].float()) - 400) / 10 for d in detections]
+        return {'boxes': boxes,
+                'labels': [d['labels'] for d in detections],
+                'scores': [d['scores'].float() for d in detections]}
+
     def _run_step(self, batch, batch_idx, step_name):
         # images, target and roadimage are tuples of length batchsize
         # bb coords in target using (-40, 40) scale
@@ -106,7 +114,8 @@ class BBFasterRCNN(LightningModule):
 
         # run a forward step
         # depending on whether its a train or validation step - losses is dict with different keys
-        losses = self(images, target)
+        with exec_context(self.exec_mode):
+            losses = self(images, target)
 
         # in training, the output is a dict of scalars
         if step_name == 'train':
@@ -123,22 +132,11 @@ class BBFasterRCNN(LightningModule):
             # ----------------------
             if batch_idx % self.hparams.output_img_freq == 0:
                 ### --- log one validation predicted image ---
-                # [N, 4] - seems to be [100,4]
-                predicted_coords_0 = losses[0]['boxes']
-                # transform [N, 4] -> [N, 2, 4]
-                # note these predictions are on [0, 800] scale
-                predicted_coords_0 = self._change_to_old_coord_sys(predicted_coords_0)
-                pred_categories_0 = losses[0]['labels'] # [N]
-
-                target_coords_0 = raw_target[0]['bounding_box']*10 + 400
-                # [N, 4] -> [N, 2, 4]
-                #target_coords_0 = self._change_to_old_coord_sys(target_coords_0)
-                target_categories_0 = raw_target[0]['category']
-
-                log_fast_rcnn_images(self, images[0], predicted_coords_0, pred_categories_0,
-                                     target_coords_0, target_categories_0,
-                                     road_image[0],
-                                     step_name)
+                # [N, 4] on the (0, 800) map -> [N, 2, 4] in meters, same as predict
+                predicted_coords_0 = (self._change_to_old_coord_sys(losses[0]['boxes']) - 400) / 10
+                target_coords_0 = raw_target[0]['bounding_box']
+
+                log_fast_rcnn_images(self, images[0], predicted_coords_0, target_coords_0, road_image[0], step_name)
 
             #return loss, None, None, None, None
 
@@ -220,13 +218,10 @@ class BBFasterRCNN(LightningModule):
         image_folder = self.hparams.link
         annotation_csv = self.hparams.link + '/annotation.csv'
         labeled_scene_index = np.arange(106, 134)
-        trainset_size = round(0.8 * len(labeled_scene_index))
 
         # split into train / validation sets at the scene index level
         # before I did this at the sample level --> this will cause leakage (!!)
-        np.random.shuffle(labeled_scene_index)
-        train_set_index = labeled_scene_index[:trainset_size]
-        valid_set_index = labeled_scene_index[trainset_size:]
+        train_set_index, valid_set_index = split_scenes(labeled_scene_index)
 
         transform = torchvision.transforms.ToTensor()
 
@@ -248,7 +243,7 @@ class BBFasterRCNN(LightningModule):
         loader = DataLoader(self.labeled_trainset,
                             batch_size=self.hparams.batch_size,
                             shuffle=True,
-                            num_workers=4,
+                            num_workers=self.hparams.num_workers if hasattr(self.hparams, 'num_workers') else 4,
                             collate_fn=collate_fn)
         return loader
 
@@ -257,7 +252,7 @@ class BBFasterRCNN(LightningModule):
         loader = DataLoader(self.labeled_validset,
                             batch_size=self.hparams.batch_size,
                             shuffle=False,
-                            num_workers=4,
+                            num_workers=self.hparams.num_workers if hasattr(self.hparams, 'num_workers') else 4,
                             collate_fn=collate_fn)
         return loader
 
@@ -276,6 +271,12 @@ class BBFasterRCNN(LightningModule):
         parser.add_argument('--unfreeze_epoch_no', type=int, default=0)
 
         parser.add_argument('--mse_loss', default=False, action='store_true')
+
+        # activation checkpointing, trades recompute in backward for a smaller memory footprint
+        parser.add_argument('--ckpt_encoder', default=False, action='store_true')
+
+        parser = add_fast_rcnn_args(parser)
+        parser = add_exec_mode_args(parser)
         return parser
 
 
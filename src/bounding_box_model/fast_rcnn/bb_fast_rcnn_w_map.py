@@ -1,4 +1,6 @@
 import random
+from functools import partial
+
 import numpy as np
 import torch
 
@@ -14,17 +16,16 @@ from test_tube import HyperOptArgumentParser
 
 from src.utils.data_helper import LabeledDataset
 from src.utils import helper
-from src.utils.helper import collate_fn, boxes_to_binary_map, compute_ats_bounding_boxes, log_fast_rcnn_images
+from src.utils.helper import split_scenes, road_map_collate_fn, compute_ats_bounding_boxes, log_fast_rcnn_images
+from src.utils.bb_to_img import boxes_to_binary_map
 from src.autoencoder.autoencoder import BasicAE
 from src.bounding_box_model.spatial_bb.components import SpatialMappingCNN, RoadMapBoxesMergingCNN
 
-from torchvision.models.detection import FasterRCNN
-from torchvision.models.detection.rpn import AnchorGenerator
+from src.utils.execution import apply_exec_mode, exec_context, add_exec_mode_args
+from src.bounding_box_model.fast_rcnn.components import build_fast_rcnn, add_fast_rcnn_args
 
 #torch.autograd.set_detect_anomaly(True)
 
-import matplotlib.pyplot as plt
-
 random.seed(20200505)
 np.random.seed(20200505)
 torch.manual_seed(20200505)
@@ -40,6 +41,7 @@ class Backbone(nn.Module):
         self.ae.freeze()
         self.ae = self.ae.encoder
         self.ae.c3_only = True
+        self.ae.checkpoint = hparams.ckpt_encoder if hasattr(hparams, 'ckpt_encoder') else False
 
     def forward(self, x):
 
@@ -77,22 +79,22 @@ class FasterRCNNRoadMap(LightningModule):
         # ------------------
         # FAST RCNN
         # ------------------
-        anchor_generator = AnchorGenerator(sizes=((32, 64, 128, 256, 512),),
-                                           aspect_ratios=((0.5, 1.0, 2.0),))
-
-        roi_pooler = torchvision.ops.MultiScaleRoIAlign(featmap_names=['0'],
-                                                        output_size=7,
-                                                        sampling_ratio=2)
-        self.fast_rcnn = FasterRCNN(
-            self.backbone,
-            num_classes=9,
-            rpn_anchor_generator=anchor_generator,
-            box_roi_pool=roi_pooler
-        )
+        self.fast_rcnn = build_fast_rcnn(self.backbone, self.hparams)
 
         # for unfreezing encoder later
         self.frozen = True
 
+        # precision / memory format the forward pass runs in
+        self.exec_mode = hparams.exec_mode if hasattr(hparams, 'exec_mode') else 'fp32'
+        apply_exec_mode(self, self.exec_mode)
+
+        # (H, W) of the image layout, road maps get resized to this in the data loader
+        map_size = hparams.map_size if hasattr(hparams, 'map_size') else 800
+        self.map_size = (map_size, map_size)
+        # the boxes live on the same grid: 80 x 80 meters, ego car in the center
+        self.pixels_per_meter = map_size / 80
+        self.map_center = map_size / 2
+
     def wide_stitch_six_images(self, x):
         # change from tuple len([6 x 3 x H x W]) = b --> tensor [b x 6 x 3 x H x W]
         #x = torch.stack(sample, dim=0)
@@ -109,18 +111,36 @@ class FasterRCNNRoadMap(LightningModule):
         losses_dict = self.fast_rcnn(ssr, targets)
         return losses_dict
 
+    @torch.no_grad()
+    def predict(self, sample, road_image):
+        # sample: [b, 6, 3, 256, 306], road_image: [b, 800, 800]
+        # -> boxes: list of [N, 2, 4] in meters, labels / scores: list of [N]
+        images = helper.layout_images_as_map(sample, self.map_size[0])
+        road_image = road_image.float().unsqueeze(1)
+        if tuple(road_image.shape[-2:]) != self.map_size:
+            road_image = F.interpolate(road_image, size=self.map_size, mode='nearest')
+
+        with exec_context(self.exec_mode):
+            images = self._mix_road_map(images, road_image)
+            detections = self.fast_rcnn(list(images.unbind(0)))
+
+        return {'boxes': [self._new_to_old_coord(d['boxes'].float()) for d in detections],
+                'labels': [d['labels'] for d in detections],
+                'scores': [d['scores'].float() for d in detections]}
+
     def _run_step(self, batch, batch_idx, step_name):
-        # images, target and roadimage are tuples
+        # images and target are tuples, road_image is already stacked: [b, 1, 800, 800]
         images, raw_target, road_image = batch
 
         # 6 images to 1 long one
-        images = helper.layout_images_as_map(images)
+        images = helper.layout_images_as_map(images, self.map_size[0])
 
-        # adjust format for FastRCNN
-        images, target = self._format_for_fastrcnn(images, raw_target, road_image)
+        with exec_context(self.exec_mode):
+            # adjust format for FastRCNN
+            images, target = self._format_for_fastrcnn(images, raw_target, road_image)
 
-        # aggregate losses
-        losses = self(images, target)
+            # aggregate losses
+            losses = self(images, target)
 
         # log images
         #if batch_idx % self.hparams.output_img_freq == 0:
@@ -158,25 +178,11 @@ class FasterRCNNRoadMap(LightningModule):
             # ----------------------
             if batch_idx % self.hparams.output_img_freq == 0:
                 ### --- log one validation predicted image ---
-                # [N, 4]
-                # range: (0, 800)
-
-                predicted_coords_0 = losses[0]['boxes']
-
-                # TODO: is this correct?
-                # transform [N, 4] -> [N, 2, 4]
-                predicted_coords_0 = self._new_to_old_coord(predicted_coords_0)
-                pred_categories_0 = losses[0]['labels'] # [N]
-
+                # [N, 4] on the (0, map_size) map -> [N, 2, 4] in meters
+                predicted_coords_0 = self._new_to_old_coord(losses[0]['boxes'])
                 target_coords_0 = raw_target[0]['bounding_box']
 
-                #target_coords_0 = self._change_to_old_coord_sys(target_coords_0)
-                target_categories_0 = raw_target[0]['category']
-
-                log_fast_rcnn_images(self, images[0], predicted_coords_0, pred_categories_0,
-                                     target_coords_0, target_categories_0,
-                                     road_image[0],
-                                     step_name)
+                log_fast_rcnn_images(self, images[0], predicted_coords_0, target_coords_0, road_image[0, 0], step_name)
 
             # return avg_bb_ts, None, None, None, None
 
@@ -186,8 +192,8 @@ class FasterRCNNRoadMap(LightningModule):
         # boxes dim: [N, 4]
         # scale down coords to (-40,40) coord sys
         #boxes[:, 0] =
-        boxes[:, [0,2]] = (boxes[:, [0,2]] - 400) / 10
-        boxes[:, [1, 3]] = (boxes[:, [1, 3]] - 400) / -10
+        boxes[:, [0,2]] = (boxes[:, [0,2]] - self.map_center) / self.pixels_per_meter
+        boxes[:, [1, 3]] = (boxes[:, [1, 3]] - self.map_center) / -self.pixels_per_meter
 
         x_0 = boxes[:, 0]
         y_0 = boxes[:, 1]
@@ -218,9 +224,9 @@ class FasterRCNNRoadMap(LightningModule):
 
         boxes = input_boxes.clone()
 
-        # rescale coordinate system from (-40, 40)x(-40,40) --> (0, 800)x(800, 0)
-        boxes[:,0] = (boxes[:,0] * 10) + 400
-        boxes[:, 1] = (boxes[:, 1] * -10) + 400
+        # rescale coordinate system from (-40, 40)x(-40,40) --> (0, map_size)x(map_size, 0)
+        boxes[:,0] = (boxes[:,0] * self.pixels_per_meter) + self.map_center
+        boxes[:, 1] = (boxes[:, 1] * -self.pixels_per_meter) + self.map_center
 
         # boxes dim: [N, 2, 4]
         max_x = boxes[:, 0].max(dim=1)[0]
@@ -234,15 +240,18 @@ class FasterRCNNRoadMap(LightningModule):
 
         return coords
 
+    def _mix_road_map(self, images, road_image):
+        # mix in the road map for the whole batch at once
+        # [b, 3, H, W] + [b, 1, H, W] --> [b, 4, H, W] --> [b, 3, H, W]
+        images = images.float()
+        images = torch.cat([images, road_image.type_as(images)], dim=1)
+        return torch.sigmoid(self.mapper_cnn(images))
+
     def _format_for_fastrcnn(self, images, target, road_image):
-        # split batch into list of single images
-        # [b, 3, 256, 1836] --> list of length b with elements [3, 256, 1836]
-        new_images = []
-        for image, road_img in zip(images, road_image):
-            image = torch.cat([image, road_img.unsqueeze(0)], dim=0).float()
-            image = self.mapper_cnn(image.unsqueeze(0)).squeeze(0)
-            image = F.sigmoid(image)
-            new_images.append(image)
+        images = self._mix_road_map(images, road_image)
+
+        # torchvision detection wants a list of length b with elements [3, H, W]
+        new_images = list(images.unbind(0))
 
         target = [{k: v for k, v in t.items()} for t in target]
         for d in target:
@@ -295,13 +304,10 @@ class FasterRCNNRoadMap(LightningModule):
         image_folder = self.hparams.link
         annotation_csv = self.hparams.link + '/annotation.csv'
         labeled_scene_index = np.arange(106, 134)
-        trainset_size = round(0.8 * len(labeled_scene_index))
 
         # split into train / validation sets at the scene index level
         # before I did this at the sample level --> this will cause leakage (!!)
-        np.random.shuffle(labeled_scene_index)
-        train_set_index = labeled_scene_index[:trainset_size]
-        valid_set_index = labeled_scene_index[trainset_size:]
+        train_set_index, valid_set_index = split_scenes(labeled_scene_index)
 
         transform = torchvision.transforms.ToTensor()
 
@@ -323,8 +329,8 @@ class FasterRCNNRoadMap(LightningModule):
         loader = DataLoader(self.labeled_trainset,
                             batch_size=self.hparams.batch_size,
                             shuffle=True,
-                            num_workers=4,
-                            collate_fn=collate_fn)
+                            num_workers=self.hparams.num_workers if hasattr(self.hparams, 'num_workers') else 4,
+                            collate_fn=partial(road_map_collate_fn, size=self.map_size))
         return loader
 
     def val_dataloader(self):
@@ -332,8 +338,8 @@ class FasterRCNNRoadMap(LightningModule):
         loader = DataLoader(self.labeled_validset,
                             batch_size=self.hparams.batch_size,
                             shuffle=False,
-                            num_workers=4,
-                            collate_fn=collate_fn)
+                            num_workers=self.hparams.num_workers if hasattr(self.hparams, 'num_workers') else 4,
+                            collate_fn=partial(road_map_collate_fn, size=self.map_size))
         return loader
 
     @staticmethod
@@ -353,7 +359,14 @@ class FasterRCNNRoadMap(LightningModule):
         parser.add_argument('--output_img_freq', type=int, default=100)
 
         parser.add_argument('--debug', default=False, action='store_true')
+        parser.add_argument('--map_size', type=int, default=800, help='side of the square image layout')
         parser.add_argument('--mse_loss', default=False, action='store_true')
+
+        # activation checkpointing, trades recompute in backward for a smaller memory footprint
+        parser.add_argument('--ckpt_encoder', default=False, action='store_true')
+
+        parser = add_fast_rcnn_args(parser)
+        parser = add_exec_mode_args(parser)
         return parser
 
 
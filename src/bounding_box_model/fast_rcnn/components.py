@@ -0,0 +1,68 @@
+import json
+
+import torchvision
+from torchvision.models.detection import FasterRCNN
+from torchvision.models.detection.rpn import AnchorGenerator
+
+# torchvision defaults (imagenet statistics, resize shorter side to 800)
+IMAGE_MEAN = [0.485, 0.456, 0.406]
+IMAGE_STD = [0.229, 0.224, 0.225]
+
+# generic coco anchors, used when no --anchor_config is given
+DEFAULT_ANCHORS = {
+    'sizes': [32, 64, 128, 256, 512],
+    'aspect_ratios': [0.5, 1.0, 2.0],
+}
+RPN_TOP_N_KEYS = ['rpn_pre_nms_top_n_train', 'rpn_post_nms_top_n_train',
+                  'rpn_pre_nms_top_n_test', 'rpn_post_nms_top_n_test']
+
+
+def load_anchor_config(path):
+    # json written by src/utils/anchor_config.py
+    if path is None:
+        return dict(DEFAULT_ANCHORS)
+    with open(path) as f:
+        return json.load(f)
+
+
+def build_fast_rcnn(backbone, hparams, num_classes=9):
+    min_size = hparams.rcnn_min_size if hasattr(hparams, 'rcnn_min_size') else 800
+    max_size = hparams.rcnn_max_size if hasattr(hparams, 'rcnn_max_size') else 1333
+    image_mean = hparams.rcnn_image_mean if hasattr(hparams, 'rcnn_image_mean') else IMAGE_MEAN
+    image_std = hparams.rcnn_image_std if hasattr(hparams, 'rcnn_image_std') else IMAGE_STD
+    anchors = load_anchor_config(hparams.anchor_config if hasattr(hparams, 'anchor_config') else None)
+
+    anchor_generator = AnchorGenerator(sizes=(tuple(anchors['sizes']),),
+                                       aspect_ratios=(tuple(anchors['aspect_ratios']),))
+
+    # rpn proposal counts tuned along with the anchors, torchvision defaults otherwise
+    rpn_kwargs = {k: anchors[k] for k in RPN_TOP_N_KEYS if k in anchors}
+
+    roi_pooler = torchvision.ops.MultiScaleRoIAlign(featmap_names=['0'],
+                                                    output_size=7,
+                                                    sampling_ratio=2)
+    fast_rcnn = FasterRCNN(
+        backbone,
+        num_classes=num_classes,
+        min_size=min_size,
+        max_size=max_size,
+        image_mean=image_mean,
+        image_std=image_std,
+        rpn_anchor_generator=anchor_generator,
+        box_roi_pool=roi_pooler,
+        **rpn_kwargs
+    )
+
+    return fast_rcnn
+
+
+def add_fast_rcnn_args(parser):
+    # input transform, by default torchvision rescales the shorter side of every input to 800,
+    # a --map_size layout is left at its own resolution with --rcnn_min_size <map_size>
+    parser.add_argument('--rcnn_min_size', type=int, default=800)
+    parser.add_argument('--rcnn_max_size', type=int, default=1333)
+    parser.add_argument('--rcnn_image_mean', type=float, nargs=3, default=IMAGE_MEAN)
+    parser.add_argument('--rcnn_image_std', type=float, nargs=3, default=IMAGE_STD)
+    parser.add_argument('--anchor_config', type=str, default=None,
+                        help='json from src/utils/anchor_config.py with anchor sizes, ratios and rpn top n')
+    return parser
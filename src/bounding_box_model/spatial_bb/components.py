@@ -2,6 +2,8 @@ import torch
 from torch import nn
 from torch.nn import functional as F
 
+from src.utils.activation_checkpoint import maybe_checkpoint
+
 
 class SpatialMappingCNN(nn.Module):
     """
@@ -25,7 +27,12 @@ class SpatialMappingCNN(nn.Module):
 
         self.out_conv = nn.Conv2d(32, 32, kernel_size=(3, 3))
 
+        self.checkpoint = False
+
     def forward(self, x):
+        return maybe_checkpoint(self, self._forward, x)
+
+    def _forward(self, x):
         # (b, 6, 3, 256, 306) -> (b, 32, 256, 256)
 
         # ---------------
@@ -77,20 +84,65 @@ class SpatialMappingCNN(nn.Module):
         return x
 
 
+class LowResHead(nn.Module):
+    """
+    Cheap replacement for the dilated upsampling stack when training at low resolution
+
+    (b, c, 256, 256) -> (b, 1, output_size, output_size)
+    """
+
+    def __init__(self, in_channels, output_size):
+        super().__init__()
+        self.output_size = output_size
+        self.conv_1 = nn.Conv2d(in_channels, 32, kernel_size=3, padding=1)
+        self.conv_2 = nn.Conv2d(32, 1, kernel_size=1)
+
+    def forward(self, x):
+        # area pooling when shrinking (200), bilinear when growing (400)
+        if self.output_size < x.size(-1):
+            x = F.adaptive_avg_pool2d(x, self.output_size)
+        else:
+            x = F.interpolate(x, size=(self.output_size, self.output_size), mode='bilinear', align_corners=False)
+        x = F.relu(self.conv_1(x))
+        x = self.conv_2(x)
+        return x
+
+
+def upsample_to_full_res(x, size=800):
+    """
+    Cheap upsampler for low resolution predictions: (b, [1,] s, s) -> (b, [1,] 800, 800)
+    """
+    if x.size(-1) == size:
+        return x
+    squeeze = x.dim() == 3
+    if squeeze:
+        x = x.unsqueeze(1)
+    x = F.interpolate(x, size=(size, size), mode='bilinear', align_corners=False)
+    if squeeze:
+        x = x.squeeze(1)
+    return x
+
+
 class BoxesMergingCNN(nn.Module):
     """
-    Merges ssl representations + spatial mapping
+    Merges ssl representations + spatial mapping, returns logits
     """
 
-    def __init__(self):
+    def __init__(self, output_size=800):
         super().__init__()
+        self.output_size = output_size
         self.ss_conv = nn.Conv2d(32, 32, kernel_size=(1, 24), stride=(1, 7))
         self.ss_deconv = nn.ConvTranspose2d(32, 32, kernel_size=2, stride=2)
 
-        self.up_conv_1 = nn.ConvTranspose2d(64, 32, kernel_size=8, stride=1, dilation=8)
-        self.up_conv_2 = nn.ConvTranspose2d(32, 16, kernel_size=8, stride=1, dilation=8)
-        self.up_conv_3 = nn.ConvTranspose2d(16, 8, kernel_size=6, stride=1, dilation=6, output_padding=2)
-        self.up_conv_4 = nn.ConvTranspose2d(8, 1, kernel_size=2, stride=2)
+        if output_size == 800:
+            self.up_conv_1 = nn.ConvTranspose2d(64, 32, kernel_size=8, stride=1, dilation=8)
+            self.up_conv_2 = nn.ConvTranspose2d(32, 16, kernel_size=8, stride=1, dilation=8)
+            self.up_conv_3 = nn.ConvTranspose2d(16, 8, kernel_size=6, stride=1, dilation=6, output_padding=2)
+            self.up_conv_4 = nn.ConvTranspose2d(8, 1, kernel_size=2, stride=2)
+        else:
+            self.low_res_head = LowResHead(64, output_size)
+
+        self.checkpoint = False
 
     def forward(self, ssr, spatial_map):
         # ssr = (b, 32, 128, 918)
@@ -108,35 +160,54 @@ class BoxesMergingCNN(nn.Module):
         # -----------------------------
         x = torch.cat([ssr, spatial_map], dim=1)
 
+        if self.output_size != 800:
+            # (b, 64, 256, 256) -> (b, 1, output_size, output_size)
+            return self.low_res_head(x)
+
         # -----------------------------
         # upsample back to 800 x 800
         # -----------------------------
+        # two segments, so only the 256 and ~370 inputs are kept when checkpointing
+        x = maybe_checkpoint(self, self._up_1_2, x)
+        x = maybe_checkpoint(self, self._up_3_4, x)
+
+        return x
+
+    def _up_1_2(self, x):
         x = F.relu(self.up_conv_1(x))
         x = F.relu(self.up_conv_2(x))
-        x = F.relu(self.up_conv_3(x))
-        x = torch.sigmoid(self.up_conv_4(x))
+        return x
 
+    def _up_3_4(self, x):
+        x = F.relu(self.up_conv_3(x))
+        x = self.up_conv_4(x)
         return x
 
 
 class RoadMapBoxesMergingCNN(nn.Module):
     """
-    Merges ssl representations + spatial mapping
+    Merges ssl representations + spatial mapping, returns logits
     """
 
-    def __init__(self):
+    def __init__(self, output_size=800):
         super().__init__()
+        self.output_size = output_size
         self.ss_conv = nn.Conv2d(32, 32, kernel_size=(1, 24), stride=(1, 7))
         self.ss_deconv = nn.ConvTranspose2d(32, 32, kernel_size=2, stride=2)
 
         self.rm_conv_1 = nn.Conv2d(1, 32, kernel_size=7, stride=3, dilation=3, padding=1)
         self.rm_conv_2 = nn.Conv2d(32, 32, kernel_size=3, stride=1, dilation=3)
 
-        self.up_conv_1 = nn.ConvTranspose2d(96, 64, kernel_size=7, stride=1, dilation=7)
-        self.up_conv_2 = nn.ConvTranspose2d(64, 32, kernel_size=7, stride=1, dilation=7)
-        self.up_conv_3 = nn.ConvTranspose2d(32, 16, kernel_size=7, stride=1, dilation=7)
-        self.up_conv_4 = nn.ConvTranspose2d(16, 8, kernel_size=7, stride=1, dilation=3)
-        self.up_conv_5 = nn.ConvTranspose2d(8, 1, kernel_size=2, stride=2)
+        if output_size == 800:
+            self.up_conv_1 = nn.ConvTranspose2d(96, 64, kernel_size=7, stride=1, dilation=7)
+            self.up_conv_2 = nn.ConvTranspose2d(64, 32, kernel_size=7, stride=1, dilation=7)
+            self.up_conv_3 = nn.ConvTranspose2d(32, 16, kernel_size=7, stride=1, dilation=7)
+            self.up_conv_4 = nn.ConvTranspose2d(16, 8, kernel_size=7, stride=1, dilation=3)
+            self.up_conv_5 = nn.ConvTranspose2d(8, 1, kernel_size=2, stride=2)
+        else:
+            self.low_res_head = LowResHead(96, output_size)
+
+        self.checkpoint = False
 
     def forward(self, ssr, spatial_map, rm):
         # ssr = (b, 32, 128, 918)
@@ -158,13 +229,26 @@ class RoadMapBoxesMergingCNN(nn.Module):
         # import pdb; pdb.set_trace()
         x = torch.cat([ssr, spatial_map, rm], dim=1)
 
+        if self.output_size != 800:
+            # (b, 96, 256, 256) -> (b, 1, output_size, output_size)
+            return self.low_res_head(x)
+
         # -----------------------------
         # upsample back to 800 x 800
         # -----------------------------
+        # two segments, so only the 256 and 340 inputs are kept when checkpointing
+        x = maybe_checkpoint(self, self._up_1_2, x)
+        x = maybe_checkpoint(self, self._up_3_5, x)
+
+        return x
+
+    def _up_1_2(self, x):
         x = F.relu(self.up_conv_1(x))
         x = F.relu(self.up_conv_2(x))
+        return x
+
+    def _up_3_5(self, x):
         x = F.relu(self.up_conv_3(x))
         x = F.relu(self.up_conv_4(x))
-        x = F.sigmoid(self.up_conv_5(x))
-
+        x = self.up_conv_5(x)
         return x
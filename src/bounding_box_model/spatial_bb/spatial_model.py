@@ -13,7 +13,8 @@ from pytorch_lightning import LightningModule, Trainer
 from test_tube import HyperOptArgumentParser
 
 from src.utils.data_helper import LabeledDataset
-from src.utils.helper import collate_fn, boxes_to_binary_map, compute_ts_road_map
+from src.utils.helper import split_scenes, collate_fn, compute_ts_road_map
+from src.utils.bb_to_img import boxes_to_binary_map
 from src.autoencoder.autoencoder import BasicAE
 from src.bounding_box_model.spatial_bb.components import SpatialMappingCNN, BoxesMergingCNN
 
@@ -100,8 +101,9 @@ class BBSpatialModel(LightningModule):
         sample = torch.stack(sample, dim=0)
         sample = sample.type_as(sample[0])
 
-        # forward pass to find predicted roadmap
-        pred_bb_img = self(sample)
+        # forward pass to find predicted roadmap, the net returns logits
+        pred_bb_logits = self(sample)
+        pred_bb_img = torch.sigmoid(pred_bb_logits)
 
         # every 10 epochs we look at inputs + predictions
         if batch_idx % self.hparams.output_img_freq == 0:
@@ -115,11 +117,12 @@ class BBSpatialModel(LightningModule):
         batch_size = target_bb_img.size(0)
         target_bb_img = target_bb_img.view(batch_size, -1)
         pred_bb_img = pred_bb_img.view(batch_size, -1)
+        pred_bb_logits = pred_bb_logits.view(batch_size, -1)
 
         if self.hparams.mse_loss:
             loss = F.mse_loss(pred_bb_img, target_bb_img)
         else:
-            loss = F.binary_cross_entropy(pred_bb_img, target_bb_img)
+            loss = F.binary_cross_entropy_with_logits(pred_bb_logits, target_bb_img)
 
         return loss, target_bb_img, pred_bb_img
 
@@ -160,13 +163,10 @@ class BBSpatialModel(LightningModule):
         image_folder = self.hparams.link
         annotation_csv = self.hparams.link + '/annotation.csv'
         labeled_scene_index = np.arange(106, 134)
-        trainset_size = round(0.8 * len(labeled_scene_index))
 
         # split into train / validation sets at the scene index level
         # before I did this at the sample level --> this will cause leakage (!!)
-        np.random.shuffle(labeled_scene_index)
-        train_set_index = labeled_scene_index[:trainset_size]
-        valid_set_index = labeled_scene_index[trainset_size:]
+        train_set_index, valid_set_index = split_scenes(labeled_scene_index)
 
         transform = torchvision.transforms.ToTensor()
 
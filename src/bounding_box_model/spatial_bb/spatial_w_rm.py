@@ -1,3 +1,4 @@
+import time
 import random
 import numpy as np
 import torch
@@ -13,9 +14,12 @@ from pytorch_lightning import LightningModule, Trainer
 from test_tube import HyperOptArgumentParser
 
 from src.utils.data_helper import LabeledDataset
-from src.utils.helper import collate_fn, boxes_to_binary_map, compute_ts_road_map
+from src.utils.helper import split_scenes, collate_fn, compute_ts_road_map
+from src.utils.bb_to_img import boxes_to_binary_map
 from src.autoencoder.autoencoder import BasicAE
-from src.bounding_box_model.spatial_bb.components import SpatialMappingCNN, RoadMapBoxesMergingCNN
+from src.utils.execution import apply_exec_mode, exec_context, add_exec_mode_args
+from src.utils.importance_sampling import LossImportanceSampler, add_importance_sampling_args
+from src.bounding_box_model.spatial_bb.components import SpatialMappingCNN, RoadMapBoxesMergingCNN, upsample_to_full_res
 
 random.seed(20200505)
 np.random.seed(20200505)
@@ -27,7 +31,9 @@ class BBSpatialRoadMap(LightningModule):
     def __init__(self, hparams):
         super().__init__()
         self.hparams = hparams
-        self.output_dim = 800 * 800
+        # 800 trains the full dilated upsampling stack, 200 / 400 use the cheap low resolution head
+        self.output_size = hparams.output_size if hasattr(hparams, 'output_size') else 800
+        self.output_dim = self.output_size * self.output_size
         #self.kernel_size = 4
 
         # TODO: add pretrained weight path
@@ -49,7 +55,32 @@ class BBSpatialRoadMap(LightningModule):
 
         self.space_map_cnn = SpatialMappingCNN()
 
-        self.box_merge = RoadMapBoxesMergingCNN()
+        self.box_merge = RoadMapBoxesMergingCNN(self.output_size)
+
+        # activation checkpointing per block
+        self.ae.encoder.checkpoint = hparams.ckpt_encoder if hasattr(hparams, 'ckpt_encoder') else False
+        self.space_map_cnn.checkpoint = hparams.ckpt_spatial if hasattr(hparams, 'ckpt_spatial') else False
+        self.box_merge.checkpoint = hparams.ckpt_merge if hasattr(hparams, 'ckpt_merge') else False
+
+        # fine-tune the full resolution head on top of a trunk trained at low resolution
+        low_res_ckpt = hparams.low_res_ckpt if hasattr(hparams, 'low_res_ckpt') else None
+        if low_res_ckpt and self.output_size == 800:
+            self._load_low_res_trunk(low_res_ckpt)
+
+        self.fit_start_time = None
+
+        # set in train_dataloader when --importance_sampling is on
+        self.train_sampler = None
+
+        # precision / memory format the forward pass runs in
+        self.exec_mode = hparams.exec_mode if hasattr(hparams, 'exec_mode') else 'fp32'
+        apply_exec_mode(self, self.exec_mode)
+
+    def _load_low_res_trunk(self, ckpt_path):
+        # everything except the low res head carries over, the up_conv stack starts from scratch
+        state_dict = torch.load(ckpt_path, map_location='cpu')['state_dict']
+        state_dict = {k: v for k, v in state_dict.items() if 'low_res_head' not in k}
+        self.load_state_dict(state_dict, strict=False)
 
     def wide_stitch_six_images(self, x):
         # change from tuple len([6 x 3 x H x W]) = b --> tensor [b x 6 x 3 x H x W]
@@ -75,20 +106,30 @@ class BBSpatialRoadMap(LightningModule):
         # [b, 3, 256, 1836] -> ssr: [b, 32, 128, 918]
         ssr = self.ae.encoder(x)
 
-        # combine all three to be -> [b, 1, 800, 800]
+        # combine all three to be -> [b, 1, 800, 800] logits
         yhat = self.box_merge(ssr, space_rep, rm)
         # [b, 1, 800, 800] -> [b, 800, 800]
         yhat = yhat.squeeze(1)
 
         return yhat
 
-    def bb_coord_to_map(self, target):
+    @torch.no_grad()
+    def predict(self, sample, road_image):
+        # sample: [b, 6, 3, 256, 306], road_image: [b, 800, 800] -> box_map: bool [b, 800, 800]
+        rm = road_image.float().unsqueeze(1)
+        with exec_context(self.exec_mode):
+            logits = self(sample, rm)
+        pred_bb_img = upsample_to_full_res(torch.sigmoid(logits.float()))
+        return {'box_map': pred_bb_img > 0.5}
+
+    def bb_coord_to_map(self, target, size=800):
         # target is tuple with len b
+        # boxes are rasterized straight at the requested size, no need to render 800 x 800 and pool
         results = []
         for i, sample in enumerate(target):
             # tuple of len 2 -> [num_boxes, 2, 4]
             sample = sample['bounding_box']
-            map = boxes_to_binary_map(sample)
+            map = boxes_to_binary_map(sample, size)
             results.append(map)
 
         results = torch.tensor(results)
@@ -97,8 +138,8 @@ class BBSpatialRoadMap(LightningModule):
     def _run_step(self, batch, batch_idx, step_name):
         sample, target, road_image = batch
 
-        # change target from dict of bounding box coords --> [b, 800, 800]
-        target_bb_img = self.bb_coord_to_map(target)
+        # change target from dict of bounding box coords --> [b, output_size, output_size]
+        target_bb_img = self.bb_coord_to_map(target, self.output_size)
         target_bb_img = target_bb_img.type_as(sample[0])
 
         # change from tuple len([6 x 3 x H x W]) = b --> tensor [b x 6 x 3 x H x W]
@@ -109,8 +150,11 @@ class BBSpatialRoadMap(LightningModule):
         rm = torch.stack(road_image, dim=0).float()
         rm = rm.unsqueeze(1)
 
-        # forward pass to predict
-        pred_bb_img = self(sample, rm)
+        # forward pass to predict, the net returns logits
+        with exec_context(self.exec_mode):
+            pred_bb_logits = self(sample, rm)
+        pred_bb_logits = pred_bb_logits.float()
+        pred_bb_img = torch.sigmoid(pred_bb_logits)
 
         # every 10 epochs we look at inputs + predictions
         if batch_idx % self.hparams.output_img_freq == 0:
@@ -124,13 +168,23 @@ class BBSpatialRoadMap(LightningModule):
         batch_size = target_bb_img.size(0)
         target_bb_img = target_bb_img.view(batch_size, -1)
         pred_bb_img = pred_bb_img.view(batch_size, -1)
+        pred_bb_logits = pred_bb_logits.view(batch_size, -1)
 
         if self.hparams.mse_loss:
-            loss = F.mse_loss(pred_bb_img, target_bb_img)
+            per_sample_loss = F.mse_loss(pred_bb_img, target_bb_img, reduction='none').mean(1)
         else:
-            loss = F.binary_cross_entropy(pred_bb_img, target_bb_img)
+            # with logits: numerically safe, and unlike binary_cross_entropy allowed under autocast
+            per_sample_loss = F.binary_cross_entropy_with_logits(pred_bb_logits, target_bb_img, reduction='none').mean(1)
 
-        return loss, target_bb_img, pred_bb_img
+        if step_name == 'train' and self.train_sampler is not None:
+            loss = self.train_sampler.reweight(batch_idx, per_sample_loss)
+        else:
+            loss = per_sample_loss.mean()
+
+        return loss, target, pred_bb_img
+
+    def on_train_start(self):
+        self.fit_start_time = time.time()
 
     def _log_rm_images(self, x, target, pred, step_name, limit=1):
 
@@ -154,13 +208,25 @@ class BBSpatialRoadMap(LightningModule):
         return {'loss': train_loss, 'log': train_tensorboard_logs}
 
     def validation_step(self, batch, batch_idx):
-        val_loss, target_rm, pred_rm = self._run_step(batch, batch_idx, step_name='valid')
+        val_loss, target, pred_bb_img = self._run_step(batch, batch_idx, step_name='valid')
+
+        # threat score is always measured at 800 x 800 so low res runs compare with the baseline
+        batch_size = pred_bb_img.size(0)
+        pred_bb_img = pred_bb_img.view(batch_size, self.output_size, self.output_size)
+        pred_bb_img = upsample_to_full_res(pred_bb_img)
+        target_bb_img = self.bb_coord_to_map(target).type_as(pred_bb_img)
+        val_ts = compute_ts_road_map(target_bb_img, pred_bb_img.round())
 
-        return {'val_loss': val_loss}
+        return {'val_loss': val_loss, 'val_ts': val_ts}
 
     def validation_epoch_end(self, outputs):
         avg_val_loss = torch.stack([x['val_loss'] for x in outputs]).mean()
-        val_tensorboard_logs = {'avg_val_loss': avg_val_loss}
+        avg_val_ts = torch.stack([x['val_ts'] for x in outputs]).mean()
+        val_tensorboard_logs = {'avg_val_loss': avg_val_loss, 'avg_val_ts': avg_val_ts}
+
+        # wall clock since fit started, plot avg_val_ts against this for time-to-threat-score
+        if self.fit_start_time is not None:
+            val_tensorboard_logs['train_time_sec'] = torch.tensor(time.time() - self.fit_start_time)
         return {'val_loss': avg_val_loss, 'log': val_tensorboard_logs}
 
     def configure_optimizers(self):
@@ -170,13 +236,10 @@ class BBSpatialRoadMap(LightningModule):
         image_folder = self.hparams.link
         annotation_csv = self.hparams.link + '/annotation.csv'
         labeled_scene_index = np.arange(106, 134)
-        trainset_size = round(0.8 * len(labeled_scene_index))
 
         # split into train / validation sets at the scene index level
         # before I did this at the sample level --> this will cause leakage (!!)
-        np.random.shuffle(labeled_scene_index)
-        train_set_index = labeled_scene_index[:trainset_size]
-        valid_set_index = labeled_scene_index[trainset_size:]
+        train_set_index, valid_set_index = split_scenes(labeled_scene_index)
 
         transform = torchvision.transforms.ToTensor()
 
@@ -195,10 +258,14 @@ class BBSpatialRoadMap(LightningModule):
                                                extra_info=False)
 
     def train_dataloader(self):
+        if getattr(self.hparams, 'importance_sampling', False):
+            self.train_sampler = LossImportanceSampler(len(self.labeled_trainset), self.hparams.batch_size,
+                                                       floor=self.hparams.is_floor, beta=self.hparams.is_beta)
         loader = DataLoader(self.labeled_trainset,
                             batch_size=self.hparams.batch_size,
-                            shuffle=True,
-                            num_workers=4,
+                            shuffle=self.train_sampler is None,
+                            sampler=self.train_sampler,
+                            num_workers=self.hparams.num_workers if hasattr(self.hparams, 'num_workers') else 4,
                             collate_fn=collate_fn)
         return loader
 
@@ -207,7 +274,7 @@ class BBSpatialRoadMap(LightningModule):
         loader = DataLoader(self.labeled_validset,
                             batch_size=self.hparams.batch_size,
                             shuffle=False,
-                            num_workers=4,
+                            num_workers=self.hparams.num_workers if hasattr(self.hparams, 'num_workers') else 4,
                             collate_fn=collate_fn)
         return loader
 
@@ -226,6 +293,17 @@ class BBSpatialRoadMap(LightningModule):
         parser.add_argument('--unfreeze_epoch_no', type=int, default=0)
 
         parser.add_argument('--mse_loss', default=False, action='store_true')
+
+        # low resolution training: predict + compute loss at 200 / 400, then fine-tune at 800 from low_res_ckpt
+        parser.add_argument('--output_size', type=int, default=800, choices=[200, 400, 800])
+        parser.add_argument('--low_res_ckpt', type=str, default=None)
+
+        # activation checkpointing, trades recompute in backward for a smaller memory footprint
+        parser.add_argument('--ckpt_encoder', default=False, action='store_true')
+        parser.add_argument('--ckpt_spatial', default=False, action='store_true')
+        parser.add_argument('--ckpt_merge', default=False, action='store_true')
+        parser = add_exec_mode_args(parser)
+        parser = add_importance_sampling_args(parser)
         return parser
 
 
@@ -0,0 +1,191 @@
+"""
+Runs the roadmap model and a box model (spatial or faster rcnn) on one shared encoder
+
+The encoder is kept once in memory and its convs run once per batch. The road map predicted
+by the roadmap head is chained into the map conditioned box models.
+
+python -m src.inference.engine --rm_ckpt_path rm.ckpt --box_model spatial_rm --box_ckpt_path bb.ckpt
+"""
+import time
+import warnings
+from argparse import ArgumentParser
+
+import torch
+from torch import nn
+
+from src.submit import MODEL_NAMES
+from src.utils.execution import exec_context
+from src.inference.incremental import CameraFeatureCache
+from src.bounding_box_model.spatial_bb.components import upsample_to_full_res
+
+
+def _encoder_of(model):
+    # every model keeps the pretrained encoder somewhere different
+    if hasattr(model, 'ae'):
+        return model.ae.encoder
+    if hasattr(model.backbone, 'ae'):
+        return model.backbone.ae
+    return model.backbone
+
+
+class _ConvFeatures(nn.Module):
+    """
+    The shared encoder seen as a c3 only backbone, without flipping its c3_only flag
+    """
+
+    def __init__(self, encoder):
+        super().__init__()
+        self.encoder = encoder
+        self.out_channels = 32
+
+    def forward(self, x):
+        return self.encoder.conv_features(x)
+
+
+def _same_weights(a, b):
+    sa, sb = a.state_dict(), b.state_dict()
+    return sa.keys() == sb.keys() and all(torch.equal(sa[k], sb[k]) for k in sa)
+
+
+class MultiHeadEngine:
+    """
+    rm_model: RoadMapBCE / RoadMap, box_model: optional BBSpatialRoadMap / BBFasterRCNN / FasterRCNNRoadMap
+
+    The heads must have been trained on top of the same (frozen) encoder weights, otherwise
+    sharing changes their predictions. Checked on init, strict=False only warns.
+    """
+
+    def __init__(self, rm_model, box_model=None, strict=True, feature_cache=False):
+        self.rm_model = rm_model.eval()
+        self.box_model = box_model.eval() if box_model is not None else None
+        self.encoder = rm_model.ae.encoder
+        self.exec_mode = rm_model.exec_mode
+
+        # feature_cache: reuse c3 slices of cameras whose bytes didn't change (replay, frozen cameras)
+        self.feature_cache = CameraFeatureCache(self.encoder) if feature_cache else None
+        self.conv_features = self.feature_cache or self.encoder.conv_features
+
+        if box_model is not None:
+            box_encoder = _encoder_of(box_model)
+            if not _same_weights(self.encoder, box_encoder):
+                msg = 'box model encoder differs from the roadmap encoder, was it unfrozen during training?'
+                if strict:
+                    raise ValueError(msg)
+                warnings.warn(msg)
+            self._share_encoder(box_model)
+
+    def _share_encoder(self, box_model):
+        # box models only ever need the c3 features of the encoder
+        features = _ConvFeatures(self.encoder)
+        if hasattr(box_model, 'ae'):
+            box_model.ae.encoder = features
+        elif hasattr(box_model.backbone, 'ae'):
+            box_model.backbone.ae = features
+        else:
+            box_model.backbone = features
+            box_model.fast_rcnn.backbone = features
+
+    def _stitch(self, sample):
+        x = sample[:, [0, 1, 2, 5, 4, 3]]
+        b, num_imgs, c, h, w = x.size()
+        return x.permute(0, 2, 3, 1, 4).reshape(b, c, h, -1)
+
+    # predict is split in three steps so src/inference/streaming.py can run them on
+    # separate threads, no_grad / autocast are thread local so each step sets them itself
+
+    @torch.no_grad()
+    def encode(self, sample):
+        """
+        sample: [b, 6, 3, 256, 306] -> (sample, c3: [b, 32, 128, 918], z: [b, latent_dim])
+        """
+        with exec_context(self.exec_mode):
+            # one pass through the convs for every head
+            c3 = self.conv_features(self._stitch(sample))
+            z = self.encoder.forward_from_c3(c3)
+        return sample, c3, z
+
+    @torch.no_grad()
+    def run_heads(self, encoded):
+        sample, c3, z = encoded
+        with exec_context(self.exec_mode):
+            rm_prob = torch.sigmoid(self.rm_model.fc1(z).float()).reshape(z.size(0), 800, 800)
+            outputs = {'road_map_prob': rm_prob}
+            if self.box_model is None:
+                return outputs
+
+            road_map = rm_prob > 0.5
+            if hasattr(self.box_model, 'box_merge'):
+                # spatial model reuses c3 directly
+                space_rep = self.box_model.space_map_cnn(sample)
+                logits = self.box_model.box_merge(c3, space_rep, road_map.float().unsqueeze(1))
+                outputs['box_map_prob'] = torch.sigmoid(logits.float()).squeeze(1)
+            else:
+                # faster rcnn runs the shared encoder on its own map shaped input
+                outputs.update(self.box_model.predict(sample, road_map))
+        return outputs
+
+    @torch.no_grad()
+    def postprocess(self, outputs):
+        outputs = dict(outputs)
+        outputs['road_map'] = outputs.pop('road_map_prob') > 0.5
+        if 'box_map_prob' in outputs:
+            outputs['box_map'] = upsample_to_full_res(outputs.pop('box_map_prob')) > 0.5
+        return outputs
+
+    def predict(self, sample):
+        """
+        sample: [b, 6, 3, 256, 306] -> dict with road_map and the box model outputs
+        """
+        return self.postprocess(self.run_heads(self.encode(sample)))
+
+
+def load_engine(rm_model_name, rm_ckpt_path, box_model_name=None, box_ckpt_path=None, strict=True,
+                feature_cache=False):
+    rm_model = MODEL_NAMES[rm_model_name].load_from_checkpoint(rm_ckpt_path)
+    rm_model.freeze()
+    box_model = None
+    if box_model_name is not None:
+        box_model = MODEL_NAMES[box_model_name].load_from_checkpoint(box_ckpt_path)
+        box_model.freeze()
+    return MultiHeadEngine(rm_model, box_model, strict=strict, feature_cache=feature_cache)
+
+
+def benchmark(engine, batch_size, steps):
+    # separate models: every model stitches and encodes on its own, box model gets the predicted map
+    sample = torch.rand(batch_size, 6, 3, 256, 306)
+
+    def separate():
+        road_map = engine.rm_model.predict(sample)['road_map']
+        if engine.box_model is not None:
+            engine.box_model.predict(sample, road_map)
+
+    def shared():
+        engine.predict(sample)
+
+    results = {}
+    for name, fn in [('separate', separate), ('shared', shared)]:
+        fn()
+        start = time.time()
+        for _ in range(steps):
+            fn()
+        results[name] = (time.time() - start) / (steps * batch_size)
+    return results
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('--rm_model', type=str, default='roadmap_bce')
+    parser.add_argument('--rm_ckpt_path', type=str, required=True)
+    parser.add_argument('--box_model', type=str, default=None, choices=['spatial_rm', 'faster_rcnn', 'faster_rcnn_rm'])
+    parser.add_argument('--box_ckpt_path', type=str, default=None)
+    parser.add_argument('--not_strict', default=False, action='store_true')
+    parser.add_argument('--batch_size', type=int, default=4)
+    parser.add_argument('--steps', type=int, default=5)
+    args = parser.parse_args()
+
+    engine = load_engine(args.rm_model, args.rm_ckpt_path, args.box_model, args.box_ckpt_path,
+                         strict=not args.not_strict)
+    results = benchmark(engine, args.batch_size, args.steps)
+    print(f"per sample latency: separate {results['separate'] * 1000:.1f}ms, "
+          f"shared {results['shared'] * 1000:.1f}ms "
+          f"({results['separate'] / results['shared']:.2f}x)")
@@ -0,0 +1,215 @@
+"""
+Exports the prediction path of a MODEL_NAMES checkpoint (stitching, model, post-processing)
+to a TorchScript file that src/inference/exported.py loads with nothing but torch.
+
+Everything is traced, except the faster rcnn detector: torchvision detection is scripted,
+with the traced encoder as its backbone and traced pre-processing in front of it.
+
+python -m src.inference.export --model roadmap_bce --ckpt_path rm.ckpt --out roadmap_bce.pt --check
+"""
+import copy
+import json
+import time
+import subprocess
+import sys
+from argparse import ArgumentParser
+from typing import List, Tuple
+
+import torch
+from torch import nn, Tensor
+from torch.nn import functional as F
+
+from src.submit import MODEL_NAMES
+from src.inference.engine import _ConvFeatures
+from src.utils import helper
+
+DETECTION_MODELS = ['faster_rcnn', 'faster_rcnn_rm']
+
+# output keys of model.predict, fixed order for the exported tuple
+OUTPUT_KEYS = {
+    'basic_ae': ['latent'],
+    'roadmap_mse': ['road_map'],
+    'roadmap_bce': ['road_map'],
+    'roadmap_distill': ['road_map'],
+    'spatial_rm': ['box_map'],
+    'faster_rcnn': ['boxes', 'labels', 'scores'],
+    'faster_rcnn_rm': ['boxes', 'labels', 'scores'],
+}
+
+
+class _TracedPredict(nn.Module):
+    """
+    (sample, road_image) -> tuple of model.predict outputs, models that don't use the road map ignore it
+    """
+
+    def __init__(self, model, keys):
+        super().__init__()
+        self.model = model
+        self.keys = keys
+
+    def forward(self, sample, road_image):
+        outputs = self.model.predict(sample, road_image)
+        return tuple(outputs[k] for k in self.keys)
+
+
+class _DetectionPreprocess(nn.Module):
+    """
+    (sample, road_image) -> images [b, 3, H, W] as faster rcnn sees them
+    """
+
+    def __init__(self, model, with_road_map):
+        super().__init__()
+        self.model = model
+        self.with_road_map = with_road_map
+        self.map_size = model.map_size[0] if hasattr(model, 'map_size') else 800
+
+    def forward(self, sample, road_image):
+        images = helper.layout_images_as_map(sample, self.map_size)
+        if not self.with_road_map:
+            return images
+        road_image = road_image.float().unsqueeze(1)
+        road_image = F.interpolate(road_image, size=tuple(images.shape[-2:]), mode='nearest')
+        return self.model._mix_road_map(images, road_image)
+
+
+class _DetectionExport(nn.Module):
+    """
+    Scripted: traced pre-processing -> scripted detector -> boxes as [N, 2, 4] corners in meters
+    """
+
+    def __init__(self, preprocess, detector, x_order, y_order, y_scale, map_size):
+        super().__init__()
+        self.preprocess = preprocess
+        self.detector = detector
+        # column of the (x0, y0, x1, y1) box for every corner, see _new_to_old_coord / _change_to_old_coord_sys
+        self.register_buffer('x_order', torch.tensor(x_order))
+        self.register_buffer('y_order', torch.tensor(y_order))
+        # the boxes live on the map_size grid: 80 x 80 meters, ego car in the center
+        self.x_scale = map_size / 80
+        self.y_scale = y_scale * map_size / 80
+        self.map_center = map_size / 2
+
+    def forward(self, sample: Tensor, road_image: Tensor) -> Tuple[List[Tensor], List[Tensor], List[Tensor]]:
+        images = self.preprocess(sample, road_image)
+        _, detections = self.detector(list(images.unbind(0)))
+
+        boxes, labels, scores = [], [], []
+        for d in detections:
+            b = d['boxes']
+            xs = (b.index_select(1, self.x_order) - self.map_center) / self.x_scale
+            ys = (b.index_select(1, self.y_order) - self.map_center) / self.y_scale
+            boxes.append(torch.stack([xs, ys], dim=1))
+            labels.append(d['labels'])
+            scores.append(d['scores'])
+        return boxes, labels, scores
+
+
+def _export_detection(model_name, model, example):
+    # the backbone gets swapped below, keep the eager model intact for check()
+    model = copy.deepcopy(model)
+    detector = model.fast_rcnn
+    encoder = detector.backbone.ae if hasattr(detector.backbone, 'ae') else detector.backbone
+
+    # the encoder's python side (checkpoint flag, c3_only) can't be scripted, trace its convs instead
+    preprocess = _DetectionPreprocess(model, model_name == 'faster_rcnn_rm')
+    images = preprocess(*example)
+    backbone = torch.jit.trace(_ConvFeatures(encoder), images)
+    detector.backbone = backbone
+
+    map_size = preprocess.map_size
+    preprocess = torch.jit.trace(preprocess, example)
+    if model_name == 'faster_rcnn_rm':
+        corners = dict(x_order=[2, 2, 0, 0], y_order=[3, 1, 3, 1], y_scale=-1.)
+    else:
+        corners = dict(x_order=[2, 2, 0, 0], y_order=[3, 1, 1, 3], y_scale=1.)
+    return torch.jit.script(_DetectionExport(preprocess, detector, map_size=map_size, **corners))
+
+
+def example_inputs(batch_size=2):
+    return torch.rand(batch_size, 6, 3, 256, 306), torch.rand(batch_size, 800, 800) > 0.5
+
+
+def export(model_name, model, out_path):
+    model.freeze()
+    model.eval()
+    # batch > 1: a trace at batch 1 can't tell the batch dimension from a constant
+    example = example_inputs()
+    keys = OUTPUT_KEYS[model_name]
+
+    with torch.no_grad():
+        if model_name in DETECTION_MODELS:
+            module = _export_detection(model_name, model, example)
+        else:
+            module = torch.jit.trace(_TracedPredict(model, keys), example)
+
+    meta = {'model': model_name, 'keys': keys}
+    torch.jit.save(module, out_path, _extra_files={'meta.json': json.dumps(meta)})
+    return module
+
+
+def _startup_time(code):
+    start = time.time()
+    subprocess.run([sys.executable, '-c', code], check=True)
+    return time.time() - start
+
+
+def _max_abs_diff(a, b):
+    # tensors or lists of per-image tensors (detections), None if the shapes already differ
+    a = [a] if torch.is_tensor(a) else list(a)
+    b = [b] if torch.is_tensor(b) else list(b)
+    if len(a) != len(b) or any(x.shape != y.shape for x, y in zip(a, b)):
+        return None
+    return max([(x.float() - y.float()).abs().max().item() for x, y in zip(a, b) if x.numel()] or [0.])
+
+
+def check(model_name, model, ckpt_path, out_path, repeats=5, atol=1e-4):
+    from src.inference.exported import load_exported
+
+    exported = load_exported(out_path)
+    # a different batch size than the trace, the export must not have the batch size baked in
+    sample, road_image = example_inputs(3)
+
+    with torch.no_grad():
+        eager = model.predict(sample, road_image)
+    traced = exported(sample, road_image)
+
+    mismatched = []
+    for key in exported.keys:
+        diff = _max_abs_diff(eager[key], traced[key])
+        print(f'{key}: ' + ('shape mismatch' if diff is None else f'max abs diff {diff:.2e}'))
+        if diff is None or diff > atol:
+            mismatched.append(key)
+    if mismatched:
+        raise AssertionError(f'exported {model_name} differs from the eager model by more than {atol}: '
+                             f'{", ".join(mismatched)}')
+
+    timings = {}
+    for name, fn in [('eager', lambda: model.predict(sample, road_image)), ('exported', lambda: exported(sample, road_image))]:
+        with torch.no_grad():
+            fn()
+            start = time.time()
+            for _ in range(repeats):
+                fn()
+        timings[name] = (time.time() - start) / repeats
+    print(f"per call: eager {timings['eager'] * 1000:.1f}ms, exported {timings['exported'] * 1000:.1f}ms")
+
+    eager_start = _startup_time(f"from src.submit import MODEL_NAMES; "
+                                f"MODEL_NAMES['{model_name}'].load_from_checkpoint('{ckpt_path}')")
+    exported_start = _startup_time(f"import torch; torch.jit.load('{out_path}')")
+    print(f'startup: eager {eager_start:.1f}s, exported {exported_start:.1f}s')
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('--model', type=str, required=True, choices=list(MODEL_NAMES))
+    parser.add_argument('--ckpt_path', type=str, required=True)
+    parser.add_argument('--out', type=str, required=True)
+    parser.add_argument('--check', default=False, action='store_true',
+                        help='compare outputs, per call time and startup time against the eager model')
+    parser.add_argument('--atol', type=float, default=1e-4, help='largest allowed output difference in --check')
+    args = parser.parse_args()
+
+    model = MODEL_NAMES[args.model].load_from_checkpoint(args.ckpt_path)
+    export(args.model, model, args.out)
+    if args.check:
+        check(args.model, model, args.ckpt_path, args.out, atol=args.atol)
@@ -0,0 +1,29 @@
+"""
+Loader for artifacts written by src/inference/export.py, only needs torch
+
+    from src.inference.exported import load_exported
+    predict = load_exported('roadmap_bce.pt')
+    outputs = predict(sample, road_image)   # dict, same keys as model.predict
+"""
+import json
+
+import torch
+
+
+class ExportedPredictor:
+
+    def __init__(self, path):
+        extra_files = {'meta.json': ''}
+        self.module = torch.jit.load(path, map_location='cpu', _extra_files=extra_files)
+        self.meta = json.loads(extra_files['meta.json'])
+        self.keys = self.meta['keys']
+
+    @torch.no_grad()
+    def __call__(self, sample, road_image=None):
+        if road_image is None:
+            road_image = torch.zeros(sample.size(0), 800, 800, dtype=torch.bool)
+        return dict(zip(self.keys, self.module(sample, road_image)))
+
+
+def load_exported(path):
+    return ExportedPredictor(path)
@@ -0,0 +1,157 @@
+"""
+Inference preparation: folds every BatchNorm into the conv / linear before it and strips
+dropout, returning an equivalent eval-only copy of the model.
+
+Pairs folded: components_v2 Encoder (c1/bn1 .. c3/bn3), Decoder (dc1/bn1 .. dc3/bn3) and
+every DenseBlock (fc1/fc_bn), so every model in MODEL_NAMES through its encoder.
+
+python -m src.inference.fold_bn                               # random components_v2 encoder / decoder
+python -m src.inference.fold_bn --model roadmap_bce --ckpt_path rm.ckpt
+"""
+import copy
+import time
+from argparse import ArgumentParser
+
+import torch
+from torch import nn
+
+BN_TYPES = (nn.BatchNorm1d, nn.BatchNorm2d)
+
+
+def _bn_scale_shift(bn):
+    scale = bn.weight / torch.sqrt(bn.running_var + bn.eps) if bn.affine else 1 / torch.sqrt(bn.running_var + bn.eps)
+    shift = (bn.bias if bn.affine else 0) - bn.running_mean * scale
+    return scale, shift
+
+
+@torch.no_grad()
+def fold_bn_into(layer, bn):
+    """
+    layer: Linear / Conv2d / ConvTranspose2d followed by bn -> new layer computing bn(layer(x)) in eval
+    """
+    scale, shift = _bn_scale_shift(bn)
+    folded = copy.deepcopy(layer)
+
+    # output channels are dim 0, except for transposed convs where they are dim 1
+    out_dim = 1 if isinstance(layer, nn.ConvTranspose2d) else 0
+    shape = [1] * layer.weight.dim()
+    shape[out_dim] = -1
+    folded.weight.copy_(layer.weight * scale.reshape(shape))
+
+    bias = layer.bias if layer.bias is not None else torch.zeros_like(bn.running_mean)
+    if folded.bias is None:
+        folded.bias = nn.Parameter(torch.zeros_like(bn.running_mean))
+    folded.bias.copy_(bias * scale + shift)
+    return folded
+
+
+def _preceding_layer_name(module, bn_name):
+    # bn1 follows c1 (encoder) or dc1 (decoder), fc_bn follows fc1 (DenseBlock)
+    if bn_name == 'fc_bn':
+        return 'fc1'
+    if bn_name.startswith('bn'):
+        for prefix in ['c', 'dc']:
+            name = prefix + bn_name[2:]
+            if isinstance(getattr(module, name, None), (nn.Conv2d, nn.ConvTranspose2d)):
+                return name
+    return None
+
+
+def fold_batchnorm(model):
+    """
+    Returns an eval-mode copy of model with BN folded away and dropout stripped
+    """
+    model = copy.deepcopy(model).eval()
+
+    for module in list(model.modules()):
+        for bn_name, bn in list(module.named_children()):
+            if not isinstance(bn, BN_TYPES):
+                continue
+            layer_name = _preceding_layer_name(module, bn_name)
+            if layer_name is None:
+                continue
+            setattr(module, layer_name, fold_bn_into(getattr(module, layer_name), bn))
+            setattr(module, bn_name, nn.Identity())
+
+        # dropout is a no-op in eval: nn.Dropout modules go away, DenseBlock still calls F.dropout but with p=0
+        if hasattr(module, 'drop_p'):
+            module.drop_p = 0.
+        for name, child in list(module.named_children()):
+            if isinstance(child, nn.Dropout):
+                setattr(module, name, nn.Identity())
+
+    return model
+
+
+@torch.no_grad()
+def max_abs_diff(model, folded, inputs, fn=None):
+    fn = fn or (lambda m, x: m(x))
+    return max((fn(model, x) - fn(folded, x)).abs().max().item() for x in inputs)
+
+
+def latency(model, inputs, fn=None, repeats=3):
+    fn = fn or (lambda m, x: m(x))
+    with torch.no_grad():
+        fn(model, inputs[0])
+        start = time.time()
+        for _ in range(repeats):
+            for x in inputs:
+                fn(model, x)
+    return (time.time() - start) / (repeats * len(inputs))
+
+
+def _random_bn_stats(model):
+    # fresh BNs are the identity, give them something to fold
+    for m in model.modules():
+        if isinstance(m, BN_TYPES):
+            m.running_mean.uniform_(-0.5, 0.5)
+            m.running_var.uniform_(0.5, 2.)
+            m.weight.data.uniform_(0.5, 1.5)
+            m.bias.data.uniform_(-0.5, 0.5)
+    return model
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('--model', type=str, default=None, help='a MODEL_NAMES key, random v2 encoder / decoder if not set')
+    parser.add_argument('--ckpt_path', type=str, default=None)
+    parser.add_argument('--batch_size', type=int, default=2)
+    parser.add_argument('--atol', type=float, default=1e-4, help='largest allowed output difference after folding')
+    args = parser.parse_args()
+
+    rows = []
+    if args.model is None:
+        from src.autoencoder.components_v2 import Encoder, Decoder
+
+        encoder = _random_bn_stats(Encoder(128, 64, 3, 256, 306 * 6)).eval()
+        decoder = _random_bn_stats(Decoder(128, 64, 3, 256, 306)).eval()
+        rows.append(('v2 encoder', encoder, [torch.rand(args.batch_size, 3, 256, 306 * 6)], None))
+        rows.append(('v2 decoder', decoder, [torch.rand(args.batch_size, 64)], None))
+    else:
+        from src.submit import MODEL_NAMES
+
+        model = MODEL_NAMES[args.model].load_from_checkpoint(args.ckpt_path)
+        model.freeze()
+        sample = torch.rand(args.batch_size, 6, 3, 256, 306)
+        road_image = torch.rand(args.batch_size, 800, 800) > 0.5
+
+        def predict(m, x):
+            # compare the raw maps / latents, thresholded outputs hide small differences
+            out = m.predict(x, road_image)
+            return torch.cat([v.float().flatten() for v in out.values() if torch.is_tensor(v)])
+
+        rows.append((args.model, model.eval(), [sample], predict))
+
+    print('| model | max abs diff | fp32 ms / batch | folded ms / batch |')
+    print('|---|---|---|---|')
+    mismatched = []
+    for name, model, inputs, fn in rows:
+        folded = fold_batchnorm(model)
+        diff = max_abs_diff(model, folded, inputs, fn)
+        print(f'| {name} | {diff:.2e} | {latency(model, inputs, fn) * 1000:.1f} | '
+              f'{latency(folded, inputs, fn) * 1000:.1f} |')
+        if diff > args.atol:
+            mismatched.append(name)
+
+    if mismatched:
+        raise SystemExit(f'folded outputs differ by more than {args.atol}: {", ".join(mismatched)}')
@@ -0,0 +1,137 @@
+"""
+Change-aware encoder features: per camera c3 slices are cached by a hash of the input
+bytes they depend on, so on replay / frozen cameras only the cameras that changed go
+through the convs again.
+
+python -m src.inference.incremental --num_samples 30 --frozen_cameras 2
+"""
+import time
+import hashlib
+import collections
+from argparse import ArgumentParser
+
+import torch
+
+CAMERA_WIDTH = 306
+NUM_CAMERAS = 6
+
+# c1, c2 (3x3, pad 1) and c3 (3x3, stride 2, pad 1): a c3 column sees 3 input columns on each side
+RECEPTIVE_BORDER = 3
+# extra input columns computed around a changed camera, even to keep the stride 2 grid aligned
+# and wide enough that the zero padding at the window edge never reaches the kept columns
+WINDOW_BORDER = 4
+
+
+class CameraFeatureCache:
+    """
+    Drop in for encoder.conv_features on stitched [b, 3, 256, 1836] inputs
+
+    Every camera's c3 slice [32, 128, 153] is keyed by the bytes of the camera plus the
+    neighbouring columns its receptive field reaches into. Runs of consecutive missing
+    cameras are recomputed together in one window with a small border, then cropped.
+    """
+
+    def __init__(self, encoder, max_entries=6 * 256):
+        self.encoder = encoder
+        self.max_entries = max_entries
+        self.cache = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.
+
+    def _key(self, x, cam):
+        start = max(cam * CAMERA_WIDTH - RECEPTIVE_BORDER, 0)
+        end = min((cam + 1) * CAMERA_WIDTH + RECEPTIVE_BORDER, x.size(-1))
+        region = x[:, :, start:end].contiguous().cpu().numpy()
+        return hashlib.blake2b(region.tobytes(), digest_size=16).digest()
+
+    def _compute_run(self, x, first, last):
+        # cameras first..last (inclusive) -> list of their c3 slices
+        start = max(first * CAMERA_WIDTH - WINDOW_BORDER, 0)
+        end = min((last + 1) * CAMERA_WIDTH + WINDOW_BORDER, x.size(-1))
+        features = self.encoder.conv_features(x[:, :, start:end].unsqueeze(0)).squeeze(0)
+
+        out_width = CAMERA_WIDTH // 2
+        offset = (first * CAMERA_WIDTH - start) // 2
+        return [features[:, :, offset + i * out_width: offset + (i + 1) * out_width]
+                for i in range(last - first + 1)]
+
+    def _put(self, key, value):
+        self.cache[key] = value
+        self.cache.move_to_end(key)
+        while len(self.cache) > self.max_entries:
+            self.cache.popitem(last=False)
+
+    def _conv_features_single(self, x):
+        # x: [3, 256, 1836] -> [32, 128, 918]
+        keys = [self._key(x, cam) for cam in range(NUM_CAMERAS)]
+        slices = [self.cache.get(key) for key in keys]
+
+        cam = 0
+        while cam < NUM_CAMERAS:
+            if slices[cam] is not None:
+                self.hits += 1
+                self.cache.move_to_end(keys[cam])
+                cam += 1
+                continue
+            last = cam
+            while last + 1 < NUM_CAMERAS and slices[last + 1] is None:
+                last += 1
+            for i, feature in enumerate(self._compute_run(x, cam, last)):
+                slices[cam + i] = feature
+                self._put(keys[cam + i], feature)
+            self.misses += last - cam + 1
+            cam = last + 1
+
+        return torch.cat(slices, dim=-1)
+
+    @torch.no_grad()
+    def conv_features(self, x):
+        return torch.stack([self._conv_features_single(sample) for sample in x], dim=0)
+
+    def __call__(self, x):
+        return self.conv_features(x)
+
+
+def replay_sequence(num_samples, frozen_cameras, repeats):
+    # random stitched frames where the first `frozen_cameras` never change, every frame played `repeats` times
+    frozen = torch.rand(3, 256, CAMERA_WIDTH * frozen_cameras)
+    frames = []
+    for _ in range(num_samples):
+        live = torch.rand(3, 256, CAMERA_WIDTH * (NUM_CAMERAS - frozen_cameras))
+        frame = torch.cat([frozen, live], dim=-1).unsqueeze(0)
+        frames.extend([frame] * repeats)
+    return frames
+
+
+if __name__ == '__main__':
+    from src.autoencoder.components import Encoder
+
+    parser = ArgumentParser()
+    parser.add_argument('--num_samples', type=int, default=30)
+    parser.add_argument('--frozen_cameras', type=int, default=2)
+    parser.add_argument('--repeats', type=int, default=2, help='times every frame is replayed')
+    args = parser.parse_args()
+
+    # conv_features don't depend on the dense layers, build them for a tiny input
+    encoder = Encoder(128, 64, 3, 8, 8).eval()
+    cache = CameraFeatureCache(encoder)
+    frames = replay_sequence(args.num_samples, args.frozen_cameras, args.repeats)
+
+    with torch.no_grad():
+        start = time.time()
+        full = [encoder.conv_features(x) for x in frames]
+        full_time = time.time() - start
+
+        start = time.time()
+        cached = [cache.conv_features(x) for x in frames]
+        cached_time = time.time() - start
+
+    max_diff = max((a - b).abs().max().item() for a, b in zip(full, cached))
+    print(f'{len(frames)} frames, {args.frozen_cameras} frozen cameras, each frame x{args.repeats}')
+    print(f'full {full_time:.2f}s, cached {cached_time:.2f}s ({full_time / cached_time:.2f}x), '
+          f'hit rate {cache.hit_rate:.2%}, max abs diff {max_diff:.2e}')
@@ -0,0 +1,77 @@
+"""
+Load generator for src/inference/server.py: keeps --concurrency requests in flight with
+random samples and reports client side throughput / latency plus the server's /metrics
+
+python -m src.inference.load_gen --port 8800 --concurrency 16 --num_requests 200
+"""
+import io
+import json
+import time
+import asyncio
+from argparse import ArgumentParser
+
+import numpy as np
+
+
+async def _open(args):
+    if args.unix_socket:
+        return await asyncio.open_unix_connection(args.unix_socket)
+    return await asyncio.open_connection(args.host, args.port)
+
+
+async def request(reader, writer, method, path, body=b''):
+    writer.write(f'{method} {path} HTTP/1.1\r\nHost: localhost\r\nContent-Length: {len(body)}\r\n\r\n'.encode()
+                 + body)
+    await writer.drain()
+
+    status = (await reader.readline()).decode().split(' ', 2)[1]
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        key, value = line.decode().split(':', 1)
+        headers[key.strip().lower()] = value.strip()
+    body = await reader.readexactly(int(headers.get('content-length', 0)))
+    return int(status), body
+
+
+async def client(args, counter, latencies):
+    reader, writer = await _open(args)
+    buf = io.BytesIO()
+    np.save(buf, np.random.rand(6, 3, 256, 306).astype(np.float32))
+    payload = buf.getvalue()
+
+    while counter[0] < args.num_requests:
+        counter[0] += 1
+        start = time.time()
+        status, _ = await request(reader, writer, 'POST', '/predict', payload)
+        assert status == 200, status
+        latencies.append(time.time() - start)
+    writer.close()
+
+
+async def main(args):
+    counter, latencies = [0], []
+    start = time.time()
+    await asyncio.gather(*[client(args, counter, latencies) for _ in range(args.concurrency)])
+    elapsed = time.time() - start
+
+    latencies = np.array(latencies) * 1000
+    print(f'{len(latencies)} requests, concurrency {args.concurrency}: {len(latencies) / elapsed:.2f} req/sec, '
+          f'p50 {np.percentile(latencies, 50):.1f}ms, p99 {np.percentile(latencies, 99):.1f}ms')
+
+    reader, writer = await _open(args)
+    _, body = await request(reader, writer, 'GET', '/metrics')
+    writer.close()
+    print('server metrics:', json.dumps(json.loads(body), indent=2))
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('--host', type=str, default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8800)
+    parser.add_argument('--unix_socket', type=str, default=None)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--num_requests', type=int, default=200)
+    asyncio.run(main(parser.parse_args()))
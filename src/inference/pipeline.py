@@ -0,0 +1,58 @@
+import threading
+
+# end of stream marker passed between stages
+STOP = object()
+
+
+class Stage(threading.Thread):
+    """
+    Runs fn over the items of in_queue (or over an iterable), pushes results to out_queue
+
+    Queues should be bounded: a slow stage then blocks the ones before it (backpressure).
+    Every stage forwards STOP when its input is exhausted or it fails, errors are kept
+    in .error for whoever joins the pipeline.
+    """
+
+    def __init__(self, fn, out_queue, in_queue=None, iterable=None):
+        super().__init__(daemon=True)
+        self.fn = fn
+        self.in_queue = in_queue
+        self.iterable = iterable
+        self.out_queue = out_queue
+        self.error = None
+        self.stopped = threading.Event()
+
+    def _items(self):
+        if self.iterable is not None:
+            for item in self.iterable:
+                if self.stopped.is_set():
+                    return
+                yield item
+            return
+        while True:
+            item = self.in_queue.get()
+            if item is STOP:
+                return
+            yield item
+
+    def run(self):
+        try:
+            for item in self._items():
+                result = self.fn(item)
+                if self.out_queue is not None:
+                    self.out_queue.put(result)
+        except Exception as e:
+            self.error = e
+            # keep draining so the upstream stage never blocks on a full queue
+            if self.in_queue is not None:
+                while self.in_queue.get() is not STOP:
+                    pass
+        finally:
+            if self.out_queue is not None:
+                self.out_queue.put(STOP)
+
+
+def raise_errors(stages):
+    for stage in stages:
+        if stage.error is not None:
+            raise stage.error
@@ -0,0 +1,210 @@
+"""
+Structured channel pruning against a CPU latency budget.
+
+Prunable groups are the channels that don't leave the module, so every head keeps its input:
+    Encoder c1 -> c2 and c2 -> c3 (both at full input resolution)
+    SpatialMappingCNN six camera convs -> out_conv
+
+Channels are ranked by L1 norm of the producing filter times L1 norm of the consuming weights.
+Every round trial-prunes each group, keeps the one that buys the most latency per unit of
+importance removed, and stops once model.predict fits the budget. The pruned model is briefly
+fine-tuned with its own training loop and written as a (smaller) lightning style checkpoint,
+load it back with load_pruned.
+
+python -m src.inference.prune --model spatial_rm --ckpt_path sp.ckpt --budget_ms 150 --out sp_pruned.ckpt
+"""
+import os
+import time
+from argparse import ArgumentParser, Namespace
+
+import torch
+from torch import nn
+from pytorch_lightning import Trainer
+
+from src.autoencoder.components import Encoder
+from src.bounding_box_model.spatial_bb.components import SpatialMappingCNN
+from src.submit import MODEL_NAMES
+
+SPATIAL_CONVS = ['f_conv', 'fl_conv', 'fr_conv', 'b_conv', 'bl_conv', 'br_conv']
+
+
+def _copy_conv(conv, in_keep=None, out_keep=None):
+    weight = conv.weight.data
+    bias = conv.bias.data if conv.bias is not None else None
+    if out_keep is not None:
+        weight = weight[out_keep]
+        bias = bias[out_keep] if bias is not None else None
+    if in_keep is not None:
+        weight = weight[:, in_keep]
+
+    new = nn.Conv2d(weight.size(1), weight.size(0), kernel_size=conv.kernel_size, stride=conv.stride,
+                    padding=conv.padding, dilation=conv.dilation, bias=bias is not None)
+    new.weight.data.copy_(weight)
+    if bias is not None:
+        new.bias.data.copy_(bias)
+    new.weight.requires_grad = conv.weight.requires_grad
+    if new.bias is not None:
+        new.bias.requires_grad = conv.weight.requires_grad
+    return new.to(conv.weight.device)
+
+
+class ChannelGroup:
+    """
+    Channels produced by `producers` (out channels) and read by `consumers` (in channels) of `module`
+    """
+
+    def __init__(self, name, module, producers, consumers):
+        self.name = name
+        self.module = module
+        self.producers = producers
+        self.consumers = consumers
+
+    @property
+    def num_channels(self):
+        return getattr(self.module, self.consumers[0]).in_channels
+
+    def importance(self):
+        score = 0
+        for p in self.producers:
+            score = score + getattr(self.module, p).weight.detach().abs().flatten(1).sum(1)
+        for c in self.consumers:
+            score = score * getattr(self.module, c).weight.detach().abs().transpose(0, 1).flatten(1).sum(1)
+        return score
+
+    def prune(self, num_pruned):
+        # drops the num_pruned least important channels, returns (importance removed, undo)
+        score = self.importance()
+        order = score.argsort()
+        keep = order[num_pruned:].sort().values
+        removed = (score[order[:num_pruned]].sum() / score.sum()).item()
+
+        old = {n: getattr(self.module, n) for n in self.producers + self.consumers}
+        for n in self.producers:
+            setattr(self.module, n, _copy_conv(old[n], out_keep=keep))
+        for n in self.consumers:
+            setattr(self.module, n, _copy_conv(old[n], in_keep=keep))
+
+        def undo():
+            for n, conv in old.items():
+                setattr(self.module, n, conv)
+        return removed, undo
+
+
+def channel_groups(model):
+    groups = []
+    for name, m in model.named_modules():
+        if isinstance(m, Encoder):
+            groups.append(ChannelGroup(f'{name}.c1', m, ['c1'], ['c2']))
+            groups.append(ChannelGroup(f'{name}.c2', m, ['c2'], ['c3']))
+        elif isinstance(m, SpatialMappingCNN):
+            groups.append(ChannelGroup(f'{name}.convs', m, SPATIAL_CONVS, ['out_conv']))
+    return groups
+
+
+def latency(model, inputs, repeats=3):
+    # seconds per model.predict call
+    with torch.no_grad():
+        model.predict(*inputs)
+        start = time.time()
+        for _ in range(repeats):
+            model.predict(*inputs)
+    return (time.time() - start) / repeats
+
+
+def prune_to_budget(model, budget, inputs, step=0.125, min_channels=4, verbose=True):
+    """
+    Prunes until latency(model) <= budget (seconds) or no group can shrink any more
+    """
+    model.eval()
+    groups = channel_groups(model)
+    current = latency(model, inputs)
+    if verbose:
+        print(f'start: {current * 1000:.1f}ms, budget {budget * 1000:.1f}ms')
+
+    while current > budget:
+        best = None
+        for group in groups:
+            num_pruned = min(max(1, int(group.num_channels * step)), group.num_channels - min_channels)
+            if num_pruned <= 0:
+                continue
+            removed, undo = group.prune(num_pruned)
+            trial = latency(model, inputs)
+            undo()
+            gain = (current - trial) / max(removed, 1e-8)
+            if best is None or gain > best[0]:
+                best = (gain, group, num_pruned)
+
+        if best is None:
+            print('every group is at min_channels, budget not reached')
+            break
+        _, group, num_pruned = best
+        group.prune(num_pruned)
+        current = latency(model, inputs)
+        if verbose:
+            print(f'{group.name}: -{num_pruned} -> {group.num_channels} channels, {current * 1000:.1f}ms')
+    return model
+
+
+def save_pruned(model, path):
+    # same layout as a lightning checkpoint, the channel counts live in the weight shapes
+    torch.save({'state_dict': model.state_dict(), 'hparams': vars(model.hparams)}, path)
+
+
+def load_pruned(model_class, path):
+    """
+    Builds model_class from the checkpoint hparams, shrinks its prunable convs to the stored
+    weight shapes, then loads the weights
+    """
+    checkpoint = torch.load(path, map_location='cpu')
+    state_dict = checkpoint['state_dict']
+    model = model_class(Namespace(**checkpoint['hparams']))
+
+    modules = dict(model.named_modules())
+    for name, m in list(modules.items()):
+        if not isinstance(m, nn.Conv2d) or name + '.weight' not in state_dict:
+            continue
+        out_channels, in_channels = state_dict[name + '.weight'].shape[:2]
+        if (out_channels, in_channels) == (m.out_channels, m.in_channels):
+            continue
+        parent_name, _, attr = name.rpartition('.')
+        setattr(modules[parent_name], attr, _copy_conv(m, in_keep=torch.arange(in_channels), out_keep=torch.arange(out_channels)))
+
+    model.load_state_dict(state_dict)
+    return model
+
+
+def checkpoint_size_mb(path):
+    return os.path.getsize(path) / 2 ** 20
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('--model', type=str, required=True, choices=list(MODEL_NAMES))
+    parser.add_argument('--ckpt_path', type=str, required=True)
+    parser.add_argument('--budget_ms', type=float, required=True, help='CPU latency of one predict call')
+    parser.add_argument('--batch_size', type=int, default=1)
+    parser.add_argument('--step', type=float, default=0.125, help='fraction of a group pruned per round')
+    parser.add_argument('--min_channels', type=int, default=4)
+    parser.add_argument('--finetune_epochs', type=int, default=1)
+    parser.add_argument('--finetune_fraction', type=float, default=0.1, help='train_percent_check while fine-tuning')
+    parser.add_argument('--out', type=str, required=True)
+    args = parser.parse_args()
+
+    model = MODEL_NAMES[args.model].load_from_checkpoint(args.ckpt_path)
+    inputs = (torch.rand(args.batch_size, 6, 3, 256, 306), torch.rand(args.batch_size, 800, 800) > 0.5)
+
+    before = latency(model.eval(), inputs)
+    prune_to_budget(model, args.budget_ms / 1000, inputs, step=args.step, min_channels=args.min_channels)
+
+    if args.finetune_epochs > 0:
+        model.train()
+        trainer = Trainer(max_epochs=args.finetune_epochs, train_percent_check=args.finetune_fraction,
+                          checkpoint_callback=False, logger=False)
+        trainer.fit(model)
+
+    save_pruned(model, args.out)
+    after = latency(model.eval(), inputs)
+    print('| | ms / predict | checkpoint (MB) |')
+    print('|---|---|---|')
+    print(f'| original | {before * 1000:.1f} | {checkpoint_size_mb(args.ckpt_path):.1f} |')
+    print(f'| pruned | {after * 1000:.1f} | {checkpoint_size_mb(args.out):.1f} |')
@@ -0,0 +1,146 @@
+"""
+int8 export for CPU inference: dynamic quantization of every nn.Linear (Encoder.fc1 and the
+DenseBlocks, RoadMapBCE.fc1, ...) and optionally static quantization of the encoder convs,
+calibrated on a few validation samples. Reports road map threat score, latency and size
+against fp32.
+
+python -m src.inference.quantize --model roadmap_bce --ckpt_path rm.ckpt --static_convs --out rm_int8.pt
+"""
+import io
+import copy
+import time
+from argparse import ArgumentParser
+
+import numpy as np
+import torch
+import torchvision
+from torch import nn
+from torch.utils.data import DataLoader
+
+from src.submit import MODEL_NAMES
+from src.utils.data_helper import LabeledDataset
+from src.utils.helper import collate_fn, compute_ts_road_map, parse_scenes, held_out_scenes
+
+
+def _encoder_of(model):
+    if hasattr(model, 'encoder'):
+        return model.encoder
+    if hasattr(model, 'ae'):
+        return model.ae.encoder
+    return None
+
+
+def quantize_linears(model):
+    # weights stored as int8, activations quantized on the fly per batch
+    return torch.quantization.quantize_dynamic(model, {nn.Linear}, dtype=torch.qint8, inplace=True)
+
+
+def quantize_encoder_convs(encoder, calibration_inputs, backend='fbgemm'):
+    """
+    Static int8 for c1 -> c2 -> c3: quantize before c1, dequantize after c3, the F.relu in
+    between run on quantized tensors directly. calibration_inputs: stitched [b, 3, 256, 1836]
+    """
+    torch.backends.quantized.engine = backend
+    qconfig = torch.quantization.get_default_qconfig(backend)
+
+    encoder.c1 = nn.Sequential(torch.quantization.QuantStub(), encoder.c1)
+    encoder.c3 = nn.Sequential(encoder.c3, torch.quantization.DeQuantStub())
+    for conv in [encoder.c1, encoder.c2, encoder.c3]:
+        conv.qconfig = qconfig
+
+    # only modules with a qconfig get observers / get converted, the dense layers stay untouched
+    torch.quantization.prepare(encoder, inplace=True)
+    with torch.no_grad():
+        for x in calibration_inputs:
+            encoder.conv_features(x)
+    torch.quantization.convert(encoder, inplace=True)
+    return encoder
+
+
+def quantize_model(model, calibration_inputs=None):
+    model = copy.deepcopy(model).eval()
+    encoder = _encoder_of(model)
+    if calibration_inputs is not None and encoder is not None:
+        quantize_encoder_convs(encoder, calibration_inputs)
+    return quantize_linears(model)
+
+
+def model_size_mb(model):
+    buffer = io.BytesIO()
+    torch.save(model.state_dict(), buffer)
+    return len(buffer.getvalue()) / 2 ** 20
+
+
+def stitch(sample):
+    x = sample[:, [0, 1, 2, 5, 4, 3]]
+    b, num_imgs, c, h, w = x.size()
+    return x.permute(0, 2, 3, 1, 4).reshape(b, c, h, -1)
+
+
+def evaluate(model, batches):
+    # mean road map threat score (if the model predicts road maps) and seconds per sample
+    scores, elapsed, num_samples = [], 0., 0
+    for sample, road_image in batches:
+        start = time.time()
+        predictions = model.predict(sample, road_image)
+        elapsed += time.time() - start
+        num_samples += sample.size(0)
+        if 'road_map' in predictions:
+            scores.append(compute_ts_road_map(road_image.float(), predictions['road_map'].float()).item())
+    return (np.mean(scores) if scores else float('nan')), elapsed / num_samples
+
+
+def validation_batches(args):
+    dataset = LabeledDataset(image_folder=args.link,
+                             annotation_file=args.link + '/annotation.csv',
+                             scene_index=parse_scenes(args.val_scenes) if args.val_scenes else held_out_scenes(),
+                             transform=torchvision.transforms.ToTensor(),
+                             extra_info=False)
+    loader = DataLoader(dataset, batch_size=args.batch_size, shuffle=False, num_workers=4, collate_fn=collate_fn)
+
+    batches = []
+    for i, (sample, _, road_image) in enumerate(loader):
+        if i == args.num_batches:
+            break
+        batches.append((torch.stack(sample, dim=0), torch.stack(road_image, dim=0)))
+    return batches
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('--model', type=str, default='roadmap_bce', choices=list(MODEL_NAMES))
+    parser.add_argument('--ckpt_path', type=str, required=True)
+    parser.add_argument('--link', type=str, default='/scratch/ab8690/DLSP20Dataset/data')
+    parser.add_argument('--val_scenes', type=str, default=None,
+                        help="e.g. '106,109,115', default: the model's held-out split")
+    parser.add_argument('--batch_size', type=int, default=4)
+    parser.add_argument('--num_batches', type=int, default=20)
+    parser.add_argument('--static_convs', default=False, action='store_true',
+                        help='also quantize the encoder convs, calibrated on the first validation batches')
+    parser.add_argument('--num_calibration_batches', type=int, default=4)
+    parser.add_argument('--out', type=str, default=None)
+    args = parser.parse_args()
+
+    torch.set_grad_enabled(False)
+    model = MODEL_NAMES[args.model].load_from_checkpoint(args.ckpt_path)
+    model.freeze()
+    model.eval()
+
+    batches = validation_batches(args)
+    calibration = None
+    if args.static_convs:
+        calibration = [stitch(sample) for sample, _ in batches[:args.num_calibration_batches]]
+    qmodel = quantize_model(model, calibration)
+
+    fp32_ts, fp32_latency = evaluate(model, batches)
+    int8_ts, int8_latency = evaluate(qmodel, batches)
+
+    print('| | threat score | ms / sample | size (MB) |')
+    print('|---|---|---|---|')
+    print(f'| fp32 | {fp32_ts:.4f} | {fp32_latency * 1000:.1f} | {model_size_mb(model):.1f} |')
+    print(f'| int8 | {int8_ts:.4f} | {int8_latency * 1000:.1f} | {model_size_mb(qmodel):.1f} |')
+    print(f'threat score delta {int8_ts - fp32_ts:+.4f}, speedup {fp32_latency / int8_latency:.2f}x')
+
+    if args.out:
+        # whole module, load with torch.load in a process that can import src
+        torch.save(qmodel, args.out)
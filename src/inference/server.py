@@ -0,0 +1,222 @@
+"""
+Local prediction server with dynamic micro-batching
+
+Concurrent requests are queued and coalesced into batches of at most --max_batch_size,
+waiting at most --max_wait_ms for a batch to fill up, then run through the model in a
+worker thread so the event loop keeps accepting requests.
+
+    POST /predict   body: np.save of one float32 sample [6, 3, 256, 306]
+                    response: np.savez of that sample's predictions (see prediction_io)
+    GET  /metrics   json: queue depth, batch sizes, p50 / p99 latency
+
+python -m src.inference.server --model roadmap_bce --ckpt_path rm.ckpt --port 8800
+python -m src.inference.server --rm_ckpt_path rm.ckpt --box_model spatial_rm --box_ckpt_path bb.ckpt --unix_socket /tmp/dd.sock
+"""
+import io
+import json
+import time
+import asyncio
+import collections
+from argparse import ArgumentParser
+
+import numpy as np
+import torch
+
+from src.utils.prediction_io import pack_predictions
+
+NEEDS_ROAD_MAP = ['spatial_rm', 'faster_rcnn_rm']
+SAMPLE_SHAPE = (6, 3, 256, 306)
+
+
+class Metrics:
+    """
+    Counters exposed on /metrics, latencies over the last `window` requests
+    """
+
+    def __init__(self, window=1000):
+        self.latencies = collections.deque(maxlen=window)
+        self.batch_sizes = collections.deque(maxlen=window)
+        self.num_requests = 0
+        self.num_batches = 0
+
+    def report(self, queue_depth):
+        latencies = np.array(self.latencies) * 1000 if self.latencies else np.zeros(1)
+        return {
+            'queue_depth': queue_depth,
+            'num_requests': self.num_requests,
+            'num_batches': self.num_batches,
+            'mean_batch_size': float(np.mean(self.batch_sizes)) if self.batch_sizes else 0.,
+            'p50_latency_ms': float(np.percentile(latencies, 50)),
+            'p99_latency_ms': float(np.percentile(latencies, 99)),
+        }
+
+
+class MicroBatcher:
+    """
+    Collects single samples into batches for predict_fn([b, 6, 3, 256, 306]) -> predictions dict
+    """
+
+    def __init__(self, predict_fn, max_batch_size=8, max_wait_ms=10):
+        self.predict_fn = predict_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.queue = asyncio.Queue()
+        self.metrics = Metrics()
+
+    async def submit(self, sample):
+        future = asyncio.get_event_loop().create_future()
+        await self.queue.put((sample, future, time.time()))
+        return await future
+
+    async def _next_batch(self):
+        # block for the first request, then fill up until full or max_wait is over
+        batch = [await self.queue.get()]
+        deadline = time.time() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def run(self):
+        loop = asyncio.get_event_loop()
+        while True:
+            batch = await self._next_batch()
+            try:
+                samples = torch.stack([sample for sample, _, _ in batch], dim=0)
+                predictions = await loop.run_in_executor(None, self.predict_fn, samples)
+            except Exception as e:
+                for _, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            now = time.time()
+            self.metrics.num_batches += 1
+            self.metrics.batch_sizes.append(len(batch))
+            for i, (_, future, arrival) in enumerate(batch):
+                # the handler of a client that disconnected is cancelled, its future with it
+                if future.done():
+                    continue
+                future.set_result({k: v[i:i + 1] for k, v in predictions.items()})
+                self.metrics.num_requests += 1
+                self.metrics.latencies.append(now - arrival)
+
+
+def _response(status, body, content_type):
+    head = (f'HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\n'
+            f'Content-Length: {len(body)}\r\nConnection: keep-alive\r\n\r\n')
+    return head.encode() + body
+
+
+class PredictionServer:
+
+    def __init__(self, batcher):
+        self.batcher = batcher
+
+    async def _handle_request(self, method, path, body):
+        if method == 'GET' and path == '/metrics':
+            report = self.batcher.metrics.report(self.batcher.queue.qsize())
+            return _response('200 OK', json.dumps(report).encode(), 'application/json')
+
+        if method == 'POST' and path == '/predict':
+            # a bad sample must not reach the batcher, it would fail the whole batch it lands in
+            try:
+                sample = np.load(io.BytesIO(body))
+            except (ValueError, OSError, EOFError) as e:
+                return _response('400 Bad Request', str(e).encode(), 'text/plain')
+            if not isinstance(sample, np.ndarray) or sample.shape != SAMPLE_SHAPE or sample.dtype.kind not in 'fiu':
+                message = f'expected np.save of a numeric array of shape {SAMPLE_SHAPE}'
+                return _response('400 Bad Request', message.encode(), 'text/plain')
+            sample = torch.from_numpy(sample).float()
+            predictions = await self.batcher.submit(sample)
+            out = io.BytesIO()
+            np.savez(out, **pack_predictions(predictions))
+            return _response('200 OK', out.getvalue(), 'application/octet-stream')
+
+        return _response('404 Not Found', b'', 'text/plain')
+
+    async def handle(self, reader, writer):
+        # minimal http/1.1 with keep-alive, enough for a local planner process
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, path, _ = request_line.decode().split(' ', 2)
+
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    key, value = line.decode().split(':', 1)
+                    headers[key.strip().lower()] = value.strip()
+
+                body = await reader.readexactly(int(headers.get('content-length', 0)))
+                try:
+                    response = await self._handle_request(method, path, body)
+                except Exception as e:
+                    response = _response('500 Internal Server Error', str(e).encode(), 'text/plain')
+                writer.write(response)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionResetError):
+            pass
+        finally:
+            writer.close()
+
+
+def build_predict_fn(args):
+    from src.submit import MODEL_NAMES
+    from src.inference.engine import load_engine
+
+    if args.rm_ckpt_path is not None:
+        engine = load_engine(args.rm_model, args.rm_ckpt_path, args.box_model, args.box_ckpt_path)
+        return engine.predict
+
+    if args.model in NEEDS_ROAD_MAP:
+        raise ValueError(f'{args.model} needs a road map, serve it through the engine (--rm_ckpt_path)')
+    model = MODEL_NAMES[args.model].load_from_checkpoint(args.ckpt_path)
+    model.freeze()
+    model.eval()
+    return lambda sample: model.predict(sample, None)
+
+
+async def serve(predict_fn, args):
+    batcher = MicroBatcher(predict_fn, args.max_batch_size, args.max_wait_ms)
+    server = PredictionServer(batcher)
+    asyncio.ensure_future(batcher.run())
+
+    if args.unix_socket:
+        srv = await asyncio.start_unix_server(server.handle, path=args.unix_socket)
+        print(f'serving on {args.unix_socket}')
+    else:
+        srv = await asyncio.start_server(server.handle, host=args.host, port=args.port)
+        print(f'serving on {args.host}:{args.port}')
+
+    async with srv:
+        await srv.serve_forever()
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('--model', type=str, default='roadmap_bce')
+    parser.add_argument('--ckpt_path', type=str, default=None)
+    # engine mode: roadmap + box model on one encoder
+    parser.add_argument('--rm_model', type=str, default='roadmap_bce')
+    parser.add_argument('--rm_ckpt_path', type=str, default=None)
+    parser.add_argument('--box_model', type=str, default=None)
+    parser.add_argument('--box_ckpt_path', type=str, default=None)
+
+    parser.add_argument('--host', type=str, default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8800)
+    parser.add_argument('--unix_socket', type=str, default=None)
+    parser.add_argument('--max_batch_size', type=int, default=8)
+    parser.add_argument('--max_wait_ms', type=float, default=10)
+    args = parser.parse_args()
+
+    asyncio.run(serve(build_predict_fn(args), args))
@@ -0,0 +1,109 @@
+"""
+Streaming per-scene prediction: samples go in as an ordered iterator and predictions come
+out in the same order. Decode, encoder, heads and post-processing each run on their own
+thread, connected by bounded queues, so on a CPU node the stages overlap instead of
+running stop-and-go.
+
+python -m src.inference.streaming --rm_ckpt_path rm.ckpt --box_model spatial_rm --box_ckpt_path bb.ckpt --scene 106
+"""
+import time
+import queue
+from argparse import ArgumentParser
+
+import numpy as np
+import torch
+import torchvision
+
+from src.inference.engine import load_engine
+from src.inference.pipeline import Stage, STOP, raise_errors
+from src.utils.data_helper import UnlabeledDataset
+
+
+def _batches(samples, batch_size):
+    # items can be [6, 3, 256, 306] tensors or dataset items with the images first
+    batch = []
+    for sample in samples:
+        if isinstance(sample, (tuple, list)):
+            sample = sample[0]
+        batch.append(sample)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def stream_predict(engine, samples, batch_size=1, queue_size=2):
+    """
+    Yields engine predictions for every item of samples, in order, one dict per sample
+
+    batch_size: samples per pass through the stages, queue_size: batches buffered between
+    two stages before the upstream one blocks
+    """
+    queues = [queue.Queue(maxsize=queue_size) for _ in range(4)]
+    stages = [
+        Stage(lambda batch: torch.stack(batch, dim=0).float(), queues[0], iterable=_batches(samples, batch_size)),
+        Stage(engine.encode, queues[1], in_queue=queues[0]),
+        Stage(engine.run_heads, queues[2], in_queue=queues[1]),
+        Stage(engine.postprocess, queues[3], in_queue=queues[2]),
+    ]
+    for stage in stages:
+        stage.start()
+
+    try:
+        while True:
+            predictions = queues[3].get()
+            if predictions is STOP:
+                break
+            num_samples = len(next(iter(predictions.values())))
+            for i in range(num_samples):
+                yield {k: v[i:i + 1] for k, v in predictions.items()}
+    finally:
+        # consumer stopped early: stop reading input, STOP then travels down the stages on its own.
+        # Only the last queue is ours to drain (taking a STOP off the others would block the next
+        # stage), keep at it until every stage has exited, or the last one blocks on a full queue
+        stages[0].stopped.set()
+        while any(stage.is_alive() for stage in stages):
+            try:
+                queues[3].get(timeout=0.01)
+            except queue.Empty:
+                pass
+
+    raise_errors(stages)
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('--rm_model', type=str, default='roadmap_bce')
+    parser.add_argument('--rm_ckpt_path', type=str, required=True)
+    parser.add_argument('--box_model', type=str, default=None)
+    parser.add_argument('--box_ckpt_path', type=str, default=None)
+    parser.add_argument('--link', type=str, default='/scratch/ab8690/DLSP20Dataset/data')
+    parser.add_argument('--scene', type=int, default=106)
+    parser.add_argument('--batch_size', type=int, default=1)
+    parser.add_argument('--queue_size', type=int, default=2)
+    parser.add_argument('--feature_cache', default=False, action='store_true',
+                        help='reuse encoder features of unchanged cameras')
+    args = parser.parse_args()
+
+    engine = load_engine(args.rm_model, args.rm_ckpt_path, args.box_model, args.box_ckpt_path,
+                         feature_cache=args.feature_cache)
+    scene = UnlabeledDataset(image_folder=args.link,
+                             scene_index=np.array([args.scene]),
+                             first_dim='sample',
+                             transform=torchvision.transforms.ToTensor())
+
+    # baseline: decode + predict one sample after the other
+    start = time.time()
+    for i in range(len(scene)):
+        engine.predict(scene[i].unsqueeze(0))
+    sequential = len(scene) / (time.time() - start)
+
+    start = time.time()
+    num_samples = sum(1 for _ in stream_predict(engine, (scene[i] for i in range(len(scene))),
+                                                args.batch_size, args.queue_size))
+    streamed = num_samples / (time.time() - start)
+
+    print(f'scene {args.scene}: sequential {sequential:.2f} samples/sec, streamed {streamed:.2f} samples/sec')
+    if engine.feature_cache is not None:
+        print(f'camera feature cache hit rate {engine.feature_cache.hit_rate:.2%}')
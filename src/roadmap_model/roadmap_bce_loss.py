@@ -14,7 +14,7 @@ from test_tube import HyperOptArgumentParser
 
 from src.utils import convert_map_to_lane_map
 from src.utils.data_helper import LabeledDataset
-from src.utils.helper import collate_fn
+from src.utils.helper import collate_fn, split_scenes
 from src.autoencoder.autoencoder import BasicAE
 from src.utils.helper import compute_ts_road_map
 
@@ -160,13 +160,10 @@ class RoadMapBCE(LightningModule):
         image_folder = self.hparams.link
         annotation_csv = self.hparams.link + '/annotation.csv'
         labeled_scene_index = np.arange(106, 134)
-        trainset_size = round(0.8 * len(labeled_scene_index))
 
         # split into train / validation sets at the scene index level
         # before I did this at the sample level --> this will cause leakage (!!)
-        np.random.shuffle(labeled_scene_index)
-        train_set_index = labeled_scene_index[:trainset_size]
-        valid_set_index = labeled_scene_index[trainset_size:]
+        train_set_index, valid_set_index = split_scenes(labeled_scene_index)
 
         transform = torchvision.transforms.ToTensor()
 
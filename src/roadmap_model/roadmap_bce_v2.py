@@ -1,3 +1,4 @@
+import time
 import random
 import numpy as np
 import torch
@@ -14,9 +15,11 @@ from test_tube import HyperOptArgumentParser
 
 from src.utils import convert_map_to_lane_map
 from src.utils.data_helper import LabeledDataset
-from src.utils.helper import collate_fn
+from src.utils.helper import collate_fn, split_scenes
 from src.autoencoder.autoencoder import BasicAE
 from src.utils.helper import compute_ts_road_map
+from src.utils.execution import apply_exec_mode, exec_context, add_exec_mode_args
+from src.utils.importance_sampling import LossImportanceSampler, add_importance_sampling_args
 
 random.seed(20200505)
 np.random.seed(20200505)
@@ -45,14 +48,23 @@ class RoadMapBCE(LightningModule):
         self.frozen = True
         self.ae.freeze()
         self.ae.decoder = None
+        self.ae.encoder.checkpoint = hparams.ckpt_encoder if hasattr(hparams, 'ckpt_encoder') else False
 
         # MLP layers: feature embedding --> predict binary roadmap
         self.fc1 = nn.Linear(self.ae.latent_dim, self.output_dim)
+
+        # precision / memory format the forward pass runs in
+        self.exec_mode = hparams.exec_mode if hasattr(hparams, 'exec_mode') else 'fp32'
+        apply_exec_mode(self, self.exec_mode)
         #self.fc2 = nn.Linear(200000, self.output_dim)
 
+        # set in train_dataloader when --importance_sampling is on
+        self.train_sampler = None
+        self.fit_start_time = None
+
     def wide_stitch_six_images(self, sample):
-        # change from tuple len([6 x 3 x H x W]) = b --> tensor [b x 6 x 3 x H x W]
-        x = torch.stack(sample, dim=0)
+        # change from tuple len([6 x 3 x H x W]) = b --> tensor [b x 6 x 3 x H x W], predict passes the tensor
+        x = torch.stack(sample, dim=0) if isinstance(sample, (list, tuple)) else sample
 
         # reorder order of 6 images (in first dimension) to become 180 degree view
         x = x[:, [0, 1, 2, 5, 4, 3]]
@@ -80,6 +92,13 @@ class RoadMapBCE(LightningModule):
 
         return y, torch.sigmoid(y)
 
+    @torch.no_grad()
+    def predict(self, sample, road_image=None):
+        # sample: [b, 6, 3, 256, 306] -> road_map: bool [b, 800, 800]
+        with exec_context(self.exec_mode):
+            _, pred_rm = self(sample)
+        return {'road_map': pred_rm.float() > 0.5}
+
     def _run_step(self, batch, batch_idx, step_name):
         sample, target, road_image = batch
 
@@ -87,7 +106,9 @@ class RoadMapBCE(LightningModule):
         target_rm = torch.stack(road_image, dim=0).float()
 
         # forward pass to find predicted roadmap
-        pred_rm, pred_logit_rm = self(sample)
+        with exec_context(self.exec_mode):
+            pred_rm, pred_logit_rm = self(sample)
+        pred_rm, pred_logit_rm = pred_rm.float(), pred_logit_rm.float()
 
         # every 10 epochs we look at inputs + predictions
         if batch_idx % self.hparams.output_img_freq == 0:
@@ -103,10 +124,17 @@ class RoadMapBCE(LightningModule):
         batch_size = target_rm.size(0)
         target_rm_flat = target_rm.view(batch_size, -1)
         pred_rm_flat = pred_rm.view(batch_size, -1)
-        loss = F.binary_cross_entropy_with_logits(pred_rm_flat, target_rm_flat) #ok. 
+        per_sample_loss = F.binary_cross_entropy_with_logits(pred_rm_flat, target_rm_flat, reduction='none').mean(1)
+        if step_name == 'train' and self.train_sampler is not None:
+            loss = self.train_sampler.reweight(batch_idx, per_sample_loss)
+        else:
+            loss = per_sample_loss.mean()
 
         return loss, target_rm, pred_rm, pred_logit_rm 
 
+    def on_train_start(self):
+        self.fit_start_time = time.time()
+
     def _log_rm_images(self, x, target_rm, pred_rm, step_name, limit=1):
         # log 6 images stitched wide, target/true roadmap and predicted roadmap
         # take first image in the batch
@@ -149,6 +177,10 @@ class RoadMapBCE(LightningModule):
         val_tensorboard_logs = {'avg_val_loss': avg_val_loss,
                                 'avg_val_ts_rounded': avg_val_ts_rounded,
                                 'avg_val_ts': avg_val_ts}
+
+        # wall clock since fit started, plot avg_val_ts against this for time-to-threat-score
+        if self.fit_start_time is not None:
+            val_tensorboard_logs['train_time_sec'] = torch.tensor(time.time() - self.fit_start_time)
         return {'val_loss': avg_val_loss, 'log': val_tensorboard_logs}
 
     def configure_optimizers(self):
@@ -160,13 +192,10 @@ class RoadMapBCE(LightningModule):
         image_folder = self.hparams.link
         annotation_csv = self.hparams.link + '/annotation.csv'
         labeled_scene_index = np.arange(106, 134)
-        trainset_size = round(0.8 * len(labeled_scene_index))
 
         # split into train / validation sets at the scene index level
         # before I did this at the sample level --> this will cause leakage (!!)
-        np.random.shuffle(labeled_scene_index)
-        train_set_index = labeled_scene_index[:trainset_size]
-        valid_set_index = labeled_scene_index[trainset_size:]
+        train_set_index, valid_set_index = split_scenes(labeled_scene_index)
 
         transform = torchvision.transforms.ToTensor()
 
@@ -185,10 +214,14 @@ class RoadMapBCE(LightningModule):
                                                extra_info=False)
 
     def train_dataloader(self):
+        if getattr(self.hparams, 'importance_sampling', False):
+            self.train_sampler = LossImportanceSampler(len(self.labeled_trainset), self.hparams.batch_size,
+                                                       floor=self.hparams.is_floor, beta=self.hparams.is_beta)
         loader = DataLoader(self.labeled_trainset,
                             batch_size=self.hparams.batch_size,
-                            shuffle=True,
-                            num_workers=4,
+                            shuffle=self.train_sampler is None,
+                            sampler=self.train_sampler,
+                            num_workers=self.hparams.num_workers if hasattr(self.hparams, 'num_workers') else 4,
                             collate_fn=collate_fn)
         return loader
 
@@ -197,7 +230,7 @@ class RoadMapBCE(LightningModule):
         loader = DataLoader(self.labeled_validset,
                             batch_size=self.hparams.batch_size,
                             shuffle=False,
-                            num_workers=4,
+                            num_workers=self.hparams.num_workers if hasattr(self.hparams, 'num_workers') else 4,
                             collate_fn=collate_fn)
         return loader
 
@@ -217,6 +250,11 @@ class RoadMapBCE(LightningModule):
        #parser.add_argument('--pretrained_path', type=str, default='/scratch/ab8690/logs/dd_pretrain_ae/lightning_logs/version_9234267/checkpoints/epoch=42.ckpt')
         parser.add_argument('--pretrained_path', type=str, default='/scratch/ab8690/logs/space_bb_pretrain/lightning_logs/version_9604234/checkpoints/epoch=23.ckpt')
         parser.add_argument('--output_img_freq', type=int, default=500)
+
+        # activation checkpointing, trades recompute in backward for a smaller memory footprint
+        parser.add_argument('--ckpt_encoder', default=False, action='store_true')
+        parser = add_exec_mode_args(parser)
+        parser = add_importance_sampling_args(parser)
         return parser
 
 
@@ -0,0 +1,288 @@
+import random
+import numpy as np
+import torch
+
+from argparse import ArgumentParser
+
+import torchvision
+from torch import nn
+from torch.nn import functional as F
+from torch.utils.data import DataLoader
+
+from pytorch_lightning import LightningModule, Trainer
+from test_tube import HyperOptArgumentParser
+
+from src.utils.data_helper import LabeledDataset, UnlabeledDataset
+from src.utils.helper import collate_fn
+from src.utils.helper import compute_ts_road_map, parse_scenes, held_out_scenes
+from src.roadmap_model.roadmap_pretrain_ae import RoadMap
+from src.roadmap_model.roadmap_bce_v2 import RoadMapBCE
+from src.utils.execution import apply_exec_mode, exec_context, add_exec_mode_args
+
+random.seed(20200505)
+np.random.seed(20200505)
+torch.manual_seed(20200505)
+
+TEACHERS = {
+    'roadmap_mse': RoadMap,
+    'roadmap_bce': RoadMapBCE,
+}
+
+
+class StudentRoadMapCNN(nn.Module):
+    """
+    Small road map predictor: strided convs on a downscaled wide image -> pooled latent
+    -> fc to a coarse map -> transposed convs -> bilinear upsample to 800 x 800 logits
+    """
+
+    def __init__(self, width=16, input_scale=0.5, map_channels=8, map_size=25):
+        super().__init__()
+        self.input_scale = input_scale
+        self.map_channels = map_channels
+        self.map_size = map_size
+
+        self.convs = nn.Sequential(
+            nn.Conv2d(3, width, kernel_size=3, stride=2, padding=1),
+            nn.BatchNorm2d(width),
+            nn.ReLU(inplace=True),
+            nn.Conv2d(width, 2 * width, kernel_size=3, stride=2, padding=1),
+            nn.BatchNorm2d(2 * width),
+            nn.ReLU(inplace=True),
+            nn.Conv2d(2 * width, 4 * width, kernel_size=3, stride=2, padding=1),
+            nn.BatchNorm2d(4 * width),
+            nn.ReLU(inplace=True),
+            nn.Conv2d(4 * width, 4 * width, kernel_size=3, stride=2, padding=1),
+            nn.BatchNorm2d(4 * width),
+            nn.ReLU(inplace=True),
+        )
+        # keep the left -> right camera layout, the map isn't translation invariant w.r.t. the cameras
+        self.pool = nn.AdaptiveAvgPool2d((2, 12))
+        self.fc = nn.Linear(4 * width * 2 * 12, map_channels * map_size * map_size)
+
+        self.up = nn.Sequential(
+            nn.ConvTranspose2d(map_channels, map_channels, kernel_size=4, stride=2, padding=1),
+            nn.ReLU(inplace=True),
+            nn.ConvTranspose2d(map_channels, map_channels, kernel_size=4, stride=2, padding=1),
+            nn.ReLU(inplace=True),
+            nn.Conv2d(map_channels, 1, kernel_size=3, padding=1),
+        )
+
+    def forward(self, x):
+        if self.input_scale != 1:
+            x = F.interpolate(x, scale_factor=self.input_scale, mode='bilinear', align_corners=False)
+        x = self.pool(self.convs(x)).flatten(1)
+        x = F.relu(self.fc(x)).reshape(x.size(0), self.map_channels, self.map_size, self.map_size)
+        x = self.up(x)
+        x = F.interpolate(x, size=(800, 800), mode='bilinear', align_corners=False)
+        return x.squeeze(1)
+
+
+class RoadMapDistill(LightningModule):
+    """
+    Trains StudentRoadMapCNN on the unlabeled scenes against the soft road maps of a frozen
+    road map teacher, validates both against the labeled road maps
+    """
+
+    def __init__(self, hparams):
+        super().__init__()
+        self.hparams = hparams
+
+        self.student = StudentRoadMapCNN(width=self.hparams.student_width,
+                                         input_scale=self.hparams.student_input_scale,
+                                         map_channels=self.hparams.student_map_channels,
+                                         map_size=self.hparams.student_map_size)
+
+        # loaded only for training, a trained student checkpoint doesn't need the teacher
+        self.teacher = None
+        if getattr(self.hparams, 'teacher_path', None):
+            self.teacher = TEACHERS[self.hparams.teacher_model].load_from_checkpoint(self.hparams.teacher_path)
+            self.teacher.freeze()
+
+        # precision / memory format the forward pass runs in
+        self.exec_mode = hparams.exec_mode if hasattr(hparams, 'exec_mode') else 'fp32'
+        apply_exec_mode(self.student, self.exec_mode)
+
+    def state_dict(self, *args, **kwargs):
+        # keep the teacher out of the student checkpoints
+        state = super().state_dict(*args, **kwargs)
+        for k in [k for k in state if k.startswith('teacher.')]:
+            del state[k]
+        return state
+
+    def load_state_dict(self, state_dict, strict=True):
+        return super().load_state_dict(state_dict, strict=strict and self.teacher is None)
+
+    def train(self, mode=True):
+        # lightning calls model.train() after every validation, the teacher has to stay in eval:
+        # no dropout on the soft targets and no batch norm running stats updates while it labels
+        super().train(mode)
+        if self.teacher is not None:
+            self.teacher.eval()
+        return self
+
+    def wide_stitch_six_images(self, sample):
+        # [b x 6 x 3 x H x W] -> [b x 3 x H x 6W], same camera order as the teacher
+        x = sample[:, [0, 1, 2, 5, 4, 3]]
+        b, num_imgs, c, h, w = x.size()
+        x = x.permute(0, 2, 3, 1, 4).reshape(b, c, h, -1)
+        return x
+
+    def forward(self, sample):
+        # sample: [b, 6, 3, 256, 306] -> road map logits [b, 800, 800]
+        return self.student(self.wide_stitch_six_images(sample))
+
+    @torch.no_grad()
+    def teacher_soft_map(self, sample):
+        out = self.teacher(sample)
+        # RoadMapBCE returns (logits, probabilities), RoadMap only probabilities
+        return (out[-1] if isinstance(out, tuple) else out).float()
+
+    @torch.no_grad()
+    def predict(self, sample, road_image=None):
+        # sample: [b, 6, 3, 256, 306] -> road_map: bool [b, 800, 800]
+        with exec_context(self.exec_mode):
+            logits = self(sample)
+        return {'road_map': logits.float() > 0}
+
+    def training_step(self, batch, batch_idx):
+        sample = batch
+        soft_target = self.teacher_soft_map(sample)
+
+        with exec_context(self.exec_mode):
+            logits = self(sample)
+        loss = F.binary_cross_entropy_with_logits(logits.float(), soft_target)
+
+        train_tensorboard_logs = {'train_loss': loss}
+        return {'loss': loss, 'log': train_tensorboard_logs}
+
+    def validation_step(self, batch, batch_idx):
+        sample, target, road_image = batch
+        sample = torch.stack(sample, dim=0)
+        target_rm = torch.stack(road_image, dim=0).float()
+
+        soft_target = self.teacher_soft_map(sample)
+        with exec_context(self.exec_mode):
+            logits = self(sample).float()
+        val_loss = F.binary_cross_entropy_with_logits(logits, soft_target)
+
+        # threat score of student and teacher against the labeled road maps
+        val_ts = compute_ts_road_map(target_rm, (logits > 0).float())
+        teacher_ts = compute_ts_road_map(target_rm, soft_target.round())
+        agreement_ts = compute_ts_road_map(soft_target.round(), (logits > 0).float())
+
+        return {'val_loss': val_loss, 'val_ts': val_ts, 'teacher_ts': teacher_ts, 'agreement_ts': agreement_ts}
+
+    def validation_epoch_end(self, outputs):
+        avg_val_loss = torch.stack([x['val_loss'] for x in outputs]).mean()
+        avg_val_ts = torch.stack([x['val_ts'] for x in outputs]).mean()
+        avg_teacher_ts = torch.stack([x['teacher_ts'] for x in outputs]).mean()
+        avg_agreement_ts = torch.stack([x['agreement_ts'] for x in outputs]).mean()
+        val_tensorboard_logs = {'avg_val_loss': avg_val_loss,
+                                'avg_val_ts': avg_val_ts,
+                                'avg_teacher_ts': avg_teacher_ts,
+                                'avg_agreement_ts': avg_agreement_ts}
+        return {'val_loss': avg_val_loss, 'log': val_tensorboard_logs}
+
+    def configure_optimizers(self):
+        return torch.optim.Adam(self.student.parameters(), lr=self.hparams.learning_rate)
+
+    def prepare_data(self):
+        image_folder = self.hparams.link
+        transform = torchvision.transforms.ToTensor()
+
+        # the teacher labels every unlabeled scene, the labeled scenes are only used to validate
+        self.unlabeled_trainset = UnlabeledDataset(image_folder=image_folder,
+                                                   scene_index=np.arange(106),
+                                                   first_dim='sample',
+                                                   transform=transform)
+
+        # only the teacher's held-out scenes, on its training scenes teacher_ts would be inflated
+        val_scenes = self.hparams.val_scenes if hasattr(self.hparams, 'val_scenes') else None
+        val_scene_index = parse_scenes(val_scenes) if val_scenes else held_out_scenes()
+        self.labeled_validset = LabeledDataset(image_folder=image_folder,
+                                               annotation_file=image_folder + '/annotation.csv',
+                                               scene_index=val_scene_index,
+                                               transform=transform,
+                                               extra_info=False)
+
+    def train_dataloader(self):
+        loader = DataLoader(self.unlabeled_trainset,
+                            batch_size=self.hparams.batch_size,
+                            shuffle=True,
+                            num_workers=self.hparams.num_workers if hasattr(self.hparams, 'num_workers') else 4)
+        return loader
+
+    def val_dataloader(self):
+        # don't shuffle validation batches
+        loader = DataLoader(self.labeled_validset,
+                            batch_size=self.hparams.batch_size,
+                            shuffle=False,
+                            num_workers=self.hparams.num_workers if hasattr(self.hparams, 'num_workers') else 4,
+                            collate_fn=collate_fn)
+        return loader
+
+    @staticmethod
+    def add_model_specific_args(parent_parser):
+        parser = HyperOptArgumentParser(parents=[parent_parser], add_help=False)
+
+        parser.opt_list('--learning_rate', type=float, default=1e-3, options=[1e-3, 1e-4], tunable=False)
+        parser.opt_list('--student_width', type=int, default=16, options=[8, 16, 32], tunable=False)
+
+        parser.add_argument('--batch_size', type=int, default=16)
+        parser.add_argument('--student_input_scale', type=float, default=0.5)
+        parser.add_argument('--student_map_channels', type=int, default=8)
+        parser.add_argument('--student_map_size', type=int, default=25)
+
+        # fixed arguments
+        parser.add_argument('--link', type=str, default='/scratch/ab8690/DLSP20Dataset/data')
+        parser.add_argument('--teacher_model', type=str, default='roadmap_bce', choices=list(TEACHERS))
+        parser.add_argument('--teacher_path', type=str, default=None)
+        parser.add_argument('--val_scenes', type=str, default=None,
+                            help="e.g. '106,109,115', default: the teacher's held-out split")
+        parser = add_exec_mode_args(parser)
+        return parser
+
+
+def report(student, teacher, args):
+    # threat score and CPU latency of the student relative to its teacher
+    from src.inference.quantize import evaluate, model_size_mb, validation_batches
+
+    torch.set_grad_enabled(False)
+    for m in (student, teacher):
+        m.freeze()
+        m.eval()
+
+    batches = validation_batches(args)
+    rows = [('teacher', teacher), ('student', student)]
+    results = {name: evaluate(m, batches) for name, m in rows}
+
+    print('| | threat score | ms / sample | size (MB) |')
+    print('|---|---|---|---|')
+    for name, m in rows:
+        ts, latency = results[name]
+        size = model_size_mb(m.student if name == 'student' else m)
+        print(f'| {name} | {ts:.4f} | {latency * 1000:.1f} | {size:.1f} |')
+    speedup = results['teacher'][1] / results['student'][1]
+    print(f"student: {speedup:.1f}x faster, {results['student'][0] / results['teacher'][0]:.2f}x teacher threat score")
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser = Trainer.add_argparse_args(parser)
+    parser = RoadMapDistill.add_model_specific_args(parser)
+    parser.add_argument('--report_only', type=str, default=None,
+                        help='student checkpoint to compare against the teacher, skips training')
+    parser.add_argument('--num_batches', type=int, default=20)
+    args = parser.parse_args()
+    args.val_scenes = args.val_scenes or ','.join(str(s) for s in held_out_scenes())
+
+    if args.report_only:
+        model = RoadMapDistill.load_from_checkpoint(args.report_only)
+    else:
+        model = RoadMapDistill(args)
+        trainer = Trainer.from_argparse_args(args)
+        trainer.fit(model)
+
+    teacher = TEACHERS[args.teacher_model].load_from_checkpoint(args.teacher_path)
+    model.teacher = None
+    report(model, teacher, args)
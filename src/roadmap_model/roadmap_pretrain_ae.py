@@ -14,9 +14,10 @@ from test_tube import HyperOptArgumentParser
 
 from src.utils import convert_map_to_lane_map
 from src.utils.data_helper import LabeledDataset
-from src.utils.helper import collate_fn
+from src.utils.helper import collate_fn, split_scenes
 from src.autoencoder.autoencoder import BasicAE
 from src.utils.helper import compute_ts_road_map
+from src.utils.execution import apply_exec_mode, exec_context, add_exec_mode_args
 
 random.seed(20200505)
 np.random.seed(20200505)
@@ -48,12 +49,16 @@ class RoadMap(LightningModule):
 
         # MLP layers: feature embedding --> predict binary roadmap
         self.fc1 = nn.Linear(self.ae.latent_dim, self.output_dim)
+
+        # precision / memory format the forward pass runs in
+        self.exec_mode = hparams.exec_mode if hasattr(hparams, 'exec_mode') else 'fp32'
+        apply_exec_mode(self, self.exec_mode)
         #self.fc2 = nn.Linear(200000, self.output_dim)
         self.sigmoid = nn.Sigmoid()
 
     def wide_stitch_six_images(self, sample):
-        # change from tuple len([6 x 3 x H x W]) = b --> tensor [b x 6 x 3 x H x W]
-        x = torch.stack(sample, dim=0)
+        # change from tuple len([6 x 3 x H x W]) = b --> tensor [b x 6 x 3 x H x W], predict passes the tensor
+        x = torch.stack(sample, dim=0) if isinstance(sample, (list, tuple)) else sample
 
         # reorder order of 6 images (in first dimension) to become 180 degree view
         x = x[:, [0, 1, 2, 5, 4, 3]]
@@ -81,6 +86,13 @@ class RoadMap(LightningModule):
 
         return y
 
+    @torch.no_grad()
+    def predict(self, sample, road_image=None):
+        # sample: [b, 6, 3, 256, 306] -> road_map: bool [b, 800, 800]
+        with exec_context(self.exec_mode):
+            pred_rm = self(sample)
+        return {'road_map': pred_rm.float() > 0.5}
+
     def _run_step(self, batch, batch_idx, step_name):
         sample, target, road_image = batch
 
@@ -88,7 +100,9 @@ class RoadMap(LightningModule):
         target_rm = torch.stack(road_image, dim=0).float()
 
         # forward pass to find predicted roadmap
-        pred_rm = self(sample)
+        with exec_context(self.exec_mode):
+            pred_rm = self(sample)
+        pred_rm = pred_rm.float()
 
         # every 10 epochs we look at inputs + predictions
         if batch_idx % self.hparams.output_img_freq == 0:
@@ -161,13 +175,10 @@ class RoadMap(LightningModule):
         image_folder = self.hparams.link
         annotation_csv = self.hparams.link + '/annotation.csv'
         labeled_scene_index = np.arange(106, 134)
-        trainset_size = round(0.8 * len(labeled_scene_index))
 
         # split into train / validation sets at the scene index level
         # before I did this at the sample level --> this will cause leakage (!!)
-        np.random.shuffle(labeled_scene_index)
-        train_set_index = labeled_scene_index[:trainset_size]
-        valid_set_index = labeled_scene_index[trainset_size:]
+        train_set_index, valid_set_index = split_scenes(labeled_scene_index)
 
         transform = torchvision.transforms.ToTensor()
 
@@ -189,7 +200,7 @@ class RoadMap(LightningModule):
         loader = DataLoader(self.labeled_trainset,
                             batch_size=self.hparams.batch_size,
                             shuffle=True,
-                            num_workers=4,
+                            num_workers=self.hparams.num_workers if hasattr(self.hparams, 'num_workers') else 4,
                             collate_fn=collate_fn)
         return loader
 
@@ -198,7 +209,7 @@ class RoadMap(LightningModule):
         loader = DataLoader(self.labeled_validset,
                             batch_size=self.hparams.batch_size,
                             shuffle=False,
-                            num_workers=4,
+                            num_workers=self.hparams.num_workers if hasattr(self.hparams, 'num_workers') else 4,
                             collate_fn=collate_fn)
         return loader
 
@@ -216,6 +227,7 @@ class RoadMap(LightningModule):
         parser.add_argument('--link', type=str, default='/scratch/ab8690/DLSP20Dataset/data')
         parser.add_argument('--pretrained_path', type=str, default='/scratch/ab8690/logs/space_bb_pretrain/lightning_logs/version_9604234/checkpoints/epoch=23.ckpt')
         parser.add_argument('--output_img_freq', type=int, default=500)
+        parser = add_exec_mode_args(parser)
         return parser
 
 
@@ -1,37 +1,44 @@
 """
 This file runs the main training/val loop, etc... using Lightning Trainer
 """
-from pytorch_lightning import Trainer
-
-# Import model classes
-from src.autoencoder.autoencoder import BasicAE
-from src.roadmap_model.roadmap_pretrain_ae import RoadMap
-from src.roadmap_model.roadmap_bce_v2 import RoadMapBCE
-#from src.bounding_box_model.bb_coord_reg.bb_MLP import Boxes
-#from src.bounding_box_model.spatial_bb.spatial_model import BBSpatialModel
-from src.bounding_box_model.spatial_bb.spatial_w_rm import BBSpatialRoadMap
-from src.bounding_box_model.fast_rcnn.bb_fast_rcnn import BBFasterRCNN
-from src.bounding_box_model.fast_rcnn.bb_fast_rcnn_w_map import FasterRCNNRoadMap
-
-from test_tube import HyperOptArgumentParser, SlurmCluster
 import os, sys
 
-MODEL_NAMES = {
-    'basic_ae': BasicAE,
-    'roadmap_mse': RoadMap,
-    'roadmap_bce': RoadMapBCE,
-    'spatial_rm': BBSpatialRoadMap,
-    'faster_rcnn': BBFasterRCNN,
-    'faster_rcnn_rm': FasterRCNNRoadMap
-}
+from src.utils.registry import LazyRegistry
+
+# model modules (torchvision detection, test_tube, global seeds, ...) are only imported for the selected model
+MODEL_NAMES = LazyRegistry({
+    'basic_ae': 'src.autoencoder.autoencoder:BasicAE',
+    'roadmap_mse': 'src.roadmap_model.roadmap_pretrain_ae:RoadMap',
+    'roadmap_bce': 'src.roadmap_model.roadmap_bce_v2:RoadMapBCE',
+    'roadmap_distill': 'src.roadmap_model.roadmap_distill:RoadMapDistill',
+    #'bb_mlp': 'src.bounding_box_model.bb_coord_reg.bb_MLP:Boxes',
+    #'spatial': 'src.bounding_box_model.spatial_bb.spatial_model:BBSpatialModel',
+    'spatial_rm': 'src.bounding_box_model.spatial_bb.spatial_w_rm:BBSpatialRoadMap',
+    'faster_rcnn': 'src.bounding_box_model.fast_rcnn.bb_fast_rcnn:BBFasterRCNN',
+    'faster_rcnn_rm': 'src.bounding_box_model.fast_rcnn.bb_fast_rcnn_w_map:FasterRCNNRoadMap'
+})
 
 def main_local(hparams):
     main(hparams, None)
 
 def main(hparams, cluster):
+    from pytorch_lightning import Trainer
+
+    # the importance sampler finds a batch's samples by batch_idx, only in the model's own loader,
+    # and with stacked trials only the first replica would weight its loss and feed the sampler
+    if getattr(hparams, 'importance_sampling', False) and (getattr(hparams, 'data_service', None) or
+                                                           getattr(hparams, 'echo_factor', 1) > 1 or
+                                                           getattr(hparams, 'stack_learning_rates', None)):
+        raise ValueError('--importance_sampling works with neither --data_service, --echo_factor '
+                         'nor --stack_learning_rates')
+
     # init module
     MODEL = MODEL_NAMES[hparams.model]
-    model = MODEL(hparams)
+    if getattr(hparams, 'stack_learning_rates', None):
+        from src.utils.stacked_trials import StackedTrials
+        model = StackedTrials(MODEL, hparams)
+    else:
+        model = MODEL(hparams)
 
     path = os.path.join(hparams.logs_save_path, hparams.tt_name)
     hparams.default_root_dir = path
@@ -43,10 +50,25 @@ def main(hparams, cluster):
     #     gpus=hparams.gpus,
     #     precision=hparams.precision
     # )
-    trainer.fit(model)
+    train_dataloader = None
+    if getattr(hparams, 'data_service', None):
+        # training batches come from a node-local src.utils.data_service, validation stays on the model's loader
+        from src.utils.data_service import DataServiceLoader
+        train_dataloader = DataServiceLoader(hparams.data_service, hparams.batch_size, model=model)
+    if getattr(hparams, 'echo_factor', 1) > 1:
+        from src.utils.data_echoing import echo_train_dataloader
+        train_dataloader = echo_train_dataloader(model, train_dataloader, hparams.echo_factor)
+
+    if train_dataloader is not None:
+        trainer.fit(model, train_dataloader=train_dataloader)
+    else:
+        trainer.fit(model)
+    return trainer
 
 
 def run_on_cluster(hyperparams):
+    from test_tube import SlurmCluster
+
     # enable cluster training
     cluster = SlurmCluster(hyperparam_optimizer=hyperparams,
                            log_path=hyperparams.logs_save_path)
@@ -74,6 +96,11 @@ def run_on_cluster(hyperparams):
                                           job_name=job_display_name)
 
 if __name__ == '__main__':
+    from pytorch_lightning import Trainer
+    from test_tube import HyperOptArgumentParser
+    from src.utils.successive_halving import add_successive_halving_args
+    from src.utils.stacked_trials import add_stacked_trials_args
+
     root_dir = os.path.split(os.path.dirname(sys.modules['__main__'].__file__))[0]
 
     parser = HyperOptArgumentParser(add_help=False, strategy='grid_search')
@@ -96,9 +123,27 @@ if __name__ == '__main__':
     parser.add_argument('--single_run', dest='single_run', action='store_true')
     parser.add_argument('--nb_hopt_trials', default=12, type=int)
 
+    # local sweep: run the grid on this machine, local_workers trials at a time, each pinned to its own cores
+    parser.add_argument('--local_workers', default=None, type=int)
+    parser.add_argument('--cores_per_trial', default=None, type=int, help='default: all cores / local_workers')
+    parser.add_argument('--num_workers', default=None, type=int, help='DataLoader workers, default 4 (cores_per_trial - 1 in a local sweep)')
+    parser = add_successive_halving_args(parser)
+    parser = add_stacked_trials_args(parser)
+    parser.add_argument('--data_service', default=None, type=str, help='unix socket of a running src.utils.data_service')
+    parser.add_argument('--echo_factor', default=1, type=int, help='training steps per decoded batch (data echoing)')
+
     # parse params
     hparams = parser.parse_args()
-    if hparams.on_cluster and not hparams.single_run:
+    if hparams.num_workers is None and not hparams.local_workers:
+        hparams.num_workers = 4
+
+    if hparams.local_workers and hparams.sha_min_epochs and not hparams.single_run:
+        from src.utils.successive_halving import run_successive_halving
+        run_successive_halving(hparams)
+    elif hparams.local_workers and not hparams.single_run:
+        from src.utils.local_sweep import run_local_sweep
+        run_local_sweep(hparams)
+    elif hparams.on_cluster and not hparams.single_run:
         run_on_cluster(hparams)
     else:
         main_local(hparams)
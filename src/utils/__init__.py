@@ -1 +1,6 @@
-from src.utils.data_helper import convert_map_to_lane_map
+def __getattr__(name):
+    # resolved on first use so importing a light src.utils module doesn't pull in PIL / pandas / torch
+    if name == 'convert_map_to_lane_map':
+        from src.utils.data_helper import convert_map_to_lane_map
+        return convert_map_to_lane_map
+    raise AttributeError(f"module 'src.utils' has no attribute '{name}'")
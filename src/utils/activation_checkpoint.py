@@ -0,0 +1,26 @@
+import torch
+from torch.utils.checkpoint import checkpoint
+
+
+def maybe_checkpoint(module, fn, *args):
+    """
+    Runs fn(*args) under activation checkpointing when module.checkpoint is set
+
+    Intermediate activations inside fn are dropped after the forward pass and recomputed
+    during backward. Skipped when there is nothing to backprop into (eval, no_grad or a
+    frozen module), since recomputing would only cost time.
+    """
+    if not getattr(module, 'checkpoint', False) or not torch.is_grad_enabled():
+        return fn(*args)
+
+    if not any(p.requires_grad for p in module.parameters()):
+        return fn(*args)
+
+    # reentrant checkpoint only tracks gradients if one of its inputs requires them,
+    # raw images never do so pass a dummy tensor that does
+    dummy = torch.ones(1, requires_grad=True)
+
+    def run(_dummy, *inputs):
+        return fn(*inputs)
+
+    return checkpoint(run, dummy, *args)
@@ -0,0 +1,98 @@
+"""
+Clusters the top down box sizes in annotation.csv into a compact anchor set for the faster rcnn models
+
+python -m src.utils.anchor_config --annotation_csv /path/to/data/annotation.csv --out anchors.json
+
+Pass the output to the faster rcnn models with --anchor_config anchors.json
+"""
+import json
+from argparse import ArgumentParser
+
+import numpy as np
+import pandas as pd
+
+
+def box_sizes_in_pixels(annotation_dataframe):
+    # corners are in meters on a (-40, 40) grid, 10 pixels per meter on the 800 x 800 map
+    xs = annotation_dataframe[['fl_x', 'fr_x', 'bl_x', 'br_x']].values * 10
+    ys = annotation_dataframe[['fl_y', 'fr_y', 'bl_y', 'br_y']].values * 10
+
+    # faster rcnn boxes are axis aligned (x0, y0, x1, y1), same as _old_to_new_coord
+    widths = xs.max(axis=1) - xs.min(axis=1)
+    heights = ys.max(axis=1) - ys.min(axis=1)
+    return np.stack([widths, heights], axis=1)
+
+
+def wh_iou(wh, centroids):
+    # iou between boxes and centroids when both are centred on the same point
+    inter = np.minimum(wh[:, None, 0], centroids[None, :, 0]) * np.minimum(wh[:, None, 1], centroids[None, :, 1])
+    union = (wh[:, 0] * wh[:, 1])[:, None] + (centroids[:, 0] * centroids[:, 1])[None, :] - inter
+    return inter / union
+
+
+def kmeans_iou(wh, k, n_iter=100, seed=0):
+    # k-means with 1 - iou as the distance, so big boxes don't dominate like with euclidean
+    rng = np.random.RandomState(seed)
+    centroids = wh[rng.choice(len(wh), k, replace=False)]
+
+    for _ in range(n_iter):
+        assignment = wh_iou(wh, centroids).argmax(axis=1)
+        new_centroids = np.stack([
+            np.median(wh[assignment == i], axis=0) if (assignment == i).any() else centroids[i]
+            for i in range(k)
+        ])
+        if np.allclose(new_centroids, centroids):
+            break
+        centroids = new_centroids
+
+    mean_best_iou = wh_iou(wh, centroids).max(axis=1).mean()
+    return centroids, mean_best_iou
+
+
+def anchor_config(annotation_dataframe, num_sizes=3, num_ratios=3, top_n_factor=4):
+    wh = box_sizes_in_pixels(annotation_dataframe)
+    wh = wh[(wh > 0).all(axis=1)]
+
+    # AnchorGenerator takes every size x every ratio, so cluster the two separately
+    # sizes: sqrt(area) of the iou k-means centroids
+    centroids, mean_best_iou = kmeans_iou(wh, num_sizes * num_ratios)
+    sizes = np.sqrt(centroids[:, 0] * centroids[:, 1])
+    sizes = np.sort(np.quantile(sizes, np.linspace(0, 1, num_sizes)))
+
+    # aspect ratios (h / w in torchvision) at the quantiles of the data
+    ratios = wh[:, 1] / wh[:, 0]
+    ratios = np.quantile(ratios, np.linspace(0.1, 0.9, num_ratios))
+
+    # keep a few proposals per ground truth box instead of torchvision's 2000 / 1000
+    boxes_per_sample = annotation_dataframe.groupby(['scene', 'sample']).size()
+    max_boxes = int(boxes_per_sample.max())
+    post_nms_top_n = int(np.ceil(top_n_factor * max_boxes / 50) * 50)
+    pre_nms_top_n = 2 * post_nms_top_n
+
+    return {
+        'sizes': [round(float(s), 1) for s in sizes],
+        'aspect_ratios': [round(float(r), 2) for r in ratios],
+        'rpn_pre_nms_top_n_train': pre_nms_top_n,
+        'rpn_post_nms_top_n_train': post_nms_top_n,
+        'rpn_pre_nms_top_n_test': pre_nms_top_n // 2,
+        'rpn_post_nms_top_n_test': post_nms_top_n // 2,
+        # stats, for the record
+        'mean_best_iou': round(float(mean_best_iou), 3),
+        'max_boxes_per_sample': max_boxes,
+    }
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('--annotation_csv', type=str, default='/scratch/ab8690/DLSP20Dataset/data/annotation.csv')
+    parser.add_argument('--num_sizes', type=int, default=3)
+    parser.add_argument('--num_ratios', type=int, default=3)
+    parser.add_argument('--top_n_factor', type=float, default=4)
+    parser.add_argument('--out', type=str, default='anchors.json')
+    args = parser.parse_args()
+
+    config = anchor_config(pd.read_csv(args.annotation_csv), args.num_sizes, args.num_ratios, args.top_n_factor)
+    print(json.dumps(config, indent=2))
+
+    with open(args.out, 'w') as f:
+        json.dump(config, f, indent=2)
@@ -2,9 +2,11 @@ import numpy as np
 from PIL import Image, ImageDraw
 
 
-def boxes_to_binary_map(x):
+def boxes_to_binary_map(x, size=800):
+    # boxes are in meters on a (-40, 40) grid, so one meter is size / 80 pixels
+    scale = size / 80
     x = x.cpu().numpy()
-    data = np.zeros((800, 800))
+    data = np.zeros((size, size))
 
     img = Image.fromarray(data)
     draw = ImageDraw.Draw(img)
@@ -12,7 +14,7 @@ def boxes_to_binary_map(x):
     for i in range(x.shape[0]):
         box = x[i]
         box = np.stack([box[:, 0], box[:, 1], box[:, 3], box[:, 2]])
-        box = box * 10 + 400
+        box = box * scale + size / 2
         box = list(box.flatten())
         draw.polygon(list(box), fill=1)
 
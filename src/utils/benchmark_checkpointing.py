@@ -0,0 +1,100 @@
+"""
+Measures peak memory vs step time for the activation checkpointing options of the
+spatial road map model (encoder -> spatial mapper -> merge blocks)
+
+python -m src.utils.benchmark_checkpointing --batch_size 4 --steps 5
+"""
+import resource
+import time
+import multiprocessing as mp
+from argparse import ArgumentParser
+
+import torch
+
+from src.autoencoder.components import Encoder
+from src.bounding_box_model.spatial_bb.components import SpatialMappingCNN, RoadMapBoxesMergingCNN
+
+CONFIGS = {
+    'none': (),
+    'encoder': ('encoder',),
+    'spatial': ('spatial',),
+    'merge': ('merge',),
+    'all': ('encoder', 'spatial', 'merge'),
+}
+
+
+def _run_config(name, batch_size, steps, device):
+    torch.manual_seed(0)
+    encoder = Encoder(128, 64, 3, 256, 306 * 6).to(device)
+    encoder.c3_only = True
+    space_map_cnn = SpatialMappingCNN().to(device)
+    box_merge = RoadMapBoxesMergingCNN().to(device)
+
+    encoder.checkpoint = 'encoder' in CONFIGS[name]
+    space_map_cnn.checkpoint = 'spatial' in CONFIGS[name]
+    box_merge.checkpoint = 'merge' in CONFIGS[name]
+
+    params = list(encoder.parameters()) + list(space_map_cnn.parameters()) + list(box_merge.parameters())
+    optimizer = torch.optim.Adam(params, lr=1e-4)
+
+    x = torch.rand(batch_size, 6, 3, 256, 306, device=device)
+    rm = torch.rand(batch_size, 1, 800, 800, device=device).round()
+    y = torch.rand(batch_size, 800, 800, device=device).round()
+
+    def step():
+        optimizer.zero_grad()
+        stitched = x[:, [0, 1, 2, 5, 4, 3]].permute(0, 2, 3, 1, 4).reshape(batch_size, 3, 256, -1)
+        # the merge blocks return logits, same loss as spatial_w_rm
+        logits = box_merge(encoder(stitched), space_map_cnn(x), rm).squeeze(1)
+        loss = torch.nn.functional.binary_cross_entropy_with_logits(logits, y)
+        loss.backward()
+        optimizer.step()
+
+    # warm up, then reset the peak counters
+    step()
+    if device == 'cuda':
+        torch.cuda.synchronize()
+        torch.cuda.reset_peak_memory_stats()
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    start = time.time()
+    for _ in range(steps):
+        step()
+    if device == 'cuda':
+        torch.cuda.synchronize()
+    step_time = (time.time() - start) / steps
+
+    if device == 'cuda':
+        peak_mb = torch.cuda.max_memory_allocated() / 2 ** 20
+    else:
+        # ru_maxrss is in kB on linux, the warm up step already reached the steady state peak
+        peak_mb = max(rss_before, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss) / 2 ** 10
+
+    return name, peak_mb, step_time
+
+
+def main(args):
+    device = 'cuda' if torch.cuda.is_available() and not args.cpu else 'cpu'
+
+    # every config gets a fresh process so the cpu peak rss of one doesn't leak into the next
+    ctx = mp.get_context('spawn')
+    rows = []
+    for name in args.configs.split(','):
+        with ctx.Pool(1) as pool:
+            rows.append(pool.apply(_run_config, (name, args.batch_size, args.steps, device)))
+
+    base_mem, base_time = rows[0][1], rows[0][2]
+    print(f'device={device} batch_size={args.batch_size} steps={args.steps}')
+    print('| checkpointed | peak mem (MB) | mem vs first | step time (s) | time vs first |')
+    print('|---|---|---|---|---|')
+    for name, peak_mb, step_time in rows:
+        print(f'| {name} | {peak_mb:.0f} | {peak_mb / base_mem:.2f}x | {step_time:.3f} | {step_time / base_time:.2f}x |')
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('--batch_size', type=int, default=4)
+    parser.add_argument('--steps', type=int, default=5)
+    parser.add_argument('--configs', type=str, default='none,encoder,spatial,merge,all')
+    parser.add_argument('--cpu', default=False, action='store_true')
+    main(parser.parse_args())
@@ -0,0 +1,66 @@
+"""
+Wall time to a target training loss with and without data echoing, on the real dataset so the
+JPEG decode cost is in the measurement. Loss is smoothed with an EMA, every run starts from the
+same seed.
+
+python -m src.utils.benchmark_data_echoing --model basic_ae --echo_factors 1,2,4 --target_loss 0.05
+"""
+import time
+from argparse import ArgumentParser
+
+import torch
+
+from src.submit import MODEL_NAMES
+from src.utils.data_echoing import EchoingLoader
+
+
+def time_to_target(model_name, echo_factor, args):
+    parser = MODEL_NAMES[model_name].add_model_specific_args(ArgumentParser(add_help=False))
+    cli = ['--output_img_freq', '1000000', '--link', args.link, '--batch_size', str(args.batch_size)]
+    if args.pretrained_path:
+        cli += ['--pretrained_path', args.pretrained_path]
+    hparams, _ = parser.parse_known_args(cli)
+    hparams.num_workers = args.num_workers
+
+    torch.manual_seed(0)
+    model = MODEL_NAMES[model_name](hparams)
+    model.prepare_data()
+    model.train()
+    optimizer = torch.optim.Adam([p for p in model.parameters() if p.requires_grad], lr=args.learning_rate)
+    loader = EchoingLoader(model.train_dataloader(), echo_factor)
+
+    ema, steps, start = None, 0, time.time()
+    while True:
+        for batch in loader:
+            out = model._run_step(batch, steps + 1, 'train')
+            loss = out[0] if isinstance(out, tuple) else out
+            optimizer.zero_grad()
+            loss.backward()
+            optimizer.step()
+
+            steps += 1
+            ema = loss.item() if ema is None else 0.95 * ema + 0.05 * loss.item()
+            elapsed = time.time() - start
+            if ema <= args.target_loss or elapsed > args.max_minutes * 60:
+                return ema <= args.target_loss, elapsed, steps, -(-steps // echo_factor), ema
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('--model', type=str, default='basic_ae', choices=list(MODEL_NAMES))
+    parser.add_argument('--pretrained_path', type=str, default=None)
+    parser.add_argument('--link', type=str, default='/scratch/ab8690/DLSP20Dataset/data')
+    parser.add_argument('--echo_factors', type=str, default='1,2,4')
+    parser.add_argument('--target_loss', type=float, required=True)
+    parser.add_argument('--max_minutes', type=float, default=60)
+    parser.add_argument('--batch_size', type=int, default=16)
+    parser.add_argument('--num_workers', type=int, default=4)
+    parser.add_argument('--learning_rate', type=float, default=1e-3)
+    args = parser.parse_args()
+
+    print(f'{args.model}: time to smoothed train loss {args.target_loss}')
+    print('| echo factor | reached | wall time (s) | steps | fresh batches | final loss |')
+    print('|---|---|---|---|---|---|')
+    for echo_factor in [int(e) for e in args.echo_factors.split(',')]:
+        reached, elapsed, steps, fresh, ema = time_to_target(args.model, echo_factor, args)
+        print(f"| {echo_factor} | {'yes' if reached else 'no'} | {elapsed:.0f} | {steps} | {fresh} | {ema:.4f} |")
@@ -0,0 +1,79 @@
+"""
+Training throughput (samples / sec) of every model in submit.MODEL_NAMES for each exec_mode,
+on random inputs so no dataset is needed. Models that build on the pretrained encoder need
+a BasicAE checkpoint.
+
+python -m src.utils.benchmark_exec_modes --pretrained_path /path/to/ae.ckpt --batch_size 2
+"""
+import time
+from argparse import ArgumentParser
+
+import torch
+
+from src.submit import MODEL_NAMES
+from src.utils.execution import EXEC_MODES
+
+
+def random_batch(model_name, batch_size, boxes_per_sample=10):
+    samples = torch.rand(batch_size, 6, 3, 256, 306)
+    if model_name == 'basic_ae':
+        return samples
+
+    # labeled batches come out of collate_fn as tuples
+    targets = []
+    for _ in range(batch_size):
+        corners = (torch.rand(boxes_per_sample, 2, 1) - 0.5) * 70 + torch.rand(boxes_per_sample, 2, 4) * 4
+        targets.append({'bounding_box': corners, 'category': torch.randint(0, 9, (boxes_per_sample,))})
+    road_images = tuple(torch.rand(800, 800) > 0.5 for _ in range(batch_size))
+    return tuple(samples), tuple(targets), road_images
+
+
+def throughput(model_name, exec_mode, args):
+    parser = MODEL_NAMES[model_name].add_model_specific_args(ArgumentParser(add_help=False))
+    cli = ['--exec_mode', exec_mode, '--output_img_freq', '1000000']
+    if model_name != 'basic_ae':
+        cli += ['--pretrained_path', args.pretrained_path]
+    hparams, _ = parser.parse_known_args(cli)
+
+    torch.manual_seed(0)
+    model = MODEL_NAMES[model_name](hparams)
+    model.train()
+    optimizer = torch.optim.Adam([p for p in model.parameters() if p.requires_grad], lr=1e-5)
+    batch = random_batch(model_name, args.batch_size)
+
+    def step():
+        optimizer.zero_grad()
+        out = model._run_step(batch, 1, 'train')
+        loss = out[0] if isinstance(out, tuple) else out
+        loss.backward()
+        optimizer.step()
+
+    step()
+    start = time.time()
+    for _ in range(args.steps):
+        step()
+    return args.batch_size * args.steps / (time.time() - start)
+
+
+def main(args):
+    models = args.models.split(',') if args.models else list(MODEL_NAMES)
+    print(f'batch_size={args.batch_size} steps={args.steps} threads={torch.get_num_threads()}')
+    print('| model | ' + ' | '.join(EXEC_MODES) + ' |')
+    print('|---' * (len(EXEC_MODES) + 1) + '|')
+    for model_name in models:
+        row = []
+        for exec_mode in EXEC_MODES:
+            try:
+                row.append(f'{throughput(model_name, exec_mode, args):.2f}')
+            except Exception as e:
+                row.append(f'error: {type(e).__name__}')
+        print(f'| {model_name} | ' + ' | '.join(row) + ' |')
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('--pretrained_path', type=str, default=None)
+    parser.add_argument('--models', type=str, default=None, help='comma separated, default all')
+    parser.add_argument('--batch_size', type=int, default=2)
+    parser.add_argument('--steps', type=int, default=3)
+    main(parser.parse_args())
@@ -0,0 +1,130 @@
+"""
+End to end timing of the faster rcnn models for different input sizes and anchor settings
+
+python -m src.utils.benchmark_fast_rcnn --batch_size 2 --steps 3 --anchor_config anchors.json
+python -m src.utils.benchmark_fast_rcnn --height 400 --width 400 --rcnn_min_size 400
+"""
+import time
+from argparse import ArgumentParser, Namespace
+
+import torch
+
+from src.autoencoder.components import Encoder
+from src.bounding_box_model.fast_rcnn.components import build_fast_rcnn
+
+MODES = {
+    'default': dict(),
+    'anchors': dict(use_anchor_config=True),
+}
+
+
+def build_model(mode, anchor_config=None, min_size=800):
+    # c3_only never touches the dense layers, so build them for a tiny input to save memory
+    backbone = Encoder(128, 64, 3, 8, 8)
+    backbone.c3_only = True
+    backbone.out_channels = 32
+
+    settings = dict(MODES[mode], rcnn_min_size=min_size)
+    if settings.pop('use_anchor_config', False):
+        settings['anchor_config'] = anchor_config
+    return build_fast_rcnn(backbone, Namespace(**settings))
+
+
+class RPNTimer:
+    """
+    Forward hooks on the rpn: accumulates its wall time and counts anchors per image
+    """
+
+    def __init__(self, rpn):
+        self.rpn = rpn
+        self.reset()
+        rpn.register_forward_pre_hook(self._start)
+        rpn.register_forward_hook(self._stop)
+
+    def reset(self):
+        self.total_time = 0.
+        self.anchors_per_image = 0
+
+    def _start(self, module, inputs):
+        features = inputs[1]
+        anchors_per_location = module.anchor_generator.num_anchors_per_location()
+        self.anchors_per_image = sum(n * f.size(-2) * f.size(-1)
+                                     for n, f in zip(anchors_per_location, features.values()))
+        self.start_time = time.time()
+
+    def _stop(self, module, inputs, output):
+        self.total_time += time.time() - self.start_time
+
+
+def random_batch(batch_size, height, width, boxes_per_image=10):
+    images = [torch.rand(3, height, width) for _ in range(batch_size)]
+    targets = []
+    for _ in range(batch_size):
+        xy = torch.rand(boxes_per_image, 2) * torch.tensor([width - 50., height - 50.])
+        wh = 10 + torch.rand(boxes_per_image, 2) * 40
+        targets.append({'boxes': torch.cat([xy, xy + wh], dim=1),
+                        'labels': torch.randint(1, 9, (boxes_per_image,))})
+    return images, targets
+
+
+def time_mode(mode, args):
+    torch.manual_seed(0)
+    model = build_model(mode, args.anchor_config, args.rcnn_min_size)
+    rpn_timer = RPNTimer(model.rpn)
+    images, targets = random_batch(args.batch_size, args.height, args.width)
+    optimizer = torch.optim.Adam(model.parameters(), lr=1e-4)
+
+    def train_step():
+        model.train()
+        optimizer.zero_grad()
+        losses = model(images, targets)
+        sum(losses.values()).backward()
+        optimizer.step()
+
+    def eval_step():
+        model.eval()
+        with torch.no_grad():
+            return model(images)
+
+    train_step()
+    start = time.time()
+    for _ in range(args.steps):
+        train_step()
+    train_time = (time.time() - start) / args.steps
+
+    eval_step()
+    rpn_timer.reset()
+    start = time.time()
+    for _ in range(args.steps):
+        out = eval_step()
+    eval_time = (time.time() - start) / args.steps
+    rpn_time = rpn_timer.total_time / args.steps
+
+    # boxes should be in input (map) coordinates whatever the transform does internally
+    max_coord = max([o['boxes'].max().item() for o in out if o['boxes'].numel()] or [0])
+    return mode, train_time, eval_time, rpn_time, rpn_timer.anchors_per_image, max_coord
+
+
+def main(args):
+    print(f'input {args.height}x{args.width} min_size={args.rcnn_min_size} batch_size={args.batch_size} steps={args.steps}')
+    print('| mode | train step (s) | eval step (s) | eval rpn (s) | anchors / image | max box coord |')
+    print('|---|---|---|---|---|---|')
+    modes = args.modes.split(',')
+    if args.anchor_config is None:
+        modes = [m for m in modes if not MODES[m].get('use_anchor_config')]
+    for mode in modes:
+        mode, train_time, eval_time, rpn_time, num_anchors, max_coord = time_mode(mode, args)
+        print(f'| {mode} | {train_time:.3f} | {eval_time:.3f} | {rpn_time:.3f} | {num_anchors} | {max_coord:.0f} |')
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('--batch_size', type=int, default=2)
+    parser.add_argument('--steps', type=int, default=3)
+    parser.add_argument('--height', type=int, default=800)
+    parser.add_argument('--width', type=int, default=800)
+    parser.add_argument('--rcnn_min_size', type=int, default=800,
+                        help='shorter side the transform resizes to, the input height keeps it at scale 1')
+    parser.add_argument('--modes', type=str, default='default,anchors')
+    parser.add_argument('--anchor_config', type=str, default=None)
+    main(parser.parse_args())
@@ -0,0 +1,94 @@
+"""
+Wall clock to a validation threat score with uniform shuffling vs loss-based importance sampling,
+same seed, same model, same validation subset (measured every --eval_every training batches).
+
+python -m src.utils.benchmark_importance_sampling --model roadmap_bce --pretrained_path ae.ckpt --target_ts 0.7
+"""
+import time
+import tempfile
+from argparse import ArgumentParser
+
+import torch
+
+from src.submit import MODEL_NAMES
+
+
+class _StepCounter:
+    # what _run_step reads from its trainer when it logs images
+    global_step = 0
+
+
+@torch.no_grad()
+def validation_ts(model, batches):
+    model.eval()
+    scores = [model.validation_step(batch, batch_idx)['val_ts'] for batch_idx, batch in enumerate(batches)]
+    model.train()
+    return torch.stack(scores).mean().item()
+
+
+def time_to_target(importance_sampling, args):
+    from pytorch_lightning.loggers import TensorBoardLogger
+
+    parser = MODEL_NAMES[args.model].add_model_specific_args(ArgumentParser(add_help=False))
+    cli = ['--link', args.link, '--pretrained_path', args.pretrained_path, '--batch_size', str(args.batch_size),
+           '--is_floor', str(args.is_floor)] + (['--importance_sampling'] if importance_sampling else [])
+    hparams, _ = parser.parse_known_args(cli)
+    hparams.num_workers = args.num_workers
+
+    torch.manual_seed(0)
+    model = MODEL_NAMES[args.model](hparams)
+    model.logger = TensorBoardLogger(tempfile.mkdtemp(), name='benchmark_importance_sampling')
+    model.trainer = _StepCounter()
+    model.prepare_data()
+    model.train()
+    optimizer = torch.optim.Adam([p for p in model.parameters() if p.requires_grad], lr=hparams.learning_rate)
+
+    val_batches = []
+    for batch in model.val_dataloader():
+        if len(val_batches) == args.val_batches:
+            break
+        val_batches.append(batch)
+    train_loader = model.train_dataloader()
+
+    history, start, step = [], time.time(), 0
+    while time.time() - start < args.max_minutes * 60:
+        for batch_idx, batch in enumerate(train_loader):
+            loss = model._run_step(batch, batch_idx, 'train')[0]
+            optimizer.zero_grad()
+            loss.backward()
+            optimizer.step()
+            step += 1
+
+            if step % args.eval_every == 0:
+                # evaluation time isn't training time
+                elapsed = time.time() - start
+                ts = validation_ts(model, val_batches)
+                start += time.time() - start - elapsed
+                history.append((elapsed, ts))
+                if ts >= args.target_ts:
+                    return elapsed, history
+    return None, history
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('--model', type=str, default='roadmap_bce', choices=['roadmap_bce', 'spatial_rm'])
+    parser.add_argument('--pretrained_path', type=str, required=True)
+    parser.add_argument('--link', type=str, default='/scratch/ab8690/DLSP20Dataset/data')
+    parser.add_argument('--target_ts', type=float, required=True)
+    parser.add_argument('--max_minutes', type=float, default=60)
+    parser.add_argument('--eval_every', type=int, default=50)
+    parser.add_argument('--val_batches', type=int, default=10)
+    parser.add_argument('--batch_size', type=int, default=8)
+    parser.add_argument('--num_workers', type=int, default=4)
+    parser.add_argument('--is_floor', type=float, default=0.2)
+    args = parser.parse_args()
+
+    print(f'{args.model}: training wall clock to validation threat score {args.target_ts}')
+    print('| sampling | time to target (s) | best ts | evaluations |')
+    print('|---|---|---|---|')
+    for name, importance_sampling in [('uniform', False), ('importance', True)]:
+        elapsed, history = time_to_target(importance_sampling, args)
+        best = max(ts for _, ts in history) if history else float('nan')
+        reached = f'{elapsed:.0f}' if elapsed is not None else 'not reached'
+        print(f'| {name} | {reached} | {best:.4f} | {len(history)} |')
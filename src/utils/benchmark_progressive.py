@@ -0,0 +1,87 @@
+"""
+Pretraining wall time to a full resolution validation loss for BasicAE, fixed resolution vs a
+progressive schedule. Both runs use the same resolution agnostic encoder (--agnostic_pool) and
+seed, so only the schedule differs. Also reports the mean training epoch time at every scale.
+
+python -m src.utils.benchmark_progressive --target_loss 0.02 --schedule 0:0.25,2:0.5,4:1 --epochs 10
+"""
+import time
+from argparse import ArgumentParser
+
+import numpy as np
+import torch
+
+from src.autoencoder.autoencoder import BasicAE
+
+
+@torch.no_grad()
+def validation_loss(model, batches):
+    model.eval()
+    loss = np.mean([model._run_step(batch, batch_idx + 1, 'valid').item() for batch_idx, batch in enumerate(batches)])
+    model.train()
+    return loss
+
+
+def run(schedule, args):
+    parser = BasicAE.add_model_specific_args(ArgumentParser(add_help=False))
+    cli = ['--link', args.link, '--batch_size', str(args.batch_size), '--output_img_freq', '1000000',
+           '--agnostic_pool', args.agnostic_pool] + (['--progressive_schedule', schedule] if schedule else [])
+    hparams, _ = parser.parse_known_args(cli)
+    hparams.num_workers = args.num_workers
+
+    torch.manual_seed(0)
+    model = BasicAE(hparams)
+    model.prepare_data()
+    model.train()
+    optimizer = torch.optim.Adam(model.parameters(), lr=hparams.learning_rate)
+
+    val_batches = []
+    for batch in model.val_dataloader():
+        if len(val_batches) == args.val_batches:
+            break
+        val_batches.append(batch)
+
+    train_time, epoch_times, reached = 0., {}, None
+    for epoch in range(args.epochs):
+        model.current_epoch = epoch
+        scale = model.input_scale('train')
+        start = time.time()
+        for batch_idx, batch in enumerate(model.train_dataloader()):
+            if batch_idx == args.batches_per_epoch:
+                break
+            loss = model._run_step(batch, batch_idx + 1, 'train')
+            optimizer.zero_grad()
+            loss.backward()
+            optimizer.step()
+        elapsed = time.time() - start
+        train_time += elapsed
+        epoch_times.setdefault(scale, []).append(elapsed)
+
+        val_loss = validation_loss(model, val_batches)
+        print(f"{schedule or 'full res'} epoch {epoch} (scale {scale}): val loss {val_loss:.4f}, train {train_time:.0f}s")
+        if reached is None and val_loss <= args.target_loss:
+            reached = train_time
+            break
+    return reached, {s: np.mean(t) for s, t in epoch_times.items()}
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('--link', type=str, default='/scratch/ab8690/DLSP20Dataset/data')
+    parser.add_argument('--target_loss', type=float, required=True)
+    parser.add_argument('--schedule', type=str, default='0:0.25,2:0.5,4:1')
+    parser.add_argument('--agnostic_pool', type=str, default='16,114')
+    parser.add_argument('--epochs', type=int, default=10)
+    parser.add_argument('--batches_per_epoch', type=int, default=None, help='cap on training batches per epoch')
+    parser.add_argument('--val_batches', type=int, default=10)
+    parser.add_argument('--batch_size', type=int, default=16)
+    parser.add_argument('--num_workers', type=int, default=4)
+    args = parser.parse_args()
+
+    rows = [('full res', run(None, args)), (args.schedule, run(args.schedule, args))]
+    print(f'BasicAE: training wall time to full res validation loss {args.target_loss}')
+    print('| schedule | time to target (s) | s / epoch per scale |')
+    print('|---|---|---|')
+    for name, (reached, epoch_times) in rows:
+        per_scale = ', '.join(f'{s}: {t:.0f}' for s, t in sorted(epoch_times.items()))
+        print(f"| {name} | {f'{reached:.0f}' if reached is not None else 'not reached'} | {per_scale} |")
@@ -0,0 +1,249 @@
+"""
+Data-parallel training on CPU: one process per shard, gradients all-reduced over gloo
+
+Works with every model in MODEL_NAMES through its own training_step / configure_optimizers /
+dataloaders. SceneShardedSampler hands each process whole scenes, so the workers of a process
+read consecutive samples of the same few scenes instead of hopping across the dataset.
+The lr schedulers of configure_optimizers step once per epoch as under the lightning trainer,
+ReduceLROnPlateau on the monitored validation loss of rank 0.
+
+    python -m src.utils.cpu_ddp --model roadmap_bce --num_processes 4 --max_epochs 10
+    python -m src.utils.cpu_ddp --model roadmap_bce --benchmark 1,2,4,8 --benchmark_steps 20
+"""
+import os
+import math
+import time
+from argparse import Namespace
+
+import numpy as np
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+from torch._utils import _flatten_dense_tensors, _unflatten_dense_tensors
+from torch.utils.data import DataLoader, Sampler
+
+from src.submit import MODEL_NAMES
+from src.utils.data_helper import NUM_SAMPLE_PER_SCENE
+
+
+class SceneShardedSampler(Sampler):
+    """
+    Shuffles scenes every epoch and deals them out to the replicas, then shuffles samples within
+    each replica's scenes. Replicas are padded (by repeating their own samples) to the same length
+    so every process takes the same number of steps.
+    """
+
+    def __init__(self, dataset, num_replicas, rank, seed=0):
+        self.dataset = dataset
+        self.num_replicas = num_replicas
+        self.rank = rank
+        self.seed = seed
+        self.epoch = 0
+        self.num_scenes = len(dataset) // NUM_SAMPLE_PER_SCENE
+        self.num_samples = math.ceil(len(dataset) / num_replicas)
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def __iter__(self):
+        rng = np.random.RandomState(self.seed + self.epoch)
+        scenes = rng.permutation(self.num_scenes)[self.rank::self.num_replicas]
+        indices = np.concatenate([np.arange(s * NUM_SAMPLE_PER_SCENE, (s + 1) * NUM_SAMPLE_PER_SCENE)
+                                  for s in scenes]) if len(scenes) else np.arange(0)
+        indices = rng.permutation(indices)
+        if len(indices) < self.num_samples:
+            indices = np.resize(indices if len(indices) else np.arange(len(self.dataset)), self.num_samples)
+        return iter(indices[:self.num_samples].tolist())
+
+    def __len__(self):
+        return self.num_samples
+
+
+class CPUDataParallel:
+    """
+    Minimal training loop around a LightningModule, stands in for its trainer (global_step,
+    current_epoch, logger) so training_step runs unchanged
+    """
+
+    def __init__(self, model, rank, world_size, bucket_mb=25, logger=None):
+        self.model = model
+        self.rank = rank
+        self.world_size = world_size
+        self.bucket_numel = bucket_mb * 2 ** 20 // 4
+        self.global_step = 0
+        self.current_epoch = 0
+
+        model.trainer = self
+        model.logger = logger
+
+        config = model.configure_optimizers()
+        schedulers = []
+        if isinstance(config, (list, tuple)) and len(config) == 2 and isinstance(config[0], (list, tuple)):
+            config, schedulers = config
+        self.optimizer = config[0] if isinstance(config, (list, tuple)) else config
+        # lightning's scheduler dicts (StackedTrials) or bare schedulers, monitoring val_loss by default
+        self.schedulers = [s if isinstance(s, dict) else {'scheduler': s} for s in schedulers]
+
+        # same starting point everywhere
+        for t in list(model.parameters()) + list(model.buffers()):
+            dist.broadcast(t.data, src=0)
+
+    def allreduce_gradients(self):
+        # coalesced into ~bucket_mb buckets, one all_reduce per bucket instead of per tensor
+        grads = [p.grad.data for p in self.model.parameters() if p.requires_grad and p.grad is not None]
+        bucket, size = [], 0
+        for g in grads + [None]:
+            if g is not None:
+                bucket.append(g)
+                size += g.numel()
+            if bucket and (g is None or size >= self.bucket_numel):
+                flat = _flatten_dense_tensors(bucket)
+                dist.all_reduce(flat)
+                flat /= self.world_size
+                for g_, reduced in zip(bucket, _unflatten_dense_tensors(flat, bucket)):
+                    g_.copy_(reduced)
+                bucket, size = [], 0
+
+    def train_steps(self, loader, max_steps=None):
+        self.model.train()
+        self.model.current_epoch = self.current_epoch
+        for batch_idx, batch in enumerate(loader):
+            loss = self.model.training_step(batch, batch_idx)['loss']
+            self.optimizer.zero_grad()
+            loss.backward()
+            self.allreduce_gradients()
+            self.optimizer.step()
+            self.global_step += 1
+            if max_steps is not None and batch_idx + 1 >= max_steps:
+                break
+
+    def step_schedulers(self, result=None):
+        """
+        Once per epoch on every rank, result: validation_epoch_end output, only rank 0 validates
+        """
+        for config in self.schedulers:
+            scheduler = config['scheduler']
+            if isinstance(scheduler, torch.optim.lr_scheduler.ReduceLROnPlateau):
+                monitor = config.get('monitor', 'val_loss')
+                value = torch.zeros(1)
+                if self.rank == 0:
+                    if monitor not in result:
+                        raise KeyError(f'ReduceLROnPlateau monitors {monitor}, validation_epoch_end only returned '
+                                       f'{", ".join(k for k in result if k != "log")}')
+                    value[0] = float(result[monitor])
+                # the same lr on every rank
+                dist.broadcast(value, src=0)
+                scheduler.step(value.item())
+            else:
+                scheduler.step()
+
+    @torch.no_grad()
+    def validate(self, loader):
+        self.model.eval()
+        outputs = [self.model.validation_step(batch, batch_idx) for batch_idx, batch in enumerate(loader)]
+        return self.model.validation_epoch_end(outputs)
+
+
+def _sharded_loader(model, world_size, rank, num_workers):
+    train_loader = model.train_dataloader()
+    sampler = SceneShardedSampler(train_loader.dataset, world_size, rank)
+    # batches no longer follow the model's own sampler, importance weights wouldn't line up
+    if getattr(model, 'train_sampler', None) is not None:
+        model.train_sampler = None
+    loader = DataLoader(train_loader.dataset, batch_size=train_loader.batch_size, sampler=sampler,
+                        collate_fn=train_loader.collate_fn, num_workers=num_workers)
+    return loader, sampler
+
+
+def _worker(rank, world_size, hparams, results):
+    os.environ['MASTER_ADDR'] = '127.0.0.1'
+    os.environ['MASTER_PORT'] = str(hparams.master_port)
+    dist.init_process_group('gloo', rank=rank, world_size=world_size)
+    torch.set_num_threads(hparams.threads_per_proc)
+
+    from pytorch_lightning.loggers import TensorBoardLogger
+
+    model = MODEL_NAMES[hparams.model](hparams)
+    model.prepare_data()
+    logger = TensorBoardLogger(hparams.logs_save_path, name=f'cpu_ddp_{hparams.model}_rank_{rank}')
+    runner = CPUDataParallel(model, rank, world_size, logger=logger)
+    loader, sampler = _sharded_loader(model, world_size, rank, hparams.num_workers)
+
+    if hparams.benchmark_steps:
+        runner.train_steps(loader, max_steps=hparams.warmup_steps)
+        dist.barrier()
+        start = time.time()
+        runner.train_steps(loader, max_steps=hparams.benchmark_steps)
+        dist.barrier()
+        samples = torch.tensor([float(hparams.benchmark_steps * loader.batch_size)])
+        dist.all_reduce(samples)
+        if rank == 0:
+            results.put(samples.item() / (time.time() - start))
+    else:
+        for epoch in range(hparams.max_epochs):
+            runner.current_epoch = epoch
+            sampler.set_epoch(epoch)
+            runner.train_steps(loader)
+            result = None
+            if rank == 0:
+                result = runner.validate(model.val_dataloader())
+                print(f"epoch {epoch}: {({k: float(v) for k, v in result.get('log', {}).items()})}", flush=True)
+                path = os.path.join(hparams.logs_save_path, f'cpu_ddp_{hparams.model}', f'epoch={epoch}.ckpt')
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                torch.save({'epoch': epoch, 'state_dict': model.state_dict(), 'hparams': vars(hparams)}, path)
+            runner.step_schedulers(result)
+            dist.barrier()
+
+    dist.destroy_process_group()
+
+
+def launch(hparams, num_processes):
+    context = mp.get_context('spawn')
+    results = context.SimpleQueue()
+    mp.start_processes(_worker, args=(num_processes, hparams, results), nprocs=num_processes, start_method='spawn')
+    return results.get() if hparams.benchmark_steps else None
+
+
+def scaling_benchmark(hparams, process_counts):
+    # same threads per process at every scale, so the efficiency is about the parallelism only
+    hparams.threads_per_proc = hparams.threads_per_proc or max(1, os.cpu_count() // max(process_counts))
+    throughput = {n: launch(hparams, n) for n in process_counts}
+
+    base = throughput[process_counts[0]] / process_counts[0]
+    print(f'{hparams.model}, {hparams.threads_per_proc} threads / process')
+    print('| processes | samples / sec | speedup | scaling efficiency |')
+    print('|---|---|---|---|')
+    for n in process_counts:
+        print(f'| {n} | {throughput[n]:.2f} | {throughput[n] / throughput[process_counts[0]]:.2f}x '
+              f'| {throughput[n] / (n * base):.0%} |')
+
+
+if __name__ == '__main__':
+    from test_tube import HyperOptArgumentParser
+
+    parser = HyperOptArgumentParser(add_help=False)
+    parser.add_argument('--model', type=str, default='roadmap_bce')
+    (temp_args, arr) = parser.parse_known_args()
+    parser = MODEL_NAMES[temp_args.model].add_model_specific_args(parser)
+
+    parser.add_argument('--num_processes', type=int, default=2)
+    parser.add_argument('--threads_per_proc', type=int, default=None, help='default: cpu count / processes')
+    parser.add_argument('--num_workers', type=int, default=2, help='DataLoader workers per process')
+    parser.add_argument('--max_epochs', type=int, default=10)
+    parser.add_argument('--logs_save_path', default='/scratch/ab8690/logs')
+    parser.add_argument('--master_port', type=int, default=29511)
+    parser.add_argument('--benchmark', type=str, default=None, help='process counts to compare, e.g. 1,2,4')
+    parser.add_argument('--benchmark_steps', type=int, default=None)
+    parser.add_argument('--warmup_steps', type=int, default=3)
+    args = parser.parse_args()
+
+    # test_tube hangs parser methods on the namespace, only the values go to the workers
+    hparams = Namespace(**{k: v for k, v in vars(args).items() if not callable(v)})
+
+    if hparams.benchmark:
+        hparams.benchmark_steps = hparams.benchmark_steps or 20
+        scaling_benchmark(hparams, [int(n) for n in hparams.benchmark.split(',')])
+    else:
+        hparams.benchmark_steps = None
+        hparams.threads_per_proc = hparams.threads_per_proc or max(1, os.cpu_count() // hparams.num_processes)
+        launch(hparams, hparams.num_processes)
@@ -0,0 +1,57 @@
+"""
+Data echoing: every decoded batch is used for echo_factor training steps
+
+When the JPEG decode in the loader workers is the bottleneck, the training step would otherwise
+wait on the loader; echoes keep it busy. Each echo after the first is shuffled within the batch,
+and models that draw their own randomness per step (BasicAE.six_to_one_task blacks out a random
+camera) see a different view of the same samples every time.
+
+An epoch becomes echo_factor x len(loader) steps over the same fresh data.
+"""
+import torch
+
+
+def shuffle_within_batch(batch):
+    # unlabeled: [b, 6, 3, H, W] tensor; labeled: tuple of fields, one order for all of them.
+    # a field is a per-sample tuple (collate_fn) or already stacked (road_map_collate_fn's road maps)
+    if torch.is_tensor(batch):
+        return batch[torch.randperm(batch.size(0))]
+    order = torch.randperm(len(batch[0])).tolist()
+    return type(batch)(field[order] if torch.is_tensor(field) else tuple(field[i] for i in order)
+                       for field in batch)
+
+
+class EchoingLoader:
+
+    def __init__(self, loader, echo_factor, transform=shuffle_within_batch):
+        self.loader = loader
+        self.echo_factor = echo_factor
+        self.transform = transform
+
+    def __len__(self):
+        return len(self.loader) * self.echo_factor
+
+    def __iter__(self):
+        for batch in self.loader:
+            yield batch
+            for _ in range(self.echo_factor - 1):
+                yield self.transform(batch)
+
+    def __getattr__(self, name):
+        # batch_size, dataset, ... of the wrapped loader
+        if name == 'loader':
+            raise AttributeError(name)
+        return getattr(self.loader, name)
+
+
+def echo_train_dataloader(model, train_dataloader, echo_factor):
+    """
+    Wraps the loader passed to trainer.fit, or the model's own train_dataloader if there is none
+    (it can only be built after prepare_data, so the method gets wrapped instead)
+    """
+    if train_dataloader is not None:
+        return EchoingLoader(train_dataloader, echo_factor)
+
+    model_train_dataloader = model.train_dataloader
+    model.train_dataloader = lambda: EchoingLoader(model_train_dataloader(), echo_factor)
+    return None
@@ -0,0 +1,331 @@
+"""
+Node-local data service: decodes every sample once and serves it to all trainers on the node
+
+The service owns the dataset and decodes it (shuffled, endlessly) in blocks into a shared memory
+ring of num_slots samples, one block per half of the ring, so the next block is decoded while
+the current one is consumed. Trainers subscribe over a unix socket and ask for batches; the
+reply only holds slot numbers (+ the small bounding box targets), the tensors are copied straight
+out of shared memory. Every subscriber walks each block in its own random order, a block is
+freed once every subscriber has finished it.
+
+--model serves that model's own training split (the split_scenes of its prepare_data), so the scenes its
+trainers validate on never come in as training batches; a trainer refuses a service that serves any
+of its validation scenes.
+
+    python -m src.utils.data_service --model roadmap_bce --address /tmp/dd_data.sock
+    python -m src.submit --model roadmap_bce --single_run --data_service /tmp/dd_data.sock
+"""
+import time
+import threading
+import itertools
+from argparse import ArgumentParser
+from multiprocessing import shared_memory, resource_tracker
+from multiprocessing.connection import Listener, Client
+
+import numpy as np
+import torch
+import torchvision
+
+from src.utils.data_helper import LabeledDataset, UnlabeledDataset
+from src.utils.helper import split_scenes, parse_scenes
+
+IMAGE_SHAPE = (6, 3, 256, 306)
+ROAD_SHAPE = (800, 800)
+AUTHKEY = b'driving-dirty'
+
+
+def _slot_bytes(labeled):
+    return int(np.prod(IMAGE_SHAPE)) * 4 + (int(np.prod(ROAD_SHAPE)) if labeled else 0)
+
+
+def training_split(model_name):
+    """
+    (labeled, scene index) the training set of a MODEL_NAMES model is built from in its prepare_data
+    """
+    if model_name == 'roadmap_distill':
+        # the teacher labels every unlabeled scene, the labeled ones only validate
+        return False, np.arange(106)
+    if model_name == 'basic_ae':
+        return False, split_scenes(np.arange(106))[0]
+    return True, split_scenes(np.arange(106, 134))[0]
+
+
+class _Block:
+
+    def __init__(self, slots, targets, pending):
+        self.slots = slots
+        self.targets = targets
+        # subscribers that haven't finished this block yet
+        self.pending = pending
+
+
+class BatchService:
+
+    def __init__(self, dataset, labeled, num_slots=64, seed=0):
+        self.dataset = dataset
+        self.labeled = labeled
+        self.block_size = num_slots // 2
+        self.slot_bytes = _slot_bytes(labeled)
+        self.shm = shared_memory.SharedMemory(create=True, size=num_slots * self.slot_bytes)
+        self.rng = np.random.RandomState(seed)
+
+        self.cond = threading.Condition()
+        self.blocks = {}
+        self.next_block = 0
+        self.subscribers = {}
+        self.num_decoded = 0
+        self.start_time = time.time()
+
+    # -------------------------
+    # decoding
+    # -------------------------
+    def _index_stream(self):
+        # the whole dataset in a new random order every pass
+        while True:
+            yield from self.rng.permutation(len(self.dataset))
+
+    def _write_slot(self, slot, item):
+        offset = slot * self.slot_bytes
+        if self.labeled:
+            sample, target, road_image = item
+        else:
+            sample, target, road_image = item, None, None
+
+        images = np.ndarray(IMAGE_SHAPE, dtype=np.float32, buffer=self.shm.buf, offset=offset)
+        images[...] = sample.numpy()
+        if road_image is not None:
+            road = np.ndarray(ROAD_SHAPE, dtype=np.uint8, buffer=self.shm.buf, offset=offset + images.nbytes)
+            road[...] = road_image.numpy()
+        return target
+
+    def decode_forever(self):
+        indices = self._index_stream()
+        for k in itertools.count():
+            with self.cond:
+                # nobody to decode for yet / wait for the block that used this half of the ring
+                self.cond.wait_for(lambda: self.subscribers and (k - 2) not in self.blocks)
+
+            slots = list(range((k % 2) * self.block_size, (k % 2 + 1) * self.block_size))
+            targets = [self._write_slot(slot, self.dataset[i]) for slot, i in zip(slots, indices)]
+
+            with self.cond:
+                self.blocks[k] = _Block(slots, targets, set(self.subscribers))
+                self.next_block = k + 1
+                self.num_decoded += len(slots)
+                self._maybe_free(k)
+                self.cond.notify_all()
+
+    def _maybe_free(self, k):
+        if k in self.blocks and not self.blocks[k].pending:
+            del self.blocks[k]
+            self.cond.notify_all()
+
+    # -------------------------
+    # subscribers
+    # -------------------------
+    def serve(self, conn, sid):
+        rng = np.random.RandomState(sid)
+        block_id, order, cursor = None, [], 0
+        try:
+            while True:
+                op, arg = conn.recv()
+                if op == 'info':
+                    conn.send({'shm_name': self.shm.name, 'slot_bytes': self.slot_bytes,
+                               'labeled': self.labeled, 'num_samples': len(self.dataset),
+                               'scene_index': [int(s) for s in self.dataset.scene_index]})
+                elif op == 'stats':
+                    conn.send(self.stats())
+                elif op == 'next':
+                    with self.cond:
+                        if block_id is None:
+                            # a connection only subscribes with its first batch request: blocks wait for
+                            # every subscriber, an info / stats only client must not hold them up.
+                            # The decoder waits for its first subscriber
+                            self.subscribers[sid] = {'served': 0, 'since': time.time()}
+                            self.cond.notify_all()
+                            # join at the newest block, older ones were decoded before we were around
+                            block_id = max(self.blocks) if self.blocks else self.next_block
+                            if block_id in self.blocks:
+                                self.blocks[block_id].pending.add(sid)
+                            for k in [k for k in self.blocks if k < block_id]:
+                                self.blocks[k].pending.discard(sid)
+                                self._maybe_free(k)
+                            self.cond.wait_for(lambda: block_id in self.blocks)
+                            order = rng.permutation(self.block_size)
+                        if cursor == len(order):
+                            self.blocks[block_id].pending.discard(sid)
+                            self._maybe_free(block_id)
+                            block_id += 1
+                            self.cond.wait_for(lambda: block_id in self.blocks)
+                            order, cursor = rng.permutation(self.block_size), 0
+
+                        take = order[cursor:cursor + arg]
+                        cursor += len(take)
+                        block = self.blocks[block_id]
+                        reply = {'slots': [block.slots[j] for j in take], 'targets': [block.targets[j] for j in take]}
+                        self.subscribers[sid]['served'] += len(take)
+                    conn.send(reply)
+        except (EOFError, ConnectionResetError):
+            pass
+        finally:
+            with self.cond:
+                self.subscribers.pop(sid, None)
+                for k in list(self.blocks):
+                    self.blocks[k].pending.discard(sid)
+                    self._maybe_free(k)
+            conn.close()
+
+    def stats(self):
+        elapsed = time.time() - self.start_time
+        now = time.time()
+        subscribers = {sid: s['served'] / (now - s['since']) for sid, s in self.subscribers.items()}
+        served = sum(s['served'] for s in self.subscribers.values())
+        return {'decoded_per_sec': self.num_decoded / elapsed,
+                'served_per_sec': sum(subscribers.values()),
+                'fan_out': served / max(self.num_decoded, 1),
+                'subscribers': subscribers}
+
+    def report_forever(self, every):
+        while True:
+            time.sleep(every)
+            with self.cond:
+                s = self.stats()
+            per_sub = ', '.join(f'{sid}: {v:.1f}' for sid, v in s['subscribers'].items())
+            print(f"decoded {s['decoded_per_sec']:.1f} samples/s, served {s['served_per_sec']:.1f} samples/s "
+                  f"(fan-out {s['fan_out']:.2f}) | per subscriber {per_sub}", flush=True)
+
+    def run(self, address, report_every=30):
+        threading.Thread(target=self.decode_forever, daemon=True).start()
+        threading.Thread(target=self.report_forever, args=(report_every,), daemon=True).start()
+        listener = Listener(address, family='AF_UNIX', authkey=AUTHKEY)
+        print(f'serving {len(self.dataset)} samples on {address}', flush=True)
+        try:
+            for sid in itertools.count():
+                conn = listener.accept()
+                threading.Thread(target=self.serve, args=(conn, sid), daemon=True).start()
+        finally:
+            listener.close()
+            self.shm.close()
+            self.shm.unlink()
+
+
+class DataServiceLoader:
+    """
+    Iterable stand-in for a train DataLoader, batches come from a running BatchService
+
+    Labeled batches come out like collate_fn (tuples of samples, targets, road images),
+    unlabeled ones as one [b, 6, 3, 256, 306] tensor like the default collate.
+    """
+
+    def __init__(self, address, batch_size, num_samples=None, model=None):
+        self.address = address
+        self.batch_size = batch_size
+        self.num_samples = num_samples
+        # the trainer's model, its validation scenes must not be served as training data
+        self.model = model
+        self.conn = None
+
+    def _check_scenes(self, scene_index):
+        if self.model is None:
+            return
+        # StackedTrials: the replicas share the split of the first one (its prepare_data)
+        model = self.model.replicas[0] if hasattr(self.model, 'replicas') else self.model
+        validsets = [getattr(model, name) for name in ['labeled_validset', 'unlabeled_validset'] if hasattr(model, name)]
+        if not validsets:
+            raise ValueError(f'{type(model).__name__} has no validation set to check the scenes of the data service '
+                             f'at {self.address} against, run its prepare_data first')
+        for validset in validsets:
+            leaked = sorted(set(scene_index) & {int(s) for s in validset.scene_index})
+            if leaked:
+                raise ValueError(f'the data service at {self.address} serves validation scenes {leaked}, '
+                                 f'start it with --model to serve the training split only')
+
+    def _connect(self):
+        if self.conn is not None:
+            return
+        self.conn = Client(self.address, family='AF_UNIX', authkey=AUTHKEY)
+        self.conn.send(('info', None))
+        info = self.conn.recv()
+        self._check_scenes(info['scene_index'])
+        self.shm = shared_memory.SharedMemory(name=info['shm_name'])
+        # the service owns the segment, don't let this process' tracker unlink it at exit
+        resource_tracker.unregister(self.shm._name, 'shared_memory')
+        self.slot_bytes = info['slot_bytes']
+        self.labeled = info['labeled']
+        self.num_samples = self.num_samples or info['num_samples']
+
+    def __len__(self):
+        self._connect()
+        return -(-self.num_samples // self.batch_size)
+
+    def _read(self, slot):
+        offset = slot * self.slot_bytes
+        images = np.ndarray(IMAGE_SHAPE, dtype=np.float32, buffer=self.shm.buf, offset=offset)
+        sample = torch.from_numpy(images.copy())
+        if not self.labeled:
+            return sample, None
+        road = np.ndarray(ROAD_SHAPE, dtype=np.uint8, buffer=self.shm.buf, offset=offset + images.nbytes)
+        return sample, torch.from_numpy(road.astype(bool))
+
+    def __iter__(self):
+        for _ in range(len(self)):
+            # slots stay valid until our next request, everything is copied out before it
+            self.conn.send(('next', self.batch_size))
+            reply = self.conn.recv()
+            samples, road_images = zip(*[self._read(slot) for slot in reply['slots']])
+            if self.labeled:
+                yield samples, tuple(reply['targets']), road_images
+            else:
+                yield torch.stack(samples, dim=0)
+
+    def stats(self):
+        self._connect()
+        self.conn.send(('stats', None))
+        return self.conn.recv()
+
+    def __getstate__(self):
+        # connections and shared memory don't pickle, reconnect on first use
+        state = dict(self.__dict__)
+        state['conn'] = None
+        state['model'] = None
+        state.pop('shm', None)
+        return state
+
+
+if __name__ == '__main__':
+    from src.submit import MODEL_NAMES
+
+    parser = ArgumentParser()
+    parser.add_argument('--link', type=str, default='/scratch/ab8690/DLSP20Dataset/data')
+    parser.add_argument('--model', type=str, default=None, choices=list(MODEL_NAMES),
+                        help="serve this model's training split")
+    parser.add_argument('--labeled', default=False, action='store_true')
+    parser.add_argument('--scenes', type=str, default=None,
+                        help="without --model: training scenes to serve, none of the trainer's validation scenes")
+    parser.add_argument('--address', type=str, default='/tmp/dd_data.sock')
+    parser.add_argument('--num_slots', type=int, default=64, help='ring size in samples, one block is half of it')
+    parser.add_argument('--report_every', type=float, default=30)
+    parser.add_argument('--seed', type=int, default=20200505)
+    args = parser.parse_args()
+
+    if args.model:
+        args.labeled, scene_index = training_split(args.model)
+    elif args.scenes is None:
+        parser.error('--model or --scenes is needed, the trainer validates on some of the labeled / unlabeled scenes')
+    else:
+        scene_index = parse_scenes(args.scenes)
+
+    transform = torchvision.transforms.ToTensor()
+    if args.labeled:
+        dataset = LabeledDataset(image_folder=args.link,
+                                 annotation_file=args.link + '/annotation.csv',
+                                 scene_index=scene_index,
+                                 transform=transform,
+                                 extra_info=False)
+    else:
+        dataset = UnlabeledDataset(image_folder=args.link,
+                                   scene_index=scene_index,
+                                   first_dim='sample',
+                                   transform=transform)
+
+    BatchService(dataset, args.labeled, args.num_slots, args.seed).run(args.address, args.report_every)
@@ -0,0 +1,46 @@
+import contextlib
+
+import torch
+from torch import nn
+
+# fp32: plain eager, bf16: cpu autocast to bfloat16, channels_last: NHWC convs
+EXEC_MODES = ['fp32', 'bf16', 'channels_last', 'bf16_channels_last']
+
+CONV_TYPES = (nn.Conv2d, nn.ConvTranspose2d)
+
+
+def _to_channels_last(module, inputs):
+    return tuple(x.contiguous(memory_format=torch.channels_last) if torch.is_tensor(x) and x.dim() == 4 else x
+                 for x in inputs)
+
+
+def apply_exec_mode(model, exec_mode):
+    """
+    Prepares the weights of model for exec_mode
+
+    For channels last every conv weight is converted and every conv input is converted
+    on the way in, so the models don't need to care where their 4d tensors come from
+    """
+    assert exec_mode in EXEC_MODES, f'exec_mode must be one of {EXEC_MODES}'
+
+    if 'channels_last' in exec_mode:
+        for module in model.modules():
+            if isinstance(module, CONV_TYPES):
+                module.to(memory_format=torch.channels_last)
+                module.register_forward_pre_hook(_to_channels_last)
+    return model
+
+
+def exec_context(exec_mode):
+    """
+    Context to run forward passes in, losses should be computed outside of it in fp32
+    """
+    if 'bf16' in exec_mode:
+        return torch.autocast(device_type='cpu', dtype=torch.bfloat16)
+    return contextlib.nullcontext()
+
+
+def add_exec_mode_args(parser):
+    parser.add_argument('--exec_mode', type=str, default='fp32', choices=EXEC_MODES,
+                        help='numeric precision / memory format for the forward pass')
+    return parser
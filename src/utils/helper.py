@@ -5,8 +5,6 @@ import torch.nn as nn
 import torch.nn.functional as F
 import torchvision
 
-from shapely.geometry import Polygon
-
 def convert_map_to_lane_map(ego_map, binary_lane):
     mask = (ego_map[0,:,:] == ego_map[1,:,:]) * (ego_map[1,:,:] == ego_map[2,:,:]) + (ego_map[0,:,:] == 250 / 255)
 
@@ -22,6 +20,47 @@ def convert_map_to_road_map(ego_map):
 def collate_fn(batch):
     return tuple(zip(*batch))
 
+def road_map_collate_fn(batch, size=None):
+    # same as collate_fn but road maps come out as one [b, 1, H, W] float tensor,
+    # resized in the loader workers to the (H, W) of the image layout they get concatenated with
+    sample, target, road_image = collate_fn(batch)
+    road_image = torch.stack(road_image, dim=0).float().unsqueeze(1)
+
+    if size is not None and tuple(road_image.shape[-2:]) != tuple(size):
+        road_image = F.interpolate(road_image, size=tuple(size), mode='nearest')
+
+    return sample, target, road_image
+
+def parse_scenes(scenes):
+    # '106-133' or '106,107,110'
+    if '-' in scenes:
+        start, end = scenes.split('-')
+        return np.arange(int(start), int(end) + 1)
+    return np.array([int(s) for s in scenes.split(',')])
+
+def split_scenes(scene_index, train_fraction=0.8, seed=20200505):
+    # split into train / validation scenes (never at the sample level, that leaks), on a RandomState
+    # of its own: same split in every process, whatever the global numpy rng went through before
+    scene_index = np.array(scene_index)
+    np.random.RandomState(seed).shuffle(scene_index)
+    trainset_size = round(train_fraction * len(scene_index))
+    return scene_index[:trainset_size], scene_index[trainset_size:]
+
+def held_out_scenes():
+    # validation scenes of the labeled models (prepare_data), never trained on
+    return np.sort(split_scenes(np.arange(106, 134))[1])
+
+def layout_images_as_map(sample, size=800):
+    # tuple([6 x 3 x H x W]) of length b or [b x 6 x 3 x H x W] --> [b x 3 x size x size]
+    # front cameras (left -> right) on the top half, back cameras (right -> left) on the bottom half,
+    # same camera order as the wide stitch, then resized to the square the detector boxes live on
+    x = torch.stack(sample, dim=0) if isinstance(sample, (list, tuple)) else sample
+    x = x[:, [0, 1, 2, 5, 4, 3]]
+
+    b, num_imgs, c, h, w = x.size()
+    x = x.reshape(b, 2, 3, c, h, w).permute(0, 3, 1, 4, 2, 5).reshape(b, c, 2 * h, 3 * w)
+    return F.interpolate(x.float(), size=(size, size), mode='bilinear', align_corners=False)
+
 def draw_box(ax, corners, color):
     point_squence = torch.stack([corners[:, 0], corners[:, 1], corners[:, 3], corners[:, 2], corners[:, 0]])
     
@@ -77,8 +116,28 @@ def compute_ts_road_map(road_map1, road_map2):
     return tp * 1.0 / (road_map1.sum() + road_map2.sum() - tp)
 
 def compute_iou(box1, box2):
+    # shapely is only needed for evaluation, keep it off the import path of training / serving
+    from shapely.geometry import Polygon
+
     a = Polygon(torch.t(box1)).convex_hull
     b = Polygon(torch.t(box2)).convex_hull
     
     return a.intersection(b).area / a.union(b).area
 
+
+def log_fast_rcnn_images(model, image, pred_boxes, target_boxes, road_image, step_name):
+    # image: [3, H, W] detector input, boxes: [N, 2, 4] in meters, road_image: [H, W]
+    # PIL is only needed to draw the boxes, same as compute_iou keep it off the import path
+    from src.utils.bb_to_img import boxes_to_binary_map
+
+    size = road_image.shape[-1]
+    road = road_image.detach().float().cpu() * 0.5
+    pred = torch.from_numpy(boxes_to_binary_map(pred_boxes.detach(), size).copy()).float()
+    target = torch.from_numpy(boxes_to_binary_map(target_boxes.detach(), size).copy()).float()
+
+    # road map in gray, predicted boxes in red, target boxes in green
+    overlay = torch.stack([torch.max(road, pred), torch.max(road, target), road], dim=0)
+    input_image = torchvision.utils.make_grid(image.detach().float().cpu(), normalize=True)
+
+    model.logger.experiment.add_image(f'{step_name}_input_images', input_image, model.trainer.global_step)
+    model.logger.experiment.add_image(f'{step_name}_pred_target_bbs', overlay, model.trainer.global_step)
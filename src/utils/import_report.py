@@ -0,0 +1,66 @@
+"""
+Startup cost per entry point: runs each one in a fresh interpreter with -X importtime and reports
+total import time, wall time of the process and the heaviest top-level imports.
+
+python -m src.utils.import_report
+python -m src.utils.import_report --entry "src.submit:roadmap_bce" --top 10
+"""
+import re
+import subprocess
+import sys
+import time
+from argparse import ArgumentParser
+
+from src.submit import MODEL_NAMES
+
+# module[:model name] -> just import the module, or also resolve that model through the registry
+ENTRY_POINTS = ['src.submit', 'src.utils.run_test', 'src.inference.engine', 'src.inference.server',
+                'src.inference.exported'] + [f'src.submit:{name}' for name in MODEL_NAMES]
+
+IMPORT_LINE = re.compile(r'import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)')
+
+
+def _code(entry):
+    module, _, model = entry.partition(':')
+    if model:
+        return f"from {module} import MODEL_NAMES; MODEL_NAMES['{model}']"
+    return f'import {module}'
+
+
+def measure(entry):
+    """
+    returns (import seconds, process wall seconds, [(cumulative seconds, top-level module)])
+    """
+    start = time.time()
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', _code(entry)],
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    wall = time.time() - start
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.splitlines()[-1])
+
+    top_level = []
+    for line in result.stderr.splitlines():
+        match = IMPORT_LINE.match(line)
+        # one space of indent is the root of an import tree, nested imports are indented further
+        if match and len(match.group(3)) == 1:
+            top_level.append((int(match.group(2)) / 1e6, match.group(4)))
+    return sum(t for t, _ in top_level), wall, sorted(top_level, reverse=True)
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('--entry', type=str, action='append', default=None,
+                        help='module or module:model_name, every entry point if not set')
+    parser.add_argument('--top', type=int, default=3, help='heaviest top-level imports to list per entry')
+    args = parser.parse_args()
+
+    print('| entry point | imports (s) | process (s) | heaviest imports |')
+    print('|---|---|---|---|')
+    for entry in args.entry or ENTRY_POINTS:
+        try:
+            imports, wall, heaviest = measure(entry)
+        except RuntimeError as e:
+            print(f'| {entry} | - | - | {e} |')
+            continue
+        heaviest = ', '.join(f'{name} {t:.2f}' for t, name in heaviest[:args.top])
+        print(f'| {entry} | {imports:.2f} | {wall:.2f} | {heaviest} |')
@@ -0,0 +1,77 @@
+"""
+Loss-based importance sampling for the labeled training set
+
+LossImportanceSampler keeps an exponential running loss per sample, fed from the model's
+_run_step, and draws each epoch with replacement from
+
+    p_i = (1 - floor) * loss_i / sum(loss) + floor / N
+
+so samples the model already gets right come up less often but never drop out (p_i >= floor / N).
+The loss of sample i is weighted by 1 / (N p_i) ** beta, beta=1 keeps the gradient unbiased; the
+floor also caps that weight at 1 / floor. The first warmup_epochs are a plain shuffle that fills
+in the running losses.
+"""
+import torch
+from torch.utils.data import Sampler
+
+
+class LossImportanceSampler(Sampler):
+
+    def __init__(self, num_samples, batch_size, floor=0.2, beta=1., momentum=0.9, warmup_epochs=1):
+        self.num_samples = num_samples
+        self.batch_size = batch_size
+        self.floor = floor
+        self.beta = beta
+        self.momentum = momentum
+        self.warmup_epochs = warmup_epochs
+
+        self.running_loss = torch.zeros(num_samples)
+        self.seen = torch.zeros(num_samples, dtype=torch.bool)
+        self.epoch = 0
+        self.indices = torch.randperm(num_samples)
+        self.weights = torch.ones(num_samples)
+
+    def probabilities(self):
+        # samples not seen yet get the mean loss of those that were
+        loss = self.running_loss.clone()
+        loss[~self.seen] = loss[self.seen].mean() if self.seen.any() else 1.
+        return (1 - self.floor) * loss / loss.sum().clamp(min=1e-12) + self.floor / self.num_samples
+
+    def __iter__(self):
+        if self.epoch < self.warmup_epochs or not self.seen.any():
+            self.indices = torch.randperm(self.num_samples)
+            self.weights = torch.ones(self.num_samples)
+        else:
+            p = self.probabilities()
+            self.indices = torch.multinomial(p, self.num_samples, replacement=True)
+            self.weights = (1. / (self.num_samples * p[self.indices])) ** self.beta
+        self.epoch += 1
+        # the DataLoader keeps batches in sampler order, batch_idx finds its samples in self.indices
+        return iter(self.indices.tolist())
+
+    def __len__(self):
+        return self.num_samples
+
+    def reweight(self, batch_idx, per_sample_loss):
+        """
+        per_sample_loss: [b] losses of training batch batch_idx -> importance weighted mean loss,
+        also records the losses for the next epoch's draw
+        """
+        start = batch_idx * self.batch_size
+        idx = self.indices[start:start + per_sample_loss.size(0)]
+        weights = self.weights[start:start + per_sample_loss.size(0)].to(per_sample_loss)
+
+        loss = per_sample_loss.detach().float().cpu()
+        old = torch.where(self.seen[idx], self.running_loss[idx], loss)
+        self.running_loss[idx] = self.momentum * old + (1 - self.momentum) * loss
+        self.seen[idx] = True
+
+        return (weights * per_sample_loss).mean()
+
+
+def add_importance_sampling_args(parser):
+    parser.add_argument('--importance_sampling', default=False, action='store_true',
+                        help='draw training samples by running loss instead of a uniform shuffle')
+    parser.add_argument('--is_floor', type=float, default=0.2, help='share of the uniform distribution mixed in')
+    parser.add_argument('--is_beta', type=float, default=1., help='bias correction exponent, 1 is unbiased')
+    return parser
@@ -0,0 +1,160 @@
+"""
+Runs the opt_list grid of submit.py on one machine, several trials at a time
+
+Every worker process owns a slot for its lifetime: a disjoint set of cores it is pinned to
+(sched_setaffinity), that many torch threads and a DataLoader worker budget. Trials run in
+these workers one after the other, so concurrent trials don't oversubscribe the node.
+Final callback metrics of every trial end up in one results table (printed + sweep_results.csv).
+
+python -m src.submit --model roadmap_bce --local_workers 4 --max_epochs 10
+"""
+import os
+import csv
+import time
+import multiprocessing
+from argparse import Namespace
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+
+def core_slots(num_slots, cores_per_slot=None):
+    # splits the cores this process may run on into num_slots disjoint, contiguous sets
+    cores = sorted(os.sched_getaffinity(0))
+    cores_per_slot = cores_per_slot or max(1, len(cores) // num_slots)
+    if cores_per_slot * num_slots > len(cores):
+        raise ValueError(f'{num_slots} slots x {cores_per_slot} cores needs more than the {len(cores)} available')
+    return [cores[i * cores_per_slot:(i + 1) * cores_per_slot] for i in range(num_slots)]
+
+
+def varying_names(trials):
+    # the hparams the grid actually changes between trials
+    values = [vars(t) for t in trials]
+    return sorted(k for k in values[0] if len({repr(v.get(k)) for v in values}) > 1)
+
+
+def _metric(value):
+    return value.item() if hasattr(value, 'item') else value
+
+
+def _val_scenes(model):
+    # the scenes a trial validated on, '106,109,...' (the replicas of StackedTrials share one split)
+    model = model.replicas[0] if hasattr(model, 'replicas') else model
+    for name in ['labeled_validset', 'unlabeled_validset']:
+        validset = getattr(model, name, None)
+        if validset is not None:
+            return ','.join(str(s) for s in sorted(int(s) for s in validset.scene_index))
+    return ''
+
+
+# (cores, num_workers) of the slot this worker process owns, see _init_worker
+_slot = None
+
+
+def _init_worker(free_slots):
+    # every pool worker takes one slot for its whole life: it runs trial after trial and its
+    # torch / OpenMP threads keep whatever affinity they started with, so a slot can't move
+    global _slot
+    _slot = free_slots.get()
+    cores, _ = _slot
+    # still single threaded here, torch's thread pool and the DataLoader workers inherit the affinity
+    os.sched_setaffinity(0, cores)
+    import torch
+    torch.set_num_threads(len(cores))
+
+
+def _run_trial(trial_idx, trial):
+    import random
+    import numpy as np
+    import torch
+    from src.submit import main
+
+    # the model modules seed at import, i.e. once per worker: reseed so every trial starts from the
+    # same rng state (weight init, shuffling) as in a fresh process, whatever ran in this worker before
+    random.seed(20200505)
+    np.random.seed(20200505)
+    torch.manual_seed(20200505)
+
+    _, num_workers = _slot
+    trial.num_workers = num_workers
+    trial.tt_name = os.path.join(trial.tt_name, f'trial_{trial_idx}')
+    start = time.time()
+    trainer = main(trial, None)
+
+    # full training state (optimizer, epoch) at a known path, a later run can resume from it
+    if getattr(trial, 'last_ckpt_path', None):
+        trainer.save_checkpoint(trial.last_ckpt_path)
+
+    metrics = {k: _metric(v) for k, v in trainer.callback_metrics.items()}
+    metrics['wall_time_sec'] = time.time() - start
+    metrics['val_scenes'] = _val_scenes(trainer.get_model())
+    return trial_idx, metrics
+
+
+def trial_namespaces(hparams):
+    # test_tube hangs its parser methods on every trial namespace, only the values go to the workers
+    return [Namespace(**{k: v for k, v in vars(t).items() if not callable(v)})
+            for t in hparams.trials(hparams.nb_hopt_trials)]
+
+
+def run_trials(hparams, trials):
+    """
+    trials: {trial index: namespace}, runs them hparams.local_workers at a time -> {trial index: metrics}
+    """
+    slots = core_slots(hparams.local_workers, hparams.cores_per_trial)
+    # one core of every slot stays with the training process, the rest decode data
+    num_workers = hparams.num_workers if hparams.num_workers is not None else max(0, len(slots[0]) - 1)
+
+    print(f'{len(trials)} trials, {len(slots)} at a time, {len(slots[0])} cores / {num_workers} loader workers each')
+
+    # spawn: a forked child would inherit the parent's torch thread pool and affinity
+    context = multiprocessing.get_context('spawn')
+    free_slots = context.Queue()
+    for cores in slots:
+        free_slots.put((cores, num_workers))
+
+    results = {}
+    # one worker per slot, each worker pins itself to its slot once (_init_worker)
+    with ProcessPoolExecutor(max_workers=len(slots), mp_context=context,
+                             initializer=_init_worker, initargs=(free_slots,)) as pool:
+        futures = [pool.submit(_run_trial, i, trial) for i, trial in trials.items()]
+        for future in as_completed(futures):
+            try:
+                trial_idx, metrics = future.result()
+            except Exception as e:
+                print(f'trial failed: {e!r}')
+                continue
+            results[trial_idx] = metrics
+            print(f'trial {trial_idx} done: {metrics}')
+    return results
+
+
+def run_local_sweep(hparams):
+    trials = trial_namespaces(hparams)
+    results = run_trials(hparams, dict(enumerate(trials)))
+    write_results(hparams, trials, results)
+    return results
+
+
+def write_results(hparams, trials, results):
+    names = varying_names(trials)
+    metric_names = sorted({k for m in results.values() for k in m})
+    header = ['trial'] + names + metric_names
+
+    rows = []
+    for i, trial in enumerate(trials):
+        metrics = results.get(i, {})
+        rows.append([i] + [getattr(trial, n) for n in names] + [metrics.get(k, '') for k in metric_names])
+
+    def fmt(v):
+        return f'{v:.4g}' if isinstance(v, float) else str(v)
+
+    print('| ' + ' | '.join(header) + ' |')
+    print('|' + '---|' * len(header))
+    for row in rows:
+        print('| ' + ' | '.join(fmt(v) for v in row) + ' |')
+
+    path = os.path.join(hparams.logs_save_path, hparams.tt_name)
+    os.makedirs(path, exist_ok=True)
+    with open(os.path.join(path, 'sweep_results.csv'), 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        writer.writerows(rows)
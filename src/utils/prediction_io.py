@@ -0,0 +1,92 @@
+import numpy as np
+import torch
+
+MAP_SIZE = 800
+
+
+def pack_maps(maps):
+    # bool [n, 800, 800] -> uint8 [n, 800, 100], 8x smaller than bool
+    if torch.is_tensor(maps):
+        maps = maps.cpu().numpy()
+    return np.packbits(maps.astype(bool), axis=-1)
+
+
+def unpack_maps(packed, size=MAP_SIZE):
+    return np.unpackbits(packed, axis=-1, count=size).astype(bool)
+
+
+def pack_ragged(arrays, dtype=np.float32):
+    # list of n arrays [N_i, ...] -> values [sum N_i, ...] + offsets [n + 1]
+    arrays = [a.cpu().numpy() if torch.is_tensor(a) else np.asarray(a) for a in arrays]
+    offsets = np.zeros(len(arrays) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(a) for a in arrays])
+    values = np.concatenate(arrays).astype(dtype) if arrays else np.zeros(0, dtype=dtype)
+    return values, offsets
+
+
+def unpack_ragged(values, offsets):
+    return [values[offsets[i]:offsets[i + 1]] for i in range(len(offsets) - 1)]
+
+
+def pack_predictions(predictions):
+    """
+    Turns the concatenated output of model.predict for some samples into flat numpy arrays
+
+    road_map / box_map: bit packed, boxes / labels / scores: ragged values + offsets
+    """
+    arrays = {}
+    for key in ['road_map', 'box_map']:
+        if key in predictions:
+            arrays[key] = pack_maps(predictions[key])
+    if 'boxes' in predictions:
+        arrays['boxes'], arrays['box_offsets'] = pack_ragged(predictions['boxes'])
+        arrays['labels'], _ = pack_ragged(predictions['labels'], dtype=np.int64)
+        arrays['scores'], _ = pack_ragged(predictions['scores'])
+    if 'latent' in predictions:
+        arrays['latent'] = predictions['latent'].cpu().numpy().astype(np.float32)
+    return arrays
+
+
+def unpack_predictions(arrays):
+    predictions = {}
+    for key in ['road_map', 'box_map']:
+        if key in arrays:
+            predictions[key] = unpack_maps(arrays[key])
+    if 'boxes' in arrays:
+        offsets = arrays['box_offsets']
+        predictions['boxes'] = unpack_ragged(arrays['boxes'], offsets)
+        predictions['labels'] = unpack_ragged(arrays['labels'], offsets)
+        predictions['scores'] = unpack_ragged(arrays['scores'], offsets)
+    if 'latent' in arrays:
+        predictions['latent'] = arrays['latent']
+    return predictions
+
+
+def concat_predictions(chunks):
+    # list of model.predict outputs -> one dict covering all their samples
+    out = {}
+    for key in chunks[0]:
+        if torch.is_tensor(chunks[0][key]):
+            out[key] = torch.cat([c[key] for c in chunks], dim=0)
+        else:
+            out[key] = [x for c in chunks for x in c[key]]
+    return out
+
+
+def split_predictions(predictions, n):
+    # inverse of concat_predictions: first n samples, rest
+    head, tail = {}, {}
+    for key, value in predictions.items():
+        head[key], tail[key] = value[:n], value[n:]
+    return head, tail
+
+
+def save_scene(path, scene_id, sample_ids, predictions):
+    np.savez(path, scene=scene_id, sample=np.asarray(sample_ids), **pack_predictions(predictions))
+
+
+def load_scene(path):
+    arrays = dict(np.load(path))
+    scene_id = int(arrays.pop('scene'))
+    sample_ids = arrays.pop('sample')
+    return scene_id, sample_ids, unpack_predictions(arrays)
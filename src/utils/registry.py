@@ -0,0 +1,29 @@
+import importlib
+from collections.abc import Mapping
+
+
+class LazyRegistry(Mapping):
+    """
+    name -> 'package.module:ClassName', the module is only imported the first time its name is looked up
+
+    Listing names (choices=list(MODEL_NAMES), `name in MODEL_NAMES`) never imports anything.
+    """
+
+    def __init__(self, entries):
+        self._entries = dict(entries)
+        self._loaded = {}
+
+    def __getitem__(self, name):
+        if name not in self._loaded:
+            module_name, _, attr = self._entries[name].partition(':')
+            self._loaded[name] = getattr(importlib.import_module(module_name), attr)
+        return self._loaded[name]
+
+    def __iter__(self):
+        return iter(self._entries)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, name):
+        return name in self._entries
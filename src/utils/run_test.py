@@ -0,0 +1,153 @@
+"""
+Batched prediction over whole scenes with any model in submit.MODEL_NAMES
+
+Three stages connected by bounded queues: decode (DataLoader workers) -> model (no autograd)
+-> writer. Every scene is written to <out_dir>/scene_<id>.npz, road / box maps bit packed
+and boxes as ragged arrays, see src/utils/prediction_io.py for the format.
+
+python -m src.utils.run_test --model roadmap_bce --rm_ckpt_path '../../checkpoints/rm.ckpt'
+"""
+import os
+import time
+import queue
+from argparse import ArgumentParser
+
+import numpy as np
+import torch
+import torchvision
+from torch.utils.data import DataLoader
+
+from src.submit import MODEL_NAMES
+from src.utils.data_helper import LabeledDataset, UnlabeledDataset, NUM_SAMPLE_PER_SCENE
+from src.utils.helper import collate_fn, parse_scenes
+from src.utils.prediction_io import concat_predictions, split_predictions, save_scene
+from src.inference.pipeline import Stage, raise_errors
+
+# models whose predict needs a road map as input
+NEEDS_ROAD_MAP = ['spatial_rm', 'faster_rcnn_rm']
+
+def build_loader(args, scene_index):
+    transform = torchvision.transforms.ToTensor()
+    if args.labeled:
+        dataset = LabeledDataset(image_folder=args.link,
+                                 annotation_file=os.path.join(args.link, 'annotation.csv'),
+                                 scene_index=scene_index,
+                                 transform=transform,
+                                 extra_info=False)
+        collate = collate_fn
+    else:
+        dataset = UnlabeledDataset(image_folder=args.link,
+                                   scene_index=scene_index,
+                                   first_dim='sample',
+                                   transform=transform)
+        collate = None
+
+    # no shuffle: samples come out scene by scene, in order
+    return DataLoader(dataset, batch_size=args.batch_size, shuffle=False,
+                      num_workers=args.num_workers, collate_fn=collate)
+
+
+def load_model(args):
+    model = MODEL_NAMES[args.model].load_from_checkpoint(args.ckpt_path)
+    model.freeze()
+    model.eval()
+    return model
+
+
+class SceneWriter:
+    """
+    Collects per batch predictions and writes one file as soon as a scene is complete
+    """
+
+    def __init__(self, out_dir, scene_index):
+        self.out_dir = out_dir
+        self.scene_index = scene_index
+        self.next_index = 0
+        self.pending = []
+        self.num_pending = 0
+        self.num_written = 0
+        os.makedirs(out_dir, exist_ok=True)
+
+    def __call__(self, predictions):
+        self.pending.append(predictions)
+        self.num_pending += len(next(iter(predictions.values())))
+
+        while self.num_pending >= NUM_SAMPLE_PER_SCENE:
+            scene, rest = split_predictions(concat_predictions(self.pending), NUM_SAMPLE_PER_SCENE)
+            self.pending = [rest]
+            self.num_pending -= NUM_SAMPLE_PER_SCENE
+            self._write(scene, NUM_SAMPLE_PER_SCENE)
+
+    def flush(self):
+        # scenes are always complete, but never silently drop samples
+        if self.num_pending:
+            self._write(concat_predictions(self.pending), self.num_pending)
+            self.pending, self.num_pending = [], 0
+
+    def _write(self, predictions, num_samples):
+        scene_id = int(self.scene_index[self.next_index // NUM_SAMPLE_PER_SCENE])
+        path = os.path.join(self.out_dir, f'scene_{scene_id}.npz')
+        save_scene(path, scene_id, np.arange(num_samples), predictions)
+        self.next_index += NUM_SAMPLE_PER_SCENE
+        self.num_written += num_samples
+
+
+def to_model_inputs(batch, labeled):
+    # labeled batches are tuples from collate_fn, unlabeled ones are already stacked
+    if labeled:
+        sample, _, road_image = batch
+        return torch.stack(sample, dim=0), torch.stack(road_image, dim=0)
+    return batch, None
+
+
+def main(args):
+    scene_index = parse_scenes(args.scenes)
+    model = load_model(args)
+    loader = build_loader(args, scene_index)
+
+    if args.model in NEEDS_ROAD_MAP and not args.labeled:
+        raise ValueError(f'{args.model} needs road maps as input, run with --labeled')
+
+    def decode(batch):
+        return to_model_inputs(batch, args.labeled)
+
+    def predict(inputs):
+        sample, road_image = inputs
+        with torch.no_grad():
+            predictions = model.predict(sample, road_image)
+        return {k: v.cpu() if torch.is_tensor(v) else [x.cpu() for x in v] for k, v in predictions.items()}
+
+    writer = SceneWriter(args.out_dir, scene_index)
+
+    decoded = queue.Queue(maxsize=args.queue_size)
+    predicted = queue.Queue(maxsize=args.queue_size)
+    stages = [Stage(decode, decoded, iterable=loader),
+              Stage(predict, predicted, in_queue=decoded),
+              Stage(writer, None, in_queue=predicted)]
+
+    start = time.time()
+    for stage in stages:
+        stage.start()
+    for stage in stages:
+        stage.join()
+    writer.flush()
+    elapsed = time.time() - start
+
+    raise_errors(stages)
+
+    print(f'{writer.num_written} samples from {len(scene_index)} scenes in {elapsed:.1f}s '
+          f'-> {writer.num_written / elapsed:.2f} samples/sec')
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('--model', type=str, default='roadmap_bce', choices=list(MODEL_NAMES))
+    parser.add_argument('--ckpt_path', '--rm_ckpt_path', dest='ckpt_path', type=str, required=True)
+    parser.add_argument('--link', type=str, default='/scratch/ab8690/DLSP20Dataset/data')
+    parser.add_argument('--scenes', type=str, default='106-133', help="'106-133' or '106,107'")
+    parser.add_argument('--labeled', default=False, action='store_true')
+    parser.add_argument('--out_dir', type=str, default='predictions')
+    parser.add_argument('--batch_size', type=int, default=16)
+    parser.add_argument('--num_workers', type=int, default=4)
+    parser.add_argument('--queue_size', type=int, default=4, help='max batches buffered between stages')
+    main(parser.parse_args())
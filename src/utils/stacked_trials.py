@@ -0,0 +1,137 @@
+"""
+K replicas of one model trained in a single process on the same decoded batches
+
+Replica i gets learning_rate = --stack_learning_rates[i]. Every batch is loaded and decoded once
+and goes through all K replicas, their losses are summed and one optimizer holds one param group per
+replica, so every replica steps exactly like its own trial would (frozen params stay frozen, the lr
+schedulers act on their replica's group only). Metrics are logged per replica (trial_<i>/...) and
+every replica writes its own checkpoint that the model class loads directly with load_from_checkpoint.
+
+python -m src.submit --model roadmap_bce --single_run --stack_learning_rates 1e-3,3e-4,1e-4
+"""
+import os
+import copy
+
+import torch
+from torch import nn
+from pytorch_lightning import LightningModule
+
+
+class StackedTrials(LightningModule):
+
+    def __init__(self, model_class, hparams):
+        super().__init__()
+        self.hparams = hparams
+        self.learning_rates = [float(lr) for lr in str(hparams.stack_learning_rates).split(',')]
+
+        replicas = []
+        for lr in self.learning_rates:
+            replica_hparams = copy.copy(hparams)
+            replica_hparams.learning_rate = lr
+            replicas.append(model_class(replica_hparams))
+        self.replicas = nn.ModuleList(replicas)
+        self.best_val_loss = [float('inf')] * len(replicas)
+
+        # no checkpoints from the sanity check validation, the replicas are untrained then
+        self.training_started = False
+
+    def _attach(self, replica):
+        # replicas read the trainer state (epoch, global step, logger) like a model the trainer owns
+        replica.trainer = self.trainer
+        replica.logger = self.logger
+        replica.current_epoch = self.current_epoch
+        replica.global_step = self.global_step
+
+    def forward(self, *args, **kwargs):
+        return self.replicas[0](*args, **kwargs)
+
+    def on_train_start(self):
+        self.training_started = True
+        for replica in self.replicas:
+            self._attach(replica)
+            replica.on_train_start()
+
+    def training_step(self, batch, batch_idx):
+        # the replicas share no parameters, the gradient of the sum is every replica's own gradient
+        losses, log = [], {}
+        for i, replica in enumerate(self.replicas):
+            self._attach(replica)
+            output = replica.training_step(batch, batch_idx)
+            losses.append(output['loss'])
+            log.update({f'trial_{i}/{k}': v for k, v in output.get('log', {}).items()})
+        return {'loss': torch.stack(losses).sum(), 'log': log}
+
+    def validation_step(self, batch, batch_idx):
+        outputs = []
+        for replica in self.replicas:
+            self._attach(replica)
+            outputs.append(replica.validation_step(batch, batch_idx))
+        return {'replicas': outputs}
+
+    def validation_epoch_end(self, outputs):
+        log, val_losses = {}, []
+        for i, replica in enumerate(self.replicas):
+            result = replica.validation_epoch_end([o['replicas'][i] for o in outputs])
+            val_loss = result['val_loss']
+            val_losses.append(val_loss)
+
+            log.update({f'trial_{i}/{k}': v for k, v in result.get('log', {}).items()})
+            # the lr schedulers monitor their own replica's loss
+            log[f'trial_{i}_val_loss'] = val_loss
+            if not self.training_started:
+                continue
+            self._save_replica(i, 'last.ckpt')
+            if val_loss.item() < self.best_val_loss[i]:
+                self.best_val_loss[i] = val_loss.item()
+                self._save_replica(i, 'best.ckpt')
+
+        result = {'val_loss': torch.stack(val_losses).min(), 'log': log}
+        result.update({k: v for k, v in log.items() if k.endswith('_val_loss')})
+        return result
+
+    def _save_replica(self, i, name):
+        if self.trainer is None:
+            return
+        path = os.path.join(self.trainer.default_root_dir, f'trial_{i}')
+        os.makedirs(path, exist_ok=True)
+        replica = self.replicas[i]
+        torch.save({'epoch': self.current_epoch,
+                    'state_dict': replica.state_dict(),
+                    'hparams': vars(replica.hparams)}, os.path.join(path, name))
+
+    def configure_optimizers(self):
+        # a single optimizer: with one per replica lightning would set requires_grad on every param
+        # of the current optimizer each step, which unfreezes the replicas' frozen encoders
+        groups, schedulers = [], []
+        for i, replica in enumerate(self.replicas):
+            config = replica.configure_optimizers()
+            if isinstance(config, (list, tuple)) and len(config) == 2 and isinstance(config[0], (list, tuple)):
+                replica_optimizers, replica_schedulers = config
+            else:
+                replica_optimizers, replica_schedulers = [config], []
+
+            replica_optimizer = replica_optimizers[0]
+            groups.extend(replica_optimizer.param_groups)
+            for scheduler in replica_schedulers:
+                schedulers.append({'scheduler': scheduler, 'monitor': f'trial_{i}_val_loss'})
+
+        # the group dicts are shared with the replica optimizers (never stepped themselves), so a
+        # replica's scheduler changes the lr of its own groups in the optimizer that does step
+        optimizer = type(replica_optimizer)(groups, **replica_optimizer.defaults)
+        return [optimizer], schedulers
+
+    def prepare_data(self):
+        # replica 0 owns the datasets, the others never touch the data
+        self.replicas[0].prepare_data()
+
+    def train_dataloader(self):
+        return self.replicas[0].train_dataloader()
+
+    def val_dataloader(self):
+        return self.replicas[0].val_dataloader()
+
+
+def add_stacked_trials_args(parser):
+    parser.add_argument('--stack_learning_rates', default=None, type=str,
+                        help='comma separated, trains one replica per learning rate on shared batches')
+    return parser
@@ -0,0 +1,74 @@
+"""
+Successive halving over the opt_list grid of submit.py, on top of the local sweep runner
+
+Rung k trains every surviving trial up to min_epochs * eta^k epochs (capped at --max_epochs),
+then only the best 1 / eta by --sha_metric are promoted. Promoted trials resume from the
+checkpoint they wrote at the end of the previous rung, so no epoch is trained twice; the others
+are dropped. The scene split doesn't depend on the worker a trial lands in (helper.split_scenes),
+a resumed trial that reports other validation scenes than in its previous rung stops the search.
+
+python -m src.submit --model roadmap_bce --local_workers 4 --sha_min_epochs 1 --sha_eta 3 --max_epochs 27
+"""
+import os
+import copy
+import math
+
+from src.utils.local_sweep import trial_namespaces, run_trials, write_results
+
+
+def rung_budgets(min_epochs, max_epochs, eta):
+    budgets = []
+    budget = min_epochs
+    while budget < max_epochs:
+        budgets.append(budget)
+        budget *= eta
+    return budgets + [max_epochs]
+
+
+def run_successive_halving(hparams):
+    trials = trial_namespaces(hparams)
+    budgets = rung_budgets(hparams.sha_min_epochs, hparams.max_epochs, hparams.sha_eta)
+    sign = 1 if hparams.sha_mode == 'min' else -1
+
+    alive = list(range(len(trials)))
+    results, reached = {}, {}
+    for rung, budget in enumerate(budgets):
+        print(f'rung {rung}: {len(alive)} trials -> {budget} epochs')
+
+        rung_trials = {}
+        for i in alive:
+            trial = copy.copy(trials[i])
+            ckpt_path = os.path.join(hparams.logs_save_path, hparams.tt_name, f'trial_{i}', 'sha_last.ckpt')
+            trial.max_epochs = budget
+            trial.last_ckpt_path = ckpt_path
+            trial.resume_from_checkpoint = ckpt_path if rung > 0 else None
+            rung_trials[i] = trial
+
+        rung_results = run_trials(hparams, rung_trials)
+        for i, metrics in rung_results.items():
+            # a resumed trial validating on other scenes than it trained with would score on training data
+            if i in results and metrics['val_scenes'] != results[i]['val_scenes']:
+                raise ValueError(f"trial {i} validated on scenes {results[i]['val_scenes']} in rung {rung - 1} "
+                                 f"but on {metrics['val_scenes']} after resuming in rung {rung}")
+            results[i] = dict(metrics, rung=rung, epochs=budget)
+            reached[i] = rung
+
+        # failed trials or ones that never logged the metric are out
+        scored = [i for i in alive if hparams.sha_metric in rung_results.get(i, {})]
+        scored.sort(key=lambda i: sign * rung_results[i][hparams.sha_metric])
+        if rung + 1 < len(budgets):
+            alive = scored[:max(1, math.floor(len(scored) / hparams.sha_eta))]
+            dropped = sorted(set(scored) - set(alive))
+            print(f'rung {rung}: promoted {sorted(alive)}, stopped {dropped}')
+
+    write_results(hparams, trials, results)
+    return results
+
+
+def add_successive_halving_args(parser):
+    parser.add_argument('--sha_min_epochs', default=None, type=int,
+                        help='epoch budget of the first rung, enables successive halving in a local sweep')
+    parser.add_argument('--sha_eta', default=3, type=int, help='keep 1 / eta of the trials per rung')
+    parser.add_argument('--sha_metric', default='val_loss', type=str)
+    parser.add_argument('--sha_mode', default='min', type=str, choices=['min', 'max'])
+    return parser
@@ -0,0 +1,40 @@
+import os
+
+import pytest
+import torch
+import torch.distributed as dist
+
+from src.utils.cpu_ddp import CPUDataParallel
+
+
+class _PlateauModel(torch.nn.Module):
+
+    def __init__(self):
+        super().__init__()
+        self.fc = torch.nn.Linear(2, 1)
+
+    def configure_optimizers(self):
+        # like roadmap_bce_v2
+        optimizer = torch.optim.Adam(self.parameters(), lr=1.)
+        scheduler = torch.optim.lr_scheduler.ReduceLROnPlateau(optimizer, patience=0)
+        return [optimizer], [scheduler]
+
+
+@pytest.fixture
+def process_group():
+    os.environ['MASTER_ADDR'] = '127.0.0.1'
+    os.environ['MASTER_PORT'] = '29533'
+    dist.init_process_group('gloo', rank=0, world_size=1)
+    yield
+    dist.destroy_process_group()
+
+
+def test_plateau_scheduler_steps_on_val_loss(process_group):
+    runner = CPUDataParallel(_PlateauModel(), rank=0, world_size=1)
+    for val_loss in [1., 1., 1.]:
+        runner.step_schedulers({'val_loss': torch.tensor(val_loss), 'log': {}})
+
+    assert runner.optimizer.param_groups[0]['lr'] == pytest.approx(0.01)
+
+    with pytest.raises(KeyError):
+        runner.step_schedulers({'log': {}})
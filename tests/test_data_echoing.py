@@ -0,0 +1,57 @@
+import torch
+
+from src.utils.data_echoing import shuffle_within_batch, EchoingLoader
+from src.utils.helper import collate_fn, road_map_collate_fn
+
+
+def _labeled_items(batch_size, size=8):
+    # (sample, target, road_image) like LabeledDataset, every field tagged with the item's index
+    items = []
+    for i in range(batch_size):
+        sample = torch.full((6, 3, 4, 5), float(i))
+        target = {'bounding_box': torch.full((1, 2, 4), float(i)), 'category': torch.tensor([i])}
+        road_image = torch.zeros(size, size, dtype=torch.bool)
+        road_image[0, :i] = True
+        items.append((sample, target, road_image))
+    return items
+
+
+def _indices(batch):
+    sample, target, road_image = batch
+    return ([int(s[0, 0, 0, 0]) for s in sample],
+            [int(t['category'][0]) for t in target],
+            # first row of the map, [H, W] per sample or [1, H, W] once stacked
+            [int(r.reshape(-1, r.size(-1))[0].sum()) for r in road_image])
+
+
+def test_shuffle_keeps_stacked_road_maps_a_tensor():
+    batch = road_map_collate_fn(_labeled_items(4), size=(8, 8))
+    torch.manual_seed(0)
+    shuffled = shuffle_within_batch(batch)
+
+    sample, target, road_image = shuffled
+    assert isinstance(sample, tuple) and isinstance(target, tuple)
+    assert torch.is_tensor(road_image) and road_image.shape == (4, 1, 8, 8)
+
+    samples, targets, road_images = _indices(shuffled)
+    assert samples == targets == road_images
+    assert sorted(samples) == [0, 1, 2, 3]
+
+
+def test_shuffle_per_sample_tuples():
+    batch = collate_fn(_labeled_items(4))
+    shuffled = shuffle_within_batch(batch)
+
+    assert all(isinstance(field, tuple) for field in shuffled)
+    samples, targets, road_images = _indices(shuffled)
+    assert samples == targets == road_images
+    assert sorted(samples) == [0, 1, 2, 3]
+
+
+def test_echoing_loader_repeats_every_batch():
+    batches = [road_map_collate_fn(_labeled_items(3), size=(8, 8)) for _ in range(2)]
+    loader = EchoingLoader(batches, echo_factor=3)
+
+    echoed = list(loader)
+    assert len(echoed) == len(loader) == 6
+    assert all(torch.is_tensor(b[2]) and b[2].shape == (3, 1, 8, 8) for b in echoed)
@@ -0,0 +1,57 @@
+import threading
+from multiprocessing import Pipe
+
+import numpy as np
+import torch
+
+from src.utils.data_service import BatchService, training_split
+from src.utils.helper import split_scenes
+
+
+class _Samples:
+    scene_index = np.arange(2)
+
+    def __len__(self):
+        return 8
+
+    def __getitem__(self, i):
+        return torch.full((6, 3, 256, 306), float(i))
+
+
+def _connect(service, sid):
+    client, server = Pipe()
+    threading.Thread(target=service.serve, args=(server, sid), daemon=True).start()
+    return client
+
+
+def test_stats_client_is_no_subscriber():
+    service = BatchService(_Samples(), labeled=False, num_slots=4)
+    try:
+        threading.Thread(target=service.decode_forever, daemon=True).start()
+        stats = _connect(service, 0)
+        stats.send(('stats', None))
+        stats.recv()
+        assert not service.subscribers
+
+        trainer = _connect(service, 1)
+        for _ in range(3):
+            trainer.send(('next', 2))
+            assert len(trainer.recv()['slots']) == 2
+        # blocks only wait for the trainer, the idle stats connection doesn't hold the ring
+        assert list(service.subscribers) == [1]
+        assert all(block.pending <= {1} for block in service.blocks.values())
+
+        # the trainer holds block 2, so the decoder parks after block 3 and stops writing to the ring
+        with service.cond:
+            assert service.cond.wait_for(lambda: service.next_block == 4, timeout=30)
+    finally:
+        service.shm.close()
+        service.shm.unlink()
+
+
+def test_training_split_leaves_out_validation_scenes():
+    labeled, scene_index = training_split('roadmap_bce')
+    assert labeled and list(scene_index) == list(split_scenes(np.arange(106, 134))[0])
+
+    labeled, scene_index = training_split('basic_ae')
+    assert not labeled and not set(scene_index) & set(split_scenes(np.arange(106))[1])
@@ -0,0 +1,45 @@
+import torch
+from torch import nn
+
+from src.autoencoder.components_v2 import Encoder, Decoder
+from src.inference.fold_bn import fold_batchnorm, fold_bn_into, _random_bn_stats, BN_TYPES
+
+
+def _folded_pair(model):
+    torch.manual_seed(0)
+    model = _random_bn_stats(model).eval()
+    return model, fold_batchnorm(model)
+
+
+@torch.no_grad()
+def test_encoder_outputs_unchanged():
+    encoder, folded = _folded_pair(Encoder(32, 16, 3, 16, 24))
+    x = torch.rand(4, 3, 16, 24)
+
+    assert not any(isinstance(m, BN_TYPES) for m in folded.modules())
+    assert torch.allclose(encoder(x), folded(x), atol=1e-5)
+
+
+@torch.no_grad()
+def test_decoder_outputs_unchanged():
+    decoder, folded = _folded_pair(Decoder(32, 16, 3, 16, 24))
+    z = torch.rand(4, 16)
+
+    assert not any(isinstance(m, BN_TYPES) for m in folded.modules())
+    assert torch.allclose(decoder(z), folded(z), atol=1e-5)
+
+
+@torch.no_grad()
+def test_fold_layer_without_bias():
+    conv = nn.Conv2d(3, 8, kernel_size=3, bias=False)
+    bn = _random_bn_stats(nn.Sequential(nn.BatchNorm2d(8)))[0].eval()
+    x = torch.rand(2, 3, 10, 10)
+
+    assert torch.allclose(bn(conv(x)), fold_bn_into(conv, bn)(x), atol=1e-5)
+
+
+def test_folded_copy_leaves_model_alone():
+    encoder, folded = _folded_pair(Encoder(32, 16, 3, 16, 24))
+
+    assert isinstance(encoder.bn1, nn.BatchNorm2d) and encoder.fc1.drop_p == 0.2
+    assert folded.fc1.drop_p == 0. and not folded.training
@@ -0,0 +1,30 @@
+import numpy as np
+
+from src.utils.helper import split_scenes, held_out_scenes, parse_scenes
+
+
+def test_split_matches_seeded_global_shuffle():
+    # what prepare_data did before: seed the global rng at import, shuffle in place
+    labeled_scene_index = np.arange(106, 134)
+    np.random.seed(20200505)
+    np.random.shuffle(labeled_scene_index)
+
+    train, valid = split_scenes(np.arange(106, 134))
+    assert list(train) == list(labeled_scene_index[:22])
+    assert list(valid) == list(labeled_scene_index[22:])
+
+
+def test_split_ignores_global_rng_history():
+    first = split_scenes(np.arange(106, 134))
+    np.random.rand(100)
+    np.random.shuffle(np.arange(10))
+    second = split_scenes(np.arange(106, 134))
+
+    assert all((a == b).all() for a, b in zip(first, second))
+    assert not set(first[0]) & set(first[1])
+
+
+def test_held_out_scenes():
+    assert list(held_out_scenes()) == [106, 109, 115, 117, 124, 128]
+    assert list(parse_scenes('106-108')) == [106, 107, 108]
+    assert list(parse_scenes('106,109')) == [106, 109]